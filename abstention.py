@@ -98,7 +98,8 @@ def retrieval_strength(question: str, sources: List[RetrievedSource]) -> float:
 def semantic_retrieval_strength(
     question: str,
     sources: List[RetrievedSource],
-    embedder: Embedder,
+    embedder: Optional[Embedder],
+    query_vector: Optional[Sequence[float]] = None,
 ) -> float:
     """Variante SEMANTICA di `retrieval_strength` (Ciclo 2 — FASE 13).
 
@@ -113,26 +114,41 @@ def semantic_retrieval_strength(
     da 0.0), così la scala resta confrontabile con quella lessicale. Riusa
     l'embedder del vector store (nessuna nuova dipendenza). Fallback sicuro: con
     domanda/fonti vuote, embedder assente o in errore restituisce 0.0.
+
+    Ciclo 3 — FASE 1: i vettori già disponibili non vengono ricalcolati. Le fonti
+    con `embedding` (il vettore memorizzato in ChromaDB, propagato dal retrieval)
+    e la domanda con `query_vector` (calcolato dall'arm vettoriale) entrano nel
+    confronto così come sono; l'embedder è chiamato solo per ciò che manca, e non
+    è chiamato affatto se tutti i vettori sono presenti.
     """
-    if not (question or "").strip() or not sources or embedder is None:
+    if not (question or "").strip() or not sources:
         return 0.0
 
-    texts = [question] + [source.content for source in sources]
-    try:
-        vectors = embedder(texts)
-    except Exception as exc:  # embedder non disponibile o errore a runtime
-        logger.warning(
-            "Retrieval strength semantica non disponibile (%s): uso il solo lessicale.",
-            exc,
-        )
-        return 0.0
+    missing = [] if query_vector is not None else [question]
+    missing += [s.content for s in sources if s.embedding is None]
 
-    if not vectors or len(vectors) != len(texts):
+    if missing and embedder is None:
         return 0.0
 
-    query_vec = vectors[0]
+    computed: list = []
+    if missing:
+        try:
+            computed = embedder(missing)
+        except Exception as exc:  # embedder non disponibile o errore a runtime
+            logger.warning(
+                "Retrieval strength semantica non disponibile (%s): uso il solo lessicale.",
+                exc,
+            )
+            return 0.0
+
+        if not computed or len(computed) != len(missing):
+            return 0.0
+
+    fresh = iter(computed)
+    query_vec = query_vector if query_vector is not None else next(fresh)
     best = 0.0
-    for vec in vectors[1:]:
+    for source in sources:
+        vec = source.embedding if source.embedding is not None else next(fresh)
         sim = cosine_similarity(query_vec, vec)
         if sim > best:
             best = sim
@@ -157,6 +173,7 @@ def classify_llm_abstention(
     ood_max_strength: float,
     embedder: Optional[Embedder] = None,
     semantic_ood_max_strength: Optional[float] = None,
+    query_vector: Optional[Sequence[float]] = None,
 ) -> str:
     """Classifica un'astensione prodotta dal modello in presenza (o meno) di fonti.
 
@@ -168,11 +185,15 @@ def classify_llm_abstention(
     `semantic_retrieval_strength` (similarità di embedding query↔fonte) e una
     soglia **ricalibrata** `semantic_ood_max_strength` — più robusta verso le
     parafrasi. Se la soglia semantica non è fornita, ricade su `ood_max_strength`.
+    `query_vector` (Ciclo 3 — FASE 1) è il vettore della domanda già calcolato
+    dal retrieval, se disponibile.
     """
     if not sources:
         return WEAK_RETRIEVAL
     if embedder is not None:
-        strength = semantic_retrieval_strength(question, sources, embedder)
+        strength = semantic_retrieval_strength(
+            question, sources, embedder, query_vector=query_vector
+        )
         threshold = (
             ood_max_strength
             if semantic_ood_max_strength is None
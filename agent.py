@@ -1,6 +1,6 @@
 import logging
 import os
-from typing import Any, List, Optional
+from typing import Any, Callable, List, Optional
 
 import langchain
 import redis
@@ -28,6 +28,7 @@ from config import (
     ABSTENTION_OOD_SEMANTIC_MAX_STRENGTH,
     ABSTENTION_SEMANTIC_STRENGTH_ENABLED,
     ANSWER_STYLE_GUIDE,
+    DEFAULT_K_RETRIEVAL,
     CITATION_GROUNDING_ENABLED,
     CITATION_GROUNDING_MIN_RATIO,
     CITATION_GROUNDING_SEMANTIC_ENABLED,
@@ -42,16 +43,25 @@ from config import (
     EVIDENCE_MAX_SENTENCES,
     EVIDENCE_MIN_SENTENCES,
     EVIDENCE_SELECTION_ENABLED,
+    LLM_PRIORITY,
+    LLM_PRIORITY_WEIGHTS,
     MAX_CONTEXT_DOCUMENTS,
     QA_PROMPT,
     RERANKER_ENABLED,
     RERANKER_MODEL_NAME,
+    RERANKER_CASCADE_ENABLED,
+    RERANKER_CASCADE_MARGIN,
     RERANKER_TOP_N,
+    RETRIEVAL_PREFILTER_ENABLED,
     SEMANTIC_INTENT_COURSE_MIN_SIMILARITY,
     SEMANTIC_INTENT_ENABLED,
     SEMANTIC_INTENT_TOPIC_MIN_SIMILARITY,
+    TWO_STAGE_RETRIEVAL_ENABLED,
+    VARIANT_CACHE_ENABLED,
+    WARMUP_ENABLED,
 )
 from confidence import estimate_confidence
+from document_index import load_index_document_index
 from evidence import select_passage
 from intent import (
     asks_borsa_graduatoria,
@@ -60,6 +70,7 @@ from intent import (
     infer_query_intent,
 )
 from knowledge import l19_test_table_markdown, tolc_bands_table
+from llm_dispatcher import get_dispatcher, ollama_client_options
 from neural_reranker import CrossEncoderReranker
 from semantic_intent import SemanticIntentClassifier
 from rag_types import (  # re-export: mantiene `from agent import QueryIntent, ...`
@@ -69,10 +80,17 @@ from rag_types import (  # re-export: mantiene `from agent import QueryIntent, .
     RagTrace,
     RetrievedSource,
 )
-from reranking import filter_documents_by_course, rerank_documents
-from retrieval import build_bm25_index, hybrid_retrieve
+from reranking import (
+    filter_documents_by_course,
+    heuristic_margin,
+    needs_cross_encoder,
+    rerank_within_budget,
+)
+from retrieval import CHUNK_ID_KEY, EMBEDDING_KEY, build_bm25_index, hybrid_retrieve
 from rules_tolc import classify_tolc_score, extract_tolc_score
 from tools import prova_calcolo_sicuro
+from variant_cache import load_index_variant_cache
+from warmup import start_warmup
 
 
 logger = logging.getLogger(__name__)
@@ -140,6 +158,33 @@ def has_general_tesi_regulation(sources: List[RetrievedSource]) -> bool:
     )
 
 
+def distinct_documents(docs: list) -> list:
+    """Documenti che restano dopo la deduplica delle fonti, nello stesso ordine.
+
+    Ciclo 3 — FASE 7: stesse chiavi di `UniLawResponder._prepare_sources` (file e
+    pagina; file e inizio del testo), così la cascata misura il confine fra i
+    documenti che riempiono davvero il contesto.
+    """
+    distinct = []
+    seen_pages = set()
+    seen_content = set()
+    for doc in docs:
+        metadata = doc.metadata or {}
+        filename = metadata.get("filename") or os.path.basename(
+            metadata.get("source", "Documento sconosciuto")
+        )
+        page_key = (filename, metadata.get("page", None))
+        # Sul testo, non sull'ID del chunk: l'ID include la pagina (FASE 15), e la
+        # stessa intestazione ripetuta su più pagine entra nel contesto una volta.
+        content_key = (filename, " ".join(doc.page_content.strip().split())[:250])
+        if page_key in seen_pages or content_key in seen_content:
+            continue
+        seen_pages.add(page_key)
+        seen_content.add(content_key)
+        distinct.append(doc)
+    return distinct
+
+
 class UniLawResponder:
     def __init__(
         self,
@@ -153,10 +198,24 @@ class UniLawResponder:
         use_semantic_grounding: bool | None = None,
         use_semantic_abstention: bool | None = None,
         use_general_tesi_hint: bool | None = None,
+        use_retrieval_prefilter: bool | None = None,
+        use_variant_cache: bool | None = None,
+        use_reranker_cascade: bool | None = None,
+        use_two_stage: bool | None = None,
+        llm_priority: str | None = None,
     ):
         self.vector_db = vector_db
         self.use_bm25 = use_bm25
 
+        # Pre-filtro per corso dentro la query di retrieval (Ciclo 3 — FASE 2,
+        # default OFF): i k slot per variante non vengono spesi su chunk di altri
+        # corsi che il filtro a valle scarterebbe comunque.
+        self.use_retrieval_prefilter = (
+            RETRIEVAL_PREFILTER_ENABLED
+            if use_retrieval_prefilter is None
+            else use_retrieval_prefilter
+        )
+
         # Mitigazione q14 (FASE 14, default ON): su una domanda di consultabilità
         # della tesi con un regolamento GENERALE fra le fonti, il profilo di risposta
         # autorizza l'uso della regola generale (riduce la falsa astensione). Toggle
@@ -187,6 +246,11 @@ class UniLawResponder:
             RERANKER_ENABLED if use_neural_reranker is None else use_neural_reranker
         )
         self.neural_reranker = CrossEncoderReranker(RERANKER_MODEL_NAME)
+        # Cascata (Ciclo 3 — FASE 7, default OFF): cross-encoder solo quando
+        # l'ordinamento euristico è incerto al confine del contesto.
+        self.use_reranker_cascade = (
+            RERANKER_CASCADE_ENABLED if use_reranker_cascade is None else use_reranker_cascade
+        )
 
         # Intent detection semantica opzionale (FASE 11, default OFF). Quando è attiva
         # affianca le keyword; riusa il modello di embedding già caricato nel vector
@@ -235,13 +299,55 @@ class UniLawResponder:
         # restano validi).
         self.bm25_index = build_bm25_index(vector_db)
 
+        # Risultati precalcolati delle varianti di query costanti (Ciclo 3 — FASE 4,
+        # default ON): letti da disco o calcolati una volta al caricamento dell'indice,
+        # così a ogni domanda interrogano il vector store solo le varianti che
+        # contengono la domanda. None senza vector store (test) o se disattivata.
+        # Con il retrieval a due stadi (sotto) la cache non si usa: i suoi risultati
+        # sono quelli della ricerca su tutti i chunk.
+        self.use_two_stage = (
+            TWO_STAGE_RETRIEVAL_ENABLED if use_two_stage is None else use_two_stage
+        )
+        self.use_variant_cache = (
+            VARIANT_CACHE_ENABLED if use_variant_cache is None else use_variant_cache
+        )
+        self.variant_cache = (
+            load_index_variant_cache(vector_db, DEFAULT_K_RETRIEVAL, self.use_retrieval_prefilter)
+            if self.use_variant_cache and not self.use_two_stage and vector_db is not None
+            else None
+        )
+
+        # Retrieval a due stadi (Ciclo 3 — FASE 14, default OFF): l'indice dei
+        # documenti sceglie i PDF più vicini a ogni variante e l'MMR cerca solo fra
+        # i loro chunk. Letto da disco o ricavato dai vettori del vector store; None
+        # se disattivato o non disponibile (ricerca su tutti i chunk, come prima).
+        self.document_index = (
+            load_index_document_index(vector_db) if self.use_two_stage else None
+        )
+
+        # Dispatcher delle chiamate al modello (Ciclo 3 — FASE 25): ogni generazione
+        # attende un posto nella classe `llm_priority` (default LLM_PRIORITY); i job in
+        # background usano `batch`. `llm_client` distingue i client dentro la classe.
+        self.llm_priority = llm_priority or LLM_PRIORITY
+        if self.llm_priority not in LLM_PRIORITY_WEIGHTS:
+            raise ValueError(f"classe di priorità sconosciuta: {self.llm_priority!r}")
+        self.llm_client = ""
+        self.llm_dispatcher = get_dispatcher()
+
         self.llm = ChatOllama(
             model=DEFAULT_MODEL_NAME,
             temperature=DEFAULT_TEMPERATURE,
             num_ctx=DEFAULT_NUM_CTX,
+            **ollama_client_options(self.llm_priority, f"pid-{os.getpid()}"),
         )
 
         self.last_trace = RagTrace()
+        # Vettori delle varianti di query calcolati dall'arm vettoriale durante
+        # l'ultima risposta (Ciclo 3 — FASE 1): riusati dall'astensione semantica.
+        self._last_query_vectors: dict = {}
+        # Riscaldamento in background (Ciclo 3 — FASE 8): valorizzato da
+        # `warmup.start_warmup`, None se non avviato.
+        self.warmup = None
 
     def answer(
         self,
@@ -250,9 +356,14 @@ class UniLawResponder:
         memory: dict[str, Any] | None = None,
         show_interpretation: bool = True,
         show_confidence: bool = True,
+        on_token: Callable[[str], None] | None = None,
     ) -> str:
+        # Ciclo 3 — FASE 24: con `on_token` la generazione è in streaming e ogni
+        # frammento del modello viene passato alla callback man mano che arriva (prima
+        # della normalizzazione delle citazioni); il valore restituito è invariato.
         question = (question or "").strip()
         self.last_trace = RagTrace(question=question)
+        self._last_query_vectors = {}
 
         if not question:
             return "Inserisci una domanda."
@@ -324,6 +435,7 @@ class UniLawResponder:
             )
 
         self.last_trace.selected_sources = [s.citation_label for s in sources]
+        self.last_trace.selected_chunk_ids = [s.chunk_id for s in sources if s.chunk_id]
 
         confidence, reason = self._estimate_confidence(intent, sources)
         self.last_trace.confidence = confidence
@@ -369,8 +481,7 @@ class UniLawResponder:
         )
 
         try:
-            llm_response = self.llm.invoke(prompt)
-            raw_answer = getattr(llm_response, "content", str(llm_response)).strip()
+            raw_answer = self._generate(prompt, on_token)
 
         except Exception as exc:
             return self._format_ollama_error(exc)
@@ -426,12 +537,15 @@ class UniLawResponder:
             # (fuori dominio vs evidenza insufficiente) è decisa sulla forza
             # SEMANTICA query↔fonte (soglia ricalibrata); con None (default) sulla
             # forza lessicale (soglia 0,37), byte-identica al comportamento storico.
+            # Ciclo 3 — FASE 1: domanda e fonti arrivano già vettorializzate dal
+            # retrieval, quindi l'embedder viene chiamato solo per ciò che manca.
             reason = classify_llm_abstention(
                 question,
                 sources,
                 ABSTENTION_OOD_MAX_STRENGTH,
                 embedder=self.semantic_abstention_embedder,
                 semantic_ood_max_strength=ABSTENTION_OOD_SEMANTIC_MAX_STRENGTH,
+                query_vector=self._last_query_vectors.get(question),
             )
             self.last_trace.abstention_reason = reason
             abstention_note = format_reason(reason)
@@ -453,6 +567,38 @@ class UniLawResponder:
 
         return final_answer
 
+    def _generate(self, prompt: str, on_token: Callable[[str], None] | None = None) -> str:
+        """
+        Chiama il modello dopo aver ottenuto un posto dal dispatcher (Ciclo 3 — FASE 25).
+
+        Il posto resta occupato per tutta la generazione, streaming compreso. Nel trace
+        finiscono la classe e l'attesa in coda: quella del dispatcher del processo più
+        quella del gateway, se la risposta di Ollama ne riporta una (`unilaw_queue`).
+        """
+        with self.llm_dispatcher.slot(self.llm_priority, self.llm_client) as waited:
+            self.last_trace.llm_priority = self.llm_priority
+            self.last_trace.llm_queue_wait_ms = round(waited * 1000, 1)
+            if on_token is None:
+                llm_response = self.llm.invoke(prompt)
+                text = getattr(llm_response, "content", str(llm_response))
+                metadata = getattr(llm_response, "response_metadata", None) or {}
+            else:
+                parts, metadata = [], {}
+                for chunk in self.llm.stream(prompt):
+                    piece = getattr(chunk, "content", str(chunk))
+                    metadata = getattr(chunk, "response_metadata", None) or metadata
+                    if piece:
+                        parts.append(piece)
+                        on_token(piece)
+                text = "".join(parts)
+
+        gateway = metadata.get("unilaw_queue") if isinstance(metadata, dict) else None
+        if isinstance(gateway, dict):
+            self.last_trace.llm_queue_wait_ms = round(
+                self.last_trace.llm_queue_wait_ms + float(gateway.get("wait_ms") or 0), 1
+            )
+        return text.strip()
+
     def update_memory_from_trace(self, memory: dict[str, Any] | None = None) -> dict[str, Any]:
         """
         Aggiorna una memoria a slot, evitando di salvare tutta la conversazione.
@@ -649,15 +795,45 @@ class UniLawResponder:
             intent,
             self.last_trace,
             use_bm25=self.use_bm25,
+            query_vectors=self._last_query_vectors,
+            prefilter=self.use_retrieval_prefilter,
+            variant_cache=self.variant_cache,
+            document_index=self.document_index,
+        )
+        # Ciclo 3 — FASE 5: reranking sui soli primi candidati della fusione
+        # (budget da config; senza budget identico a `rerank_documents`).
+        heuristic_scores: list = []
+        docs = rerank_within_budget(
+            question, docs, intent, self.last_trace, scores_out=heuristic_scores
         )
-        docs = rerank_documents(question, docs, intent, self.last_trace)
+        score_by_doc = {id(doc): score for doc, score in zip(docs, heuristic_scores)}
         docs = filter_documents_by_course(docs, intent)
 
+        # Ciclo 3 — FASE 7: in cascata il cross-encoder si invoca solo se il
+        # distacco euristico al confine del contesto è sotto soglia. Il confine è
+        # quello dopo la deduplica delle fonti; senza modello la cascata non decide.
+        cascade_note = ""
+        if self.use_neural_reranker and self.use_reranker_cascade and self.neural_reranker.available():
+            distinct = distinct_documents(docs)
+            scores = [score_by_doc.get(id(doc), 0) for doc in distinct]
+            margin = heuristic_margin(scores)
+            if not needs_cross_encoder(scores):
+                self.last_trace.reranker = (
+                    f"euristico (cascata: margine {margin:g} ≥ {RERANKER_CASCADE_MARGIN}, "
+                    "cross-encoder non invocato)"
+                )
+                return distinct[:MAX_CONTEXT_DOCUMENTS]
+            cascade_note = f"cascata: margine {margin:g} < {RERANKER_CASCADE_MARGIN}; "
+
         # FASE 4: reranking neurale opzionale sui top-N candidati già filtrati.
         # Se disattivato o non disponibile, resta l'ordinamento euristico.
         if self.use_neural_reranker and self.neural_reranker.available():
             docs = self.neural_reranker.rerank(question, docs, RERANKER_TOP_N)
-            self.last_trace.reranker = "euristico + cross-encoder"
+            self.last_trace.reranker = "euristico + cross-encoder ({note}punteggi in cache: {hits}/{n})".format(
+                note=cascade_note,
+                hits=self.neural_reranker.last_cache_hits,
+                n=min(len(docs), RERANKER_TOP_N),
+            )
         elif self.use_neural_reranker:
             self.last_trace.reranker = "euristico (reranker neurale non disponibile)"
         else:
@@ -667,10 +843,8 @@ class UniLawResponder:
 
     def _prepare_sources(self, docs: list) -> List[RetrievedSource]:
         prepared = []
-        seen_pages = set()
-        seen_content = set()
 
-        for doc in docs:
+        for doc in distinct_documents(docs):
             metadata = doc.metadata or {}
 
             filename = metadata.get("filename") or os.path.basename(
@@ -682,18 +856,6 @@ class UniLawResponder:
             doc_type = metadata.get("doc_type", "altro")
             content = " ".join(doc.page_content.strip().split())
 
-            page_key = (filename, page)
-            content_key = (filename, content[:250])
-
-            if page_key in seen_pages:
-                continue
-
-            if content_key in seen_content:
-                continue
-
-            seen_pages.add(page_key)
-            seen_content.add(content_key)
-
             prepared.append(
                 RetrievedSource(
                     index=len(prepared) + 1,
@@ -702,6 +864,8 @@ class UniLawResponder:
                     content=content,
                     course_tag=course_tag,
                     doc_type=doc_type,
+                    chunk_id=metadata.get(CHUNK_ID_KEY),
+                    embedding=metadata.get(EMBEDDING_KEY),
                 )
             )
 
@@ -1657,6 +1821,15 @@ class UniLawResponder:
         return format_sources_block(answer, sources, abstaining=abstaining)
 
 
-@st.cache_resource(show_spinner=False)
-def get_cached_responder(_vector_db):
-    return UniLawResponder(_vector_db)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_cached_responder(_vector_db, generation: str | None = None):
+    # Ciclo 3 — FASE 16: `_vector_db` non entra nella chiave della cache, la
+    # generazione dell'indice sì: dopo un rebuild nasce un responder sul nuovo indice.
+    # `max_entries=2`: la generazione attiva più la precedente, per le sessioni
+    # ancora aperte durante il passaggio; le più vecchie escono dalla cache.
+    responder = UniLawResponder(_vector_db)
+    # Ciclo 3 — FASE 8: modelli abilitati riscaldati in background, così la prima
+    # domanda dopo il riavvio non paga i caricamenti pigri.
+    if WARMUP_ENABLED and _vector_db is not None:
+        start_warmup(responder)
+    return responder
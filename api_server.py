@@ -0,0 +1,415 @@
+"""API HTTP di UniLaw Agent con coda limitata e controllo di ammissione (Ciclo 3 — FASE 24).
+
+L'unico modo di interrogare il sistema era la UI Streamlit, che non si può
+mettere dietro un bilanciatore né chiamare dal portale studenti. Questo servizio
+(solo libreria standard: `http.server`) espone:
+
+- `POST /answer` — `{"question": ..., "memory": {...}, "stream": false}` →
+  `{"answer", "trace", "memory", "queue_wait_s"}`. Con `"stream": true` la
+  risposta è NDJSON: una riga `{"token": ...}` per frammento generato dal
+  modello, poi una riga finale con gli stessi campi della risposta sincrona
+  (il testo finale, con citazioni normalizzate e blocco fonti, è quello della
+  riga finale). `show_interpretation` e `show_confidence` (default false)
+  aggiungono i blocchi della UI; le stesse informazioni sono nel `trace`.
+- `POST /retrieve` — `{"question": ..., "memory": {...}}` → fonti selezionate e
+  trace, senza chiamare il modello.
+- `GET /health` — stato del worker, generazione dell'indice, code.
+
+Tutte le richieste condividono un solo `UniLawResponder` riscaldato: ogni
+richiesta ne usa una copia superficiale, che ha trace propri e condivide indice,
+BM25 e modelli (il reranker neurale protegge la sua cache con un lock).
+Le risposte passano da `AdmissionControl`: `API_LLM_SLOTS` posti in esecuzione
+(quanti Ollama ne genera in parallelo) e `API_QUEUE_SIZE` in attesa; oltre, o
+oltre `API_CLIENT_MAX_INFLIGHT` richieste dello stesso client (`X-Client-Id`,
+altrimenti l'indirizzo), la risposta è 429 con `Retry-After`, invece di accodare
+lavoro che Ollama non smaltirebbe. Il retrieval occupa solo la CPU: ha un
+controllo di ammissione suo, con `API_RETRIEVE_SLOTS` posti, e non attende le
+generazioni del modello.
+
+Con `--workers N` il servizio gira sul server preload-then-fork della FASE 23:
+i worker accettano connessioni dallo stesso socket e i posti di esecuzione e di
+coda sono condivisi fra i processi; il limite per client vale per worker.
+
+Uso:
+    python api_server.py                       # UNILAW_WORKERS worker
+    python api_server.py --workers 0 --port 8080   # processo unico
+"""
+
+import copy
+import json
+import logging
+import math
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    API_CLIENT_MAX_INFLIGHT,
+    API_HOST,
+    API_LLM_SLOTS,
+    API_PORT,
+    API_QUEUE_SIZE,
+    API_RETRIEVE_SLOTS,
+    SERVER_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 64 * 1024
+MAX_QUESTION_CHARS = 2000
+# Stime prudenti della durata di una risposta generata e di un retrieval, per il Retry-After.
+ANSWER_ESTIMATE_S = 10
+RETRIEVE_ESTIMATE_S = 1
+
+
+class Rejected(Exception):
+    """Richiesta non ammessa: coda piena o troppe richieste dello stesso client."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class AdmissionControl:
+    """Posti di esecuzione e di attesa per un tipo di richiesta (risposte o retrieval).
+
+    Semaforo e contatori sono primitive di `multiprocessing`: creati prima del
+    `fork`, valgono per tutti i worker. Il conteggio per client è del processo.
+    """
+
+    def __init__(
+        self,
+        slots: int = API_LLM_SLOTS,
+        queue_size: int = API_QUEUE_SIZE,
+        per_client: int = API_CLIENT_MAX_INFLIGHT,
+        estimate_s: float = ANSWER_ESTIMATE_S,
+    ):
+        self.slots = max(1, slots)
+        self.estimate_s = estimate_s
+        self.queue_size = max(0, queue_size)
+        self.per_client = max(1, per_client)
+        self._semaphore = multiprocessing.BoundedSemaphore(self.slots)
+        self._admitted = multiprocessing.Value("i", 0)
+        self._waiting = multiprocessing.Value("i", 0)
+        self._clients: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def admit(self, client: str):
+        """Ammette la richiesta o solleva `Rejected`; restituisce i secondi di attesa in coda."""
+        with self._lock:
+            if self._clients.get(client, 0) >= self.per_client:
+                raise Rejected("troppe richieste in corso per questo client", retry_after=1)
+            with self._admitted.get_lock():
+                if self._admitted.value >= self.slots + self.queue_size:
+                    waves = math.ceil((self._admitted.value + 1) / self.slots)
+                    raise Rejected("coda piena", retry_after=math.ceil(waves * self.estimate_s))
+                self._admitted.value += 1
+            self._clients[client] = self._clients.get(client, 0) + 1
+
+        t0 = time.perf_counter()
+        with self._waiting.get_lock():
+            self._waiting.value += 1
+        acquired = False
+        try:
+            self._semaphore.acquire()
+            acquired = True
+            with self._waiting.get_lock():
+                self._waiting.value -= 1
+            yield time.perf_counter() - t0
+        finally:
+            if acquired:
+                self._semaphore.release()
+            else:
+                with self._waiting.get_lock():
+                    self._waiting.value -= 1
+            with self._admitted.get_lock():
+                self._admitted.value -= 1
+            with self._lock:
+                self._clients[client] -= 1
+                if not self._clients[client]:
+                    del self._clients[client]
+
+    def stats(self) -> dict:
+        admitted, waiting = self._admitted.value, self._waiting.value
+        return {
+            "slots": self.slots,
+            "queue_size": self.queue_size,
+            "running": admitted - waiting,
+            "waiting": waiting,
+        }
+
+
+class UniLawAPI:
+    """Logica delle rotte, indipendente dal trasporto HTTP."""
+
+    def __init__(
+        self,
+        responder,
+        admission: AdmissionControl | None = None,
+        retrieval_admission: AdmissionControl | None = None,
+    ):
+        from index_generations import generation_number
+
+        self.responder = responder
+        self.admission = admission or AdmissionControl()
+        self.retrieval_admission = retrieval_admission or retrieval_admission_control()
+        self.generation = generation_number()
+        self.started_at = time.time()
+
+    def answer(self, payload: dict, client: str, on_token=None) -> dict:
+        from trace_export import trace_to_dict
+
+        question, memory = _parse_question(payload)
+        with self.admission.admit(client) as queue_wait:
+            responder = copy.copy(self.responder)
+            responder.llm_client = client  # Ciclo 3 — FASE 25: turni fra client nel dispatcher
+            answer = responder.answer(
+                question,
+                memory=memory,
+                show_interpretation=bool(payload.get("show_interpretation", False)),
+                show_confidence=bool(payload.get("show_confidence", False)),
+                on_token=on_token,
+            )
+        return {
+            "answer": answer,
+            "trace": trace_to_dict(responder.last_trace),
+            "memory": responder.update_memory_from_trace(memory),
+            "queue_wait_s": round(queue_wait, 3),
+        }
+
+    def retrieve(self, payload: dict, client: str) -> dict:
+        from rag_types import RagTrace
+        from trace_export import trace_to_dict
+
+        question, memory = _parse_question(payload)
+        # Embedding, ricerca e cross-encoder occupano la CPU ma non il modello:
+        # posti propri, senza attendere le generazioni di `answer`.
+        with self.retrieval_admission.admit(client):
+            responder = copy.copy(self.responder)
+            responder.last_trace = RagTrace(question=question)
+            responder._last_query_vectors = {}
+            intent = responder._infer_query_intent(question, memory)
+            responder.last_trace.course_tag = intent.course_tag
+            responder.last_trace.topic = intent.topic
+            sources = responder._prepare_sources(responder._retrieve_documents(question, intent))
+            responder.last_trace.selected_sources = [s.citation_label for s in sources]
+        return {
+            "sources": [
+                {
+                    "label": s.citation_label,
+                    "filename": s.filename,
+                    "page": s.page,
+                    "course_tag": s.course_tag,
+                    "doc_type": s.doc_type,
+                    "chunk_id": s.chunk_id,
+                    "content": s.content,
+                }
+                for s in sources
+            ],
+            "trace": trace_to_dict(responder.last_trace),
+        }
+
+    def health(self) -> dict:
+        from index_generations import generation_number
+
+        warmup = getattr(self.responder, "warmup", None)
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "index_generation": self.generation,
+            "published_generation": generation_number(),
+            "warmup": warmup.status() if warmup is not None else None,
+            "admission": self.admission.stats(),
+            "retrieval_admission": self.retrieval_admission.stats(),
+            "llm": self.responder.llm_dispatcher.stats(),
+        }
+
+
+def retrieval_admission_control() -> AdmissionControl:
+    """Controllo di ammissione di `/retrieve`: un posto per core, non per generazione."""
+    return AdmissionControl(slots=API_RETRIEVE_SLOTS, estimate_s=RETRIEVE_ESTIMATE_S)
+
+
+def _parse_question(payload: dict) -> tuple[str, dict]:
+    if not isinstance(payload, dict):
+        raise BadRequest("il corpo deve essere un oggetto JSON")
+    question = payload.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise BadRequest("campo 'question' mancante o vuoto")
+    if len(question) > MAX_QUESTION_CHARS:
+        raise BadRequest(f"domanda oltre {MAX_QUESTION_CHARS} caratteri")
+    memory = payload.get("memory") or {}
+    if not isinstance(memory, dict):
+        raise BadRequest("il campo 'memory' deve essere un oggetto")
+    return question.strip(), memory
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "UniLawAPI/1.0"
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/health":
+            self._send_json(200, self.server.api.health())
+        else:
+            self._send_json(404, {"error": "rotta sconosciuta"})
+
+    def do_POST(self):
+        route = self.path.split("?")[0]
+        if route not in ("/answer", "/retrieve"):
+            self._send_json(404, {"error": "rotta sconosciuta"})
+            return
+        try:
+            payload = self._read_json()
+            if route == "/retrieve":
+                self._send_json(200, self.server.api.retrieve(payload, self._client()))
+            elif payload.get("stream"):
+                self._stream_answer(payload)
+            else:
+                self._send_json(200, self.server.api.answer(payload, self._client()))
+        except BadRequest as exc:
+            self._send_json(400, {"error": str(exc)})
+        except Rejected as exc:
+            self._send_json(429, {"error": exc.reason}, {"Retry-After": str(exc.retry_after)})
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnesso durante la risposta")
+        except Exception:
+            logger.exception("Errore nella richiesta %s", route)
+            self._send_json(500, {"error": "errore interno"})
+
+    def _stream_answer(self, payload: dict) -> None:
+        started = False
+
+        def write(event: dict) -> None:
+            nonlocal started
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                started = True
+            self.wfile.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+        # Le intestazioni partono al primo frammento, o con la riga finale: un 429
+        # o un 400 arrivano quindi ancora come risposte normali.
+        try:
+            result = self.server.api.answer(payload, self._client(), on_token=lambda text: write({"token": text}))
+        except (BadRequest, Rejected):
+            raise
+        except Exception:
+            if not started:
+                raise
+            logger.exception("Errore durante la risposta in streaming")
+            result = {"error": "errore interno"}
+        write(result)
+        self.close_connection = True
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise BadRequest(f"corpo oltre {MAX_BODY_BYTES} byte")
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as exc:
+            raise BadRequest(f"JSON non valido: {exc}") from None
+        if not isinstance(payload, dict):
+            raise BadRequest("il corpo deve essere un oggetto JSON")
+        return payload
+
+    def _client(self) -> str:
+        return self.headers.get("X-Client-Id") or self.client_address[0]
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class APIServer(ThreadingHTTPServer):
+    """Server HTTP a thread; con `sock` usa un socket già in ascolto (worker di FASE 23)."""
+
+    daemon_threads = True
+
+    def __init__(self, api: UniLawAPI, address=(API_HOST, API_PORT), sock: socket.socket | None = None):
+        super().__init__(address, _Handler, bind_and_activate=sock is None)
+        if sock is not None:
+            self.socket.close()
+            self.socket = sock
+            self.server_address = sock.getsockname()
+        self.api = api
+
+
+def serve_worker(
+    responder,
+    index: int,
+    sock: socket.socket,
+    admission: AdmissionControl,
+    retrieval_admission: AdmissionControl | None = None,
+) -> None:
+    """Corpo di un worker del server preload-then-fork."""
+    # Socket non bloccante: quando un altro worker accetta la connessione per
+    # primo, `accept` qui fallisce subito invece di restare bloccato.
+    sock.setblocking(False)
+    server = APIServer(UniLawAPI(responder, admission, retrieval_admission), sock=sock)
+    logger.info("Worker %d in ascolto su %s:%d", index, *server.server_address[:2])
+    server.serve_forever()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="API HTTP di UniLaw Agent")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="0: processo unico, senza fork")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    from prefork import PreforkServer, preload_state
+
+    admission, retrieval_admission = AdmissionControl(), retrieval_admission_control()
+    if args.workers <= 0:
+        server = APIServer(UniLawAPI(preload_state(), admission, retrieval_admission), (args.host, args.port))
+        logger.info("API in ascolto su http://%s:%d", *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    sock = socket.create_server((args.host, args.port), backlog=128)
+    prefork = PreforkServer(
+        preload_state,
+        lambda responder, index: serve_worker(responder, index, sock, admission, retrieval_admission),
+        workers=args.workers,
+    ).start()
+    logger.info("API in ascolto su http://%s:%d con %d worker", args.host, args.port, args.workers)
+    try:
+        prefork.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        prefork.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,13 @@ from config import (
     DEFAULT_MODEL_NAME,
     DOCUMENTS_FOLDER,
     EVIDENCE_SELECTION_ENABLED,
+    INDEX_READ_ONLY,
     RERANKER_ENABLED,
     setup_environment,
 )
-from database import calcola_firma_documenti, inizializza_conoscenza
+from database import avvia_ricostruzione, calcola_firma_documenti, inizializza_conoscenza
+from index_generations import current_generation, rebuild_in_progress, touch_reader_lease
+from model_registry import describe_memory
 
 
 # ============================================================
@@ -72,13 +75,25 @@ docs_signature = calcola_firma_documenti()
 documents = docs_signature.get("documents", [])
 documents_count = len(documents)
 
+# Ciclo 3 — FASE 16: la generazione attiva dell'indice è parte della chiave delle
+# cache: quando un rebuild in background la pubblica, il rerun successivo apre
+# il nuovo indice senza interrompere le sessioni.
+index_generation = current_generation()
+if INDEX_READ_ONLY:  # Ciclo 3 — FASE 22: la generazione in uso non va cancellata
+    touch_reader_lease(index_generation)
 vector_db, msg = inizializza_conoscenza(
     docs_signature=docs_signature,
     force_rebuild=st.session_state.force_rebuild,
+    generation=index_generation,
 )
 
 st.session_state.force_rebuild = False
 
+# Ciclo 3 — FASE 8: il responder (e il suo warm-up in background) nasce con la
+# knowledge base, non alla prima domanda.
+if vector_db:
+    get_cached_responder(vector_db, index_generation)
+
 
 # ============================================================
 # Small UI helpers
@@ -188,6 +203,8 @@ def render_trace(trace, title="TRACE // LAST RETRIEVAL"):
         st.markdown(f"- Evidence: `{getattr(trace, 'evidence_chars', '') or 'n.d.'}`")
         st.markdown(f"- Grounding citazioni: `{getattr(trace, 'grounding', 'n.d.')}`")
         st.markdown(f"- Astensione: `{getattr(trace, 'abstention_reason', '') or 'nessuna'}`")
+        if getattr(trace, "llm_queue_wait_ms", None) is not None:
+            st.markdown(f"- Coda modello: `{trace.llm_priority}`, attesa {trace.llm_queue_wait_ms:.0f} ms")
         fusion_scores = getattr(trace, "fusion_scores", None)
         if fusion_scores:
             for line in fusion_scores:
@@ -362,6 +379,15 @@ with st.sidebar:
         ),
     )
 
+    warmup = get_cached_responder(vector_db, index_generation).warmup if vector_db else None
+    if warmup is not None:
+        st.caption(f"Warm-up modelli: {warmup.status()}")
+        st.caption(f"Memoria: {describe_memory()}")
+
+    rebuild = rebuild_in_progress()
+    if rebuild is not None:
+        st.caption(f"Rebuild indice: {rebuild.status()}")
+
     st.divider()
 
     st.markdown("### OPERATIONS")
@@ -381,16 +407,12 @@ with st.sidebar:
                 with open(destination, "wb") as out_file:
                     out_file.write(uploaded.getbuffer())
                 saved += 1
-            inizializza_conoscenza.clear()
-            get_cached_responder.clear()
-            st.session_state.force_rebuild = True
+            avvia_ricostruzione(calcola_firma_documenti())
             st.success(f"Salvati {saved} PDF. Ricostruzione della knowledge base in corso...")
             st.rerun()
 
     if st.button("REBUILD KNOWLEDGE BASE", use_container_width=True):
-        inizializza_conoscenza.clear()
-        get_cached_responder.clear()
-        st.session_state.force_rebuild = True
+        avvia_ricostruzione(calcola_firma_documenti())
         st.rerun()
 
     if st.button("CLEAR CHAT", use_container_width=True):
@@ -615,7 +637,7 @@ if prompt:
                 expanded=True,
             ) as status:
                 try:
-                    responder = get_cached_responder(vector_db)
+                    responder = get_cached_responder(vector_db, index_generation)
                     responder.use_neural_reranker = use_reranker
 
                     response = responder.answer(
@@ -23,10 +23,12 @@ from agent import get_cached_responder, setup_redis_cache
 from config import (
     DEFAULT_MODEL_NAME,
     DOCUMENTS_FOLDER,
+    INDEX_READ_ONLY,
     RERANKER_ENABLED,
     setup_environment,
 )
-from database import calcola_firma_documenti, inizializza_conoscenza
+from database import avvia_ricostruzione, calcola_firma_documenti, inizializza_conoscenza
+from index_generations import current_generation, rebuild_in_progress, touch_reader_lease
 from rag_types import COURSE_LABELS, TOPIC_LABELS
 from theme_light import CSS_STYLES_LIGHT
 
@@ -77,13 +79,25 @@ docs_signature = calcola_firma_documenti()
 documents = docs_signature.get("documents", [])
 documents_count = len(documents)
 
+# Ciclo 3 — FASE 16: la generazione attiva dell'indice è parte della chiave delle
+# cache: quando un rebuild in background la pubblica, il rerun successivo apre
+# il nuovo indice senza interrompere le sessioni.
+index_generation = current_generation()
+if INDEX_READ_ONLY:  # Ciclo 3 — FASE 22: la generazione in uso non va cancellata
+    touch_reader_lease(index_generation)
 vector_db, msg = inizializza_conoscenza(
     docs_signature=docs_signature,
     force_rebuild=st.session_state.force_rebuild,
+    generation=index_generation,
 )
 
 st.session_state.force_rebuild = False
 
+# Ciclo 3 — FASE 8: il responder (e il suo warm-up in background) nasce con la
+# knowledge base, non alla prima domanda.
+if vector_db:
+    get_cached_responder(vector_db, index_generation)
+
 
 # ============================================================
 # Helpers di presentazione
@@ -369,18 +383,18 @@ with st.sidebar:
                 with open(destination, "wb") as out_file:
                     out_file.write(uploaded.getbuffer())
                 saved += 1
-            inizializza_conoscenza.clear()
-            get_cached_responder.clear()
-            st.session_state.force_rebuild = True
+            avvia_ricostruzione(calcola_firma_documenti())
             st.success(f"Salvati {saved} PDF. Ricostruzione in corso...")
             st.rerun()
 
     if st.button("Ricostruisci base di conoscenza", use_container_width=True):
-        inizializza_conoscenza.clear()
-        get_cached_responder.clear()
-        st.session_state.force_rebuild = True
+        avvia_ricostruzione(calcola_firma_documenti())
         st.rerun()
 
+    rebuild = rebuild_in_progress()
+    if rebuild is not None:
+        st.caption(f"Ricostruzione indice: {rebuild.status()}")
+
     col_a, col_b = st.columns(2)
     if col_a.button("Nuova chat", use_container_width=True):
         reset_chat()
@@ -513,7 +527,7 @@ if prompt:
             # Streamlit non consente expander annidati.
             with st.status("Sto consultando i documenti…", expanded=False) as status:
                 try:
-                    responder = get_cached_responder(vector_db)
+                    responder = get_cached_responder(vector_db, index_generation)
                     responder.use_neural_reranker = use_reranker
 
                     raw_response = responder.answer(
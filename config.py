@@ -615,11 +615,99 @@ CHROMA_PERSIST_DIRECTORY = os.getenv(
 )
 INDEX_MANIFEST_FILE = "index_manifest.json"
 
+# Ciclo 3 — FASE 16 — rebuild blue/green dell'indice (`index_generations.py`). Ogni
+# ricostruzione scrive una nuova generazione in CHROMA_PERSIST_DIRECTORY/generations/
+# mentre le domande continuano a usare quella attiva; a indice completo il puntatore
+# INDEX_POINTER_FILE viene sostituito in modo atomico e i responder si ricaricano. Si
+# conservano le ultime INDEX_GENERATIONS_KEEP generazioni (l'attiva compresa: una
+# sessione con una risposta in corso sulla precedente non la perde), le altre vengono
+# cancellate. Un indice scritto prima della FASE 16 direttamente in
+# CHROMA_PERSIST_DIRECTORY resta valido finché la prima generazione non lo sostituisce.
+INDEX_GENERATIONS_DIR = "generations"
+INDEX_POINTER_FILE = "current.json"
+INDEX_GENERATIONS_KEEP = 2
+
+# Ciclo 3 — FASE 17 — cache degli embedding dei chunk (`embedding_cache.py`). Il
+# vettore di ogni chunk è salvato con chiave hash(modello, testo) in
+# CHROMA_PERSIST_DIRECTORY/EMBEDDING_CACHE_FILE, fuori dalle generazioni: un rebuild
+# (nuovi PDF, CHUNK_SIZE/CHUNK_OVERLAP diversi) calcola solo i testi mai visti.
+# Vettori identici a quelli del modello: ATTIVA di default; a `0` ogni rebuild
+# ricalcola tutti gli embedding.
+EMBEDDING_CACHE_ENABLED = os.getenv("UNILAW_EMBEDDING_CACHE", "1").strip() in {"1", "true", "True"}
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite3"
+
+# Ciclo 3 — FASE 18 — cache delle pagine estratte dai PDF (`page_cache.py`). Testo e
+# metadata di ogni pagina sono salvati in CHROMA_PERSIST_DIRECTORY/PAGE_CACHE_DIR/,
+# un file per PDF con chiave SHA-256 del file e versione dell'estrattore: un rebuild
+# rilegge con PyPDFLoader solo i PDF nuovi o modificati. Testo identico all'estrazione:
+# ATTIVA di default.
+PAGE_CACHE_ENABLED = os.getenv("UNILAW_PAGE_CACHE", "1").strip() in {"1", "true", "True"}
+PAGE_CACHE_DIR = "page_cache"
+
+# Ciclo 3 — FASE 19 — ingestione in streaming. Le pagine dei PDF sono lette una alla
+# volta (`lazy_load`) e divise appena estratte; un thread produce lotti di
+# INGEST_BATCH_SIZE chunk in una coda di INGEST_QUEUE_DEPTH posti, e il rebuild
+# incorpora e scrive un lotto alla volta. Picco di memoria proporzionale al lotto,
+# non al corpus (`eval/ingestion_memory_benchmark.py`).
+INGEST_BATCH_SIZE = int(os.getenv("UNILAW_INGEST_BATCH", "256") or 256)
+INGEST_QUEUE_DEPTH = 2
+
+# Ciclo 3 — FASE 20 — chunk quasi duplicati eliminati all'indicizzazione
+# (`near_dedup.py`, opt-in). Firme MinHash di MINHASH_PERMUTATIONS permutazioni sui
+# trigrammi di parole, indicizzate in MINHASH_BANDS bande (LSH): un chunk con
+# somiglianza di Jaccard stimata ≥ NEAR_DEDUP_THRESHOLD con uno già tenuto dello stesso
+# corso non viene indicizzato, e il canonico riceve la provenienza (`provenance`,
+# `duplicate_count`). Cambia il contenuto dell'indice: registrata nel manifest, un
+# cambio forza il rebuild.
+NEAR_DEDUP_ENABLED = os.getenv("UNILAW_NEAR_DEDUP", "0").strip() in {"1", "true", "True"}
+NEAR_DEDUP_THRESHOLD = float(os.getenv("UNILAW_NEAR_DEDUP_THRESHOLD", "0.85") or 0.85)
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16
+
+# Ciclo 3 — FASE 21 — watcher della cartella dei documenti (`python ingestion_watcher.py`).
+# Controlla DOCUMENTS_FOLDER ogni WATCHER_POLL_S secondi e, quando i PDF cambiano e la
+# cartella resta ferma per WATCHER_DEBOUNCE_S, pubblica una nuova generazione
+# dell'indice. Finché è attivo tiene aggiornato WATCHER_HEARTBEAT_FILE nella radice
+# dell'indice, e l'app lascia a lui i rebuild dovuti a PDF cambiati.
+WATCHER_POLL_S = int(os.getenv("UNILAW_WATCH_INTERVAL", "30") or 30)
+WATCHER_DEBOUNCE_S = int(os.getenv("UNILAW_WATCH_DEBOUNCE", "10") or 10)
+WATCHER_HEARTBEAT_FILE = "watcher.json"
+
 CHUNK_SIZE = 900
 CHUNK_OVERLAP = 150
 
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+# Ciclo 3 — FASE 11 — backend del vector store. "chroma" (default): collezione HNSW
+# su SQLite. "flat": matrice dei vettori in memory-map sotto CHROMA_PERSIST_DIRECTORY,
+# con ricerca esatta (`vector_store.FlatVectorStore`); per ~22 PDF un prodotto
+# matrice-vettore costa meno del round-trip HNSW ed è deterministico. Cambiare
+# backend forza un rebuild. FLAT_INDEX_DTYPE: "float32" o "float16" (metà spazio).
+VECTOR_BACKEND = os.getenv("UNILAW_VECTOR_BACKEND", "chroma").strip().lower()
+FLAT_INDEX_DIR = "flat_index"
+FLAT_INDEX_DTYPE = os.getenv("UNILAW_FLAT_DTYPE", "float32").strip()
+
+# Ciclo 3 — FASE 13 — vettori compatti per il primo stadio dell'indice piatto.
+# FLAT_INDEX_COMPACT: "" (off), "float16" o "int8" (quantizzazione scalare per
+# dimensione); FLAT_INDEX_PCA_DIM > 0 riduce prima le dimensioni con una PCA stimata
+# in fase di indicizzazione. Il primo stadio sceglie n × FLAT_INDEX_RESCORE_FACTOR
+# candidati sui vettori compatti, poi il punteggio esatto viene ricalcolato sui vettori
+# completi (in memory-map su disco: si leggono solo le righe dei candidati).
+FLAT_INDEX_COMPACT = os.getenv("UNILAW_FLAT_COMPACT", "").strip().lower()
+FLAT_INDEX_PCA_DIM = int(os.getenv("UNILAW_FLAT_PCA_DIM", "0") or 0)
+FLAT_INDEX_RESCORE_FACTOR = 4
+
+# Ciclo 3 — FASE 12 — parametri HNSW della collezione Chroma (solo backend "chroma").
+# I default coincidono con quelli di Chroma: nulla cambia finché non vengono tarati con
+# `eval/hnsw_benchmark.py` (recall del vettoriale vs ricerca esatta, latenza p50/p95).
+# Sono parametri di costruzione registrati nel manifest: cambiarli forza un rebuild.
+# M = archi per nodo del grafo, construction_ef / search_ef = ampiezza della lista
+# candidati in costruzione / in ricerca (più alti: più recall, più latenza).
+HNSW_SPACE = os.getenv("UNILAW_HNSW_SPACE", "l2").strip()
+HNSW_M = int(os.getenv("UNILAW_HNSW_M", "16") or 16)
+HNSW_CONSTRUCTION_EF = int(os.getenv("UNILAW_HNSW_CONSTRUCTION_EF", "100") or 100)
+HNSW_SEARCH_EF = int(os.getenv("UNILAW_HNSW_SEARCH_EF", "10") or 10)
+
 DEFAULT_MODEL_NAME = "llama3.1:8b"
 DEFAULT_TEMPERATURE = 0.0
 DEFAULT_NUM_CTX = 4096
@@ -627,6 +715,55 @@ DEFAULT_NUM_CTX = 4096
 DEFAULT_K_RETRIEVAL = 12
 MAX_CONTEXT_DOCUMENTS = 5
 
+# Ciclo 3 — FASE 2 — pre-filtro per corso spinto dentro la query (opt-in).
+# `filter_documents_by_course` scarta i chunk di altri corsi solo DOPO che l'arm
+# vettoriale ha già speso i suoi k slot MMR per variante: sulle domande con un corso
+# riconosciuto parte dei candidati viene quindi sprecata. Con questa opzione la stessa
+# regola (course_tag ∈ {corso, generale}, esclusi i casi Erasmus/borsa) diventa una
+# clausola `where` di ChromaDB e un filtro dell'arm BM25. Se la query filtrata rende
+# meno di RETRIEVAL_PREFILTER_MIN_RESULTS documenti, si ripete la query senza filtro
+# (stesso fallback controllato del filtro a valle). DISATTIVATO di default finché
+# l'ablation (`eval/retrieval_ablation.py --prefilter`) non ne misura l'effetto sul
+# retrieval-hit.
+RETRIEVAL_PREFILTER_ENABLED = os.getenv("UNILAW_RETRIEVAL_PREFILTER", "0").strip() in {"1", "true", "True"}
+RETRIEVAL_PREFILTER_MIN_RESULTS = 4
+
+# Ciclo 3 — FASE 4 — cache delle varianti di query costanti.
+# Le espansioni fisse di `build_query_variants` (quelle che non contengono la domanda)
+# hanno sempre lo stesso risultato MMR a parità di indice: vengono precalcolate al
+# caricamento e salvate (solo gli ID dei chunk) accanto al manifest, legate alla sua
+# firma. Risultati identici al calcolo a runtime: ATTIVA di default; a `0` ogni variante
+# torna a interrogare il vector store a ogni domanda.
+VARIANT_CACHE_ENABLED = os.getenv("UNILAW_VARIANT_CACHE", "1").strip() in {"1", "true", "True"}
+VARIANT_CACHE_FILE = "variant_cache.json"
+
+# Ciclo 3 — FASE 14 — retrieval a due stadi: documento, poi chunk (opt-in).
+# All'indicizzazione ogni PDF viene riassunto da DOCUMENT_INDEX_CENTROIDS centroidi
+# (media normalizzata dei vettori di altrettante sezioni consecutive di pagine),
+# salvati accanto al manifest. A runtime ogni variante sceglie prima i
+# DOCUMENT_STAGE_TOP_N documenti più vicini (fra quelli ammessi dalla regola di
+# `filter_documents_by_course`) e poi cerca solo fra i loro chunk, con un `where` su
+# `source`. Se il secondo stadio rende meno di RETRIEVAL_PREFILTER_MIN_RESULTS chunk,
+# la variante viene ripetuta sull'intero indice. DISATTIVATO di default: con 22 PDF
+# la ricerca su tutti i chunk costa poco; serve quando `documenti/` cresce.
+TWO_STAGE_RETRIEVAL_ENABLED = os.getenv("UNILAW_TWO_STAGE", "0").strip() in {"1", "true", "True"}
+DOCUMENT_STAGE_TOP_N = int(os.getenv("UNILAW_DOCUMENT_TOP_N", "4") or 4)
+DOCUMENT_INDEX_CENTROIDS = 4
+DOCUMENT_INDEX_FILE = "document_index.npz"
+
+# Ciclo 3 — FASE 5 — budget dei candidati fra fusione RRF e reranking euristico.
+# La fusione restituisce tutti i candidati deduplicati di varianti e arm (fino a ~100),
+# mentre al modello ne arrivano MAX_CONTEXT_DOCUMENTS: con un budget > 0 reranking,
+# filtro per corso e cross-encoder lavorano solo sui primi CANDIDATE_BUDGET. In modalità
+# adattiva il budget raddoppia quando, al confine dei primi MAX_CONTEXT_DOCUMENTS, i
+# punteggi euristici distano al più CANDIDATE_BUDGET_CLOSE_MARGIN (il reranker euristico
+# usa priori interi: +4/+6 per parola chiave, +30 per corso). DISATTIVATO di default
+# (0 = nessun limite) finché l'ablation `eval/retrieval_ablation.py --budget` non fissa
+# un valore che conserva il retrieval-hit@5.
+CANDIDATE_BUDGET = int(os.getenv("UNILAW_CANDIDATE_BUDGET", "0") or 0)
+CANDIDATE_BUDGET_ADAPTIVE = os.getenv("UNILAW_CANDIDATE_BUDGET_ADAPTIVE", "0").strip() in {"1", "true", "True"}
+CANDIDATE_BUDGET_CLOSE_MARGIN = 4
+
 # FASE 4 — reranker neurale (cross-encoder multilingua) OPZIONALE.
 # Disattivato di default: si abilita via env (UNILAW_RERANKER=1) o dal toggle in
 # sidebar. Se il modello non è disponibile, la pipeline torna al reranking
@@ -636,6 +773,37 @@ RERANKER_ENABLED = os.getenv("UNILAW_RERANKER", "0").strip() in {"1", "true", "T
 RERANKER_MODEL_NAME = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
 RERANKER_TOP_N = 15
 
+# Ciclo 3 — FASE 6 — costo del cross-encoder su CPU.
+# Batch unico per i RERANKER_TOP_N candidati; thread di torch (0 = default di torch);
+# cache LRU dei punteggi per (domanda, chunk), utile sulle domande ripetute e sulle
+# varianti di una stessa sessione. Con RERANKER_EVIDENCE_WINDOW il cross-encoder valuta
+# la finestra di evidenza (`select_passage`, ≤ EVIDENCE_MAX_CHARS) invece dei 900
+# caratteri del chunk: input più corti, ma punteggi diversi → opt-in.
+RERANKER_BATCH_SIZE = 16
+RERANKER_NUM_THREADS = int(os.getenv("UNILAW_RERANKER_THREADS", "0") or 0)
+RERANKER_CACHE_SIZE = 2048
+RERANKER_EVIDENCE_WINDOW = os.getenv("UNILAW_RERANKER_EVIDENCE", "0").strip() in {"1", "true", "True"}
+
+# Ciclo 3 — FASE 7 — reranking a cascata. Con il reranker neurale attivo, il
+# cross-encoder viene invocato solo se l'euristica è incerta: distacco fra il 5° e il 6°
+# candidato (confine del contesto) inferiore a RERANKER_CASCADE_MARGIN punti euristici.
+# I boost per nome file (+30/+65) e per corso (+30) rendono molti ordinamenti netti.
+# Opt-in (UNILAW_RERANKER_CASCADE=1): senza, il cross-encoder gira sempre come prima.
+RERANKER_CASCADE_ENABLED = os.getenv("UNILAW_RERANKER_CASCADE", "0").strip() in {"1", "true", "True"}
+RERANKER_CASCADE_MARGIN = 10
+
+# Ciclo 3 — FASE 8 — warm-up in background all'avvio del responder (`warmup.py`):
+# primo embedding, cross-encoder e anchor dell'intent semantico (solo se abilitati).
+# Nessun effetto sulle risposte, solo sulla latenza della prima domanda: ATTIVO di default.
+WARMUP_ENABLED = os.getenv("UNILAW_WARMUP", "1").strip() in {"1", "true", "True"}
+
+# Ciclo 3 — FASE 10 — quantizzazione dinamica int8 (torch) dei layer lineari del
+# modello di embedding e del cross-encoder, applicata dopo il caricamento (solo CPU).
+# Meno memoria e inferenza più rapida, ma vettori e punteggi leggermente diversi:
+# opt-in (UNILAW_QUANTIZE=1), da validare con `eval/quantization_benchmark.py`.
+# Se attiva durante un rebuild, anche i vettori dei chunk sono calcolati in int8.
+MODEL_QUANTIZATION_ENABLED = os.getenv("UNILAW_QUANTIZE", "0").strip() in {"1", "true", "True"}
+
 # FASE 5 — evidence selection + verifica delle citazioni.
 # Evidence selection: al modello vengono passati passaggi più brevi e mirati
 # (le frasi più pertinenti alla domanda), con un minimo garantito per non perdere
@@ -828,3 +996,55 @@ QA_PROMPT = PromptTemplate(
     template=qa_template,
     input_variables=["context", "question", "style_guide", "answer_profile"],
 )
+
+# Ciclo 3 — FASE 22 — più processi che servono domande sullo stesso indice. Con
+# UNILAW_INDEX_READ_ONLY=1 il processo è un lettore: apre la generazione pubblicata e
+# non costruisce mai l'indice (lo fa un solo scrittore, es. il watcher della FASE 21,
+# che tiene INDEX_WRITER_LOCK_FILE). I lettori controllano il puntatore al più ogni
+# INDEX_POLL_S secondi e registrano in INDEX_READERS_DIR la generazione in uso, che la
+# pulizia delle generazioni non cancella.
+INDEX_READ_ONLY = os.getenv("UNILAW_INDEX_READ_ONLY", "0").strip() in {"1", "true", "True"}
+INDEX_POLL_S = int(os.getenv("UNILAW_INDEX_POLL", "5") or 5)
+INDEX_WRITER_LOCK_FILE = "writer.lock"
+INDEX_READERS_DIR = "readers"
+
+# Ciclo 3 — FASE 23 — server preload-then-fork (`prefork.py`): il processo padre carica
+# una volta modelli, indice, BM25 e anchor, esegue gc.freeze() e crea SERVER_WORKERS
+# worker che condividono quelle pagine in copy-on-write.
+SERVER_WORKERS = int(os.getenv("UNILAW_WORKERS", "2") or 2)
+
+# Ciclo 3 — FASE 24 — API HTTP (`python api_server.py`): /answer, /retrieve, /health. Le
+# risposte che possono chiamare Ollama passano da API_LLM_SLOTS posti in esecuzione
+# (da allineare a OLLAMA_NUM_PARALLEL) e da una coda di API_QUEUE_SIZE posti; a coda
+# piena, o oltre API_CLIENT_MAX_INFLIGHT richieste dello stesso client, la risposta è
+# 429. Con più worker (FASE 23) posti e coda sono condivisi; il limite per client vale
+# per worker. /retrieve non chiama il modello: ha posti suoi, API_RETRIEVE_SLOTS
+# (default: i core della macchina), con la stessa coda e lo stesso limite per client.
+API_HOST = os.getenv("UNILAW_API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("UNILAW_API_PORT", "8080") or 8080)
+API_LLM_SLOTS = int(os.getenv("UNILAW_API_LLM_SLOTS", "1") or 1)
+API_QUEUE_SIZE = int(os.getenv("UNILAW_API_QUEUE", "8") or 8)
+API_CLIENT_MAX_INFLIGHT = int(os.getenv("UNILAW_API_CLIENT_LIMIT", "2") or 2)
+API_RETRIEVE_SLOTS = int(os.getenv("UNILAW_API_RETRIEVE_SLOTS", "0") or 0) or (os.cpu_count() or 1)
+
+# Ciclo 3 — FASE 25 — dispatcher delle chiamate al modello (`llm_dispatcher.py`). Ogni
+# generazione attende un posto fra LLM_MAX_INFLIGHT (da allineare a OLLAMA_NUM_PARALLEL).
+# I posti liberi vanno alle classi di priorità in proporzione ai pesi (round robin
+# pesato) e, dentro una classe, a turno fra i client. La classe `batch` (valutazioni,
+# precalcoli) non occupa più di LLM_BATCH_MAX_INFLIGHT posti (default: tutti meno uno,
+# almeno uno), così con più posti ne resta sempre uno per le domande degli studenti.
+# LLM_PRIORITY è la classe di default del processo (es. UNILAW_LLM_PRIORITY=batch per un
+# job notturno).
+# Il dispatcher vale nel processo; fra processi diversi (Streamlit, API, eval) lo stesso
+# ordinamento lo applica il gateway `python llm_dispatcher.py`, davanti a Ollama:
+# con UNILAW_LLM_GATEWAY=http://127.0.0.1:11435 i client passano da lì.
+LLM_MAX_INFLIGHT = int(os.getenv("UNILAW_LLM_MAX_INFLIGHT", "1") or 1)
+LLM_BATCH_MAX_INFLIGHT = int(os.getenv("UNILAW_LLM_BATCH_SLOTS", "0") or 0)  # 0: tutti i posti meno uno
+LLM_PRIORITY_WEIGHTS = {
+    "interactive": int(os.getenv("UNILAW_LLM_WEIGHT_INTERACTIVE", "8") or 8),
+    "batch": int(os.getenv("UNILAW_LLM_WEIGHT_BATCH", "1") or 1),
+}
+LLM_PRIORITY = os.getenv("UNILAW_LLM_PRIORITY", "interactive").strip() or "interactive"
+LLM_GATEWAY_URL = os.getenv("UNILAW_LLM_GATEWAY", "").strip()
+LLM_GATEWAY_PORT = int(os.getenv("UNILAW_LLM_GATEWAY_PORT", "11435") or 11435)
+OLLAMA_URL = os.getenv("UNILAW_OLLAMA_URL", "http://localhost:11434").strip()
@@ -3,13 +3,13 @@ import hashlib
 import json
 import logging
 import os
-import shutil
+import queue
+import threading
 from pathlib import Path
 
 import streamlit as st
 from chromadb.config import Settings
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
@@ -17,10 +17,48 @@ from config import (
     CHROMA_PERSIST_DIRECTORY,
     CHUNK_OVERLAP,
     CHUNK_SIZE,
+    DEFAULT_K_RETRIEVAL,
     DOCUMENTS_FOLDER,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_FILE,
     EMBEDDING_MODEL_NAME,
+    FLAT_INDEX_DIR,
+    FLAT_INDEX_COMPACT,
+    FLAT_INDEX_DTYPE,
+    FLAT_INDEX_PCA_DIM,
+    HNSW_CONSTRUCTION_EF,
+    HNSW_M,
+    HNSW_SEARCH_EF,
+    HNSW_SPACE,
     INDEX_MANIFEST_FILE,
+    INDEX_READ_ONLY,
+    INGEST_BATCH_SIZE,
+    INGEST_QUEUE_DEPTH,
+    NEAR_DEDUP_ENABLED,
+    NEAR_DEDUP_THRESHOLD,
+    PAGE_CACHE_DIR,
+    PAGE_CACHE_ENABLED,
+    RETRIEVAL_PREFILTER_ENABLED,
+    TWO_STAGE_RETRIEVAL_ENABLED,
+    VARIANT_CACHE_ENABLED,
+    VECTOR_BACKEND,
 )
+from document_index import load_index_document_index
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from index_generations import (
+    IndexReader,
+    IndexRebuild,
+    active_index_dir,
+    current_generation,
+    start_rebuild,
+    touch_reader_lease,
+)
+from model_registry import get_embeddings
+from near_dedup import NearDuplicateFilter
+from page_cache import PageCache
+from retrieval import CHUNK_ID_KEY
+from variant_cache import load_index_variant_cache
+from vector_store import FlatVectorStore
 
 
 logger = logging.getLogger(__name__)
@@ -64,8 +102,13 @@ def calcola_firma_documenti(folder_path: str = DOCUMENTS_FOLDER) -> dict:
     return {"documents": documents}
 
 
-def _read_manifest() -> dict | None:
-    manifest_path = Path(CHROMA_PERSIST_DIRECTORY) / INDEX_MANIFEST_FILE
+def _index_dir() -> Path:
+    """Cartella dell'indice attivo (Ciclo 3 — FASE 16: generazione corrente o radice)."""
+    return active_index_dir(CHROMA_PERSIST_DIRECTORY)
+
+
+def _read_manifest(index_dir: Path | None = None) -> dict | None:
+    manifest_path = Path(index_dir or _index_dir()) / INDEX_MANIFEST_FILE
 
     if not manifest_path.exists():
         return None
@@ -78,13 +121,50 @@ def _read_manifest() -> dict | None:
         return None
 
 
-def _write_manifest(signature: dict) -> None:
-    manifest_path = Path(CHROMA_PERSIST_DIRECTORY) / INDEX_MANIFEST_FILE
+# Impostazioni implicite dei manifest scritti prima del Ciclo 3 — FASE 12: indice
+# Chroma con i parametri HNSW di default.
+_LEGACY_INDEX_SETTINGS = {
+    "backend": "chroma",
+    "hnsw:space": "l2",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 100,
+    "hnsw:search_ef": 10,
+}
+
+
+def _hnsw_metadata() -> dict:
+    """Parametri HNSW per `collection_metadata` di Chroma (Ciclo 3 — FASE 12)."""
+    return {
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:M": HNSW_M,
+        "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+    }
+
+
+def _index_settings() -> dict:
+    """Parametri di costruzione dell'indice, registrati nel manifest."""
+    if VECTOR_BACKEND == "flat":
+        settings = {"backend": "flat", "dtype": FLAT_INDEX_DTYPE}
+        if FLAT_INDEX_COMPACT:  # Ciclo 3 — FASE 13
+            settings.update(compact=FLAT_INDEX_COMPACT, pca_dim=FLAT_INDEX_PCA_DIM)
+    else:
+        settings = {"backend": "chroma", **_hnsw_metadata()}
+    if NEAR_DEDUP_ENABLED:  # Ciclo 3 — FASE 20
+        settings["near_dedup"] = NEAR_DEDUP_THRESHOLD
+    settings["chunk_ids"] = _CHUNK_ID_SCHEME  # Ciclo 3 — FASE 15
+    return settings
+
+
+def _write_manifest(
+    signature: dict, index_dir: Path | None = None, ingestion: dict | None = None
+) -> None:
+    manifest_path = Path(index_dir or _index_dir()) / INDEX_MANIFEST_FILE
     manifest_path.parent.mkdir(parents=True, exist_ok=True)
-    manifest_path.write_text(
-        json.dumps(signature, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    manifest = {**signature, "index": _index_settings()}
+    if ingestion:  # Ciclo 3 — FASE 20: statistiche della deduplica (e PDF letti in parte, FASE 19)
+        manifest["ingestion"] = ingestion
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
 
 
 def _infer_course_tag(filename: str) -> str:
@@ -146,97 +226,415 @@ def _enrich_metadata(doc, pdf_path: str):
     doc.metadata["doc_type"] = _infer_doc_type(filename)
 
 
-def _load_and_split_documents(pdf_files: list[str]):
-    all_chunks = []
+# Ciclo 3 — FASE 15: caratteri esadecimali dell'ID dei chunk (80 bit di SHA-256).
+_CHUNK_ID_LENGTH = 20
+# Campi che entrano nell'ID, registrati nel manifest: se cambiano, l'indice si ricostruisce.
+_CHUNK_ID_SCHEME = "file+pagina+testo"
+
+
+def _chunk_content_id(filename: str, text: str, page=None) -> str:
+    """ID deterministico del chunk: hash del nome del PDF, della pagina e del testo normalizzato.
 
+    Stesso PDF, stessa pagina e stesso testo danno lo stesso ID a ogni
+    reindicizzazione (e su ogni macchina): cache di embedding, punteggi del
+    reranker e risposte possono usarlo come chiave senza rileggere il contenuto.
+    La pagina fa parte della chiave: lo stesso testo su due pagine (intestazioni,
+    articoli ripetuti) resta citabile su entrambe.
+    """
+    normalized = " ".join((text or "").split())
+    payload = f"{filename}\n{page}\n{normalized}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:_CHUNK_ID_LENGTH]
+
+
+def _unique_chunks(chunks, seen: set):
+    """Scrive l'ID di contenuto nei metadata e scarta i chunk con ID ripetuto.
+
+    Un ID ripetuto è lo stesso testo sulla stessa pagina dello stesso PDF: si tiene
+    la prima occorrenza (Chroma rifiuterebbe comunque ID doppi). `seen` raccoglie
+    gli ID già emessi (anche dei lotti precedenti).
+    """
+    for chunk in chunks:
+        metadata = chunk.metadata
+        chunk_id = _chunk_content_id(metadata.get("filename", ""), chunk.page_content, metadata.get("page"))
+        if chunk_id in seen:
+            continue
+        seen.add(chunk_id)
+        chunk.metadata[CHUNK_ID_KEY] = chunk_id
+        yield chunk
+
+
+def _iter_pdf_pages(pdf_path: str, page_cache: PageCache | None = None):
+    """Pagine del PDF una alla volta (Ciclo 3 — FASE 19: `lazy_load`, non `load`).
+
+    Dalla cache delle pagine (FASE 18) se il file è già stato letto, altrimenti
+    estratte e salvate mentre scorrono. La chiave è lo SHA-256 calcolato qui, sui
+    byte che si stanno per leggere (non quello della firma, che un upload nel
+    frattempo renderebbe vecchio).
+
+    Se la voce in cache si rivela illeggibile a metà, il PDF viene estratto di
+    nuovo (e la voce riscritta) ma le pagine già emesse non si ripetono.
+    """
+    if page_cache is None:
+        yield from PyPDFLoader(pdf_path).lazy_load()
+        return
+
+    sha256 = _file_hash(pdf_path)
+    emitted = 0
+    if sha256 in page_cache:
+        logger.info("Pagine dalla cache: %s", os.path.basename(pdf_path))
+        pages = page_cache.iter_pages(sha256)
+        while True:
+            try:
+                page = next(pages)
+            except StopIteration:
+                return
+            except Exception as exc:
+                logger.warning("Pagine in cache non leggibili (%s), si estrae di nuovo: %s", sha256[:12], exc)
+                break
+            emitted += 1
+            yield page
+
+    logger.info("Analizzo PDF: %s", os.path.basename(pdf_path))
+    for i, page in enumerate(page_cache.tee(sha256, PyPDFLoader(pdf_path).lazy_load())):
+        if i >= emitted:
+            yield page
+
+
+def _iter_chunks(
+    pdf_files: list[str],
+    near_dedup: NearDuplicateFilter | None = None,
+    partial: dict | None = None,
+    root=None,
+):
+    """Chunk del corpus uno alla volta, già arricchiti e con ID di contenuto.
+
+    Ciclo 3 — FASE 19: ogni pagina è divisa appena estratta (lo splitter divide
+    comunque pagina per pagina: chunk identici a quelli di `load()` +
+    `split_documents`), quindi in memoria c'è una pagina alla volta, non il PDF.
+    Un errore di lettura interrompe il PDF: a differenza di prima (PDF scartato
+    per intero) le pagine già emesse restano nell'indice, e `partial` (se
+    fornito) riceve nome del file → pagine lette ed errore, per il manifest.
+    Con `near_dedup` (FASE 20) i quasi duplicati di chunk già emessi sono scartati.
+    La cache delle pagine è quella sotto `root` (default `CHROMA_PERSIST_DIRECTORY`).
+    """
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
     )
+    page_cache = None
+    if PAGE_CACHE_ENABLED:
+        page_cache = PageCache(Path(root or CHROMA_PERSIST_DIRECTORY) / PAGE_CACHE_DIR)
 
+    seen = set()
     for pdf_path in pdf_files:
+        pages = 0
         try:
-            logger.info("Analizzo PDF: %s", os.path.basename(pdf_path))
-
-            loader = PyPDFLoader(pdf_path)
-            documents = loader.load()
-
-            for doc in documents:
-                _enrich_metadata(doc, pdf_path)
+            for page in _iter_pdf_pages(pdf_path, page_cache):
+                pages += 1
+                _enrich_metadata(page, pdf_path)
+                chunks = splitter.split_documents([page])
 
-            chunks = splitter.split_documents(documents)
+                for chunk in chunks:
+                    if "filename" not in chunk.metadata:
+                        _enrich_metadata(chunk, pdf_path)
 
-            for chunk in chunks:
-                if "filename" not in chunk.metadata:
-                    _enrich_metadata(chunk, pdf_path)
-
-            all_chunks.extend(chunks)
+                for chunk in _unique_chunks(chunks, seen):
+                    if near_dedup is None or not near_dedup.is_duplicate(chunk, chunk.metadata[CHUNK_ID_KEY]):
+                        yield chunk
 
         except Exception as exc:
-            logger.warning("Errore leggendo %s: %s", os.path.basename(pdf_path), exc)
+            logger.warning("Errore leggendo %s (dopo %d pagine): %s", os.path.basename(pdf_path), pages, exc)
+            if partial is not None:
+                partial[os.path.basename(pdf_path)] = {"pages": pages, "error": str(exc)}
+
+
+def _stream_batches(
+    pdf_files: list[str],
+    batch_size: int = INGEST_BATCH_SIZE,
+    depth: int = INGEST_QUEUE_DEPTH,
+    near_dedup: NearDuplicateFilter | None = None,
+    partial: dict | None = None,
+    root=None,
+):
+    """Lotti di chunk prodotti da un thread e passati da una coda limitata (FASE 19).
 
-    return all_chunks
+    Estrazione e divisione dei PDF proseguono mentre il chiamante calcola gli
+    embedding del lotto precedente; con la coda piena il produttore si ferma,
+    quindi in memoria ci sono al più `depth` + 2 lotti. Un errore del produttore
+    è risollevato nel chiamante.
+    """
+    done = object()
+    batches = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for chunk in _iter_chunks(pdf_files, near_dedup, partial, root):
+                batch.append(chunk)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(done)
+        except BaseException as exc:  # risollevato nel consumatore
+            put(exc)
+
+    producer = threading.Thread(target=produce, name="unilaw-ingest", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
 
 
 def _build_embeddings():
-    return HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL_NAME,
-        model_kwargs={"device": "cpu"},
-    )
+    # Ciclo 3 — FASE 9: istanza condivisa dal registro dei modelli; un rebuild o un
+    # nuovo caricamento dell'indice non ricarica il modello di embedding.
+    return get_embeddings(EMBEDDING_MODEL_NAME, device="cpu")
 
 
-def _build_chroma_settings():
+def _build_chroma_settings(index_dir: Path | None = None):
     return Settings(
         anonymized_telemetry=False,
         is_persistent=True,
-        persist_directory=CHROMA_PERSIST_DIRECTORY,
+        persist_directory=str(index_dir or _index_dir()),
+    )
+
+
+def apri_knowledge_base(embeddings=None, index_dir: Path | None = None):
+    """Apre l'indice già persistito (Chroma o piatto, FASE 11), senza ricostruirlo.
+
+    Usata dagli script di valutazione (Ciclo 3 — FASE 9) al posto di costruire
+    ciascuno il proprio Chroma con i propri embeddings. `embeddings` permette di
+    interrogare lo stesso indice con un altro modello di query (es. int8, FASE 10).
+    Senza `index_dir` si apre la generazione attiva (FASE 16).
+    """
+    embeddings = embeddings or _build_embeddings()
+    index_dir = Path(index_dir or _index_dir())
+    if VECTOR_BACKEND == "flat":
+        return FlatVectorStore.load(_flat_index_dir(index_dir), embeddings)
+    return Chroma(
+        persist_directory=str(index_dir),
+        embedding_function=embeddings,
+        client_settings=_build_chroma_settings(index_dir),
     )
 
 
-def _should_rebuild(force_rebuild: bool, docs_signature: dict) -> bool:
+def apri_lettore_indice(embeddings=None) -> IndexReader:
+    """Lettore dell'indice per i processi che servono domande (Ciclo 3 — FASE 22).
+
+    Apre la generazione attiva e passa da sola a quelle pubblicate in seguito
+    (vedi `index_generations.IndexReader`); non scrive mai l'indice.
+    """
+    embeddings = embeddings or _build_embeddings()
+    return IndexReader(lambda index_dir: apri_knowledge_base(embeddings, index_dir), CHROMA_PERSIST_DIRECTORY)
+
+
+def _flat_index_dir(index_dir: Path | None = None) -> Path:
+    return Path(index_dir or _index_dir()) / FLAT_INDEX_DIR
+
+
+def _should_rebuild(force_rebuild: bool, docs_signature: dict, root=None) -> bool:
+    """True se l'indice attivo sotto `root` (default `CHROMA_PERSIST_DIRECTORY`) va ricostruito."""
     if force_rebuild:
         return True
 
-    manifest = _read_manifest()
+    index_dir = active_index_dir(root if root is not None else CHROMA_PERSIST_DIRECTORY)
+    manifest = _read_manifest(index_dir)
 
-    if manifest != docs_signature:
+    if not manifest or manifest.get("documents") != docs_signature.get("documents"):
         return True
 
-    db_path = Path(CHROMA_PERSIST_DIRECTORY) / "chroma.sqlite3"
+    # Ciclo 3 — FASE 12: parametri dell'indice cambiati (backend, HNSW, dtype).
+    # Un manifest senza parametri precede anche gli ID dei chunk (FASE 15): nessun
+    # chunk scartato, niente da recuperare.
+    legacy = {**_LEGACY_INDEX_SETTINGS, "chunk_ids": _CHUNK_ID_SCHEME}
+    if manifest.get("index", legacy) != _index_settings():
+        return True
+
+    if VECTOR_BACKEND == "flat":
+        return not FlatVectorStore.exists(_flat_index_dir(index_dir))
+
+    db_path = index_dir / "chroma.sqlite3"
 
     return not db_path.exists()
 
 
-def _delete_existing_index() -> None:
-    index_path = Path(CHROMA_PERSIST_DIRECTORY)
+def _build_index(pdf_files: list[str], docs_signature: dict, index_dir: Path, root=None):
+    """Scrive un indice completo (chunk, vettori, manifest) in `index_dir`.
 
-    if index_path.exists():
-        shutil.rmtree(index_path)
+    Ciclo 3 — FASE 16: `index_dir` è sempre la cartella di una generazione nuova;
+    l'indice attivo non viene toccato finché la nuova generazione non è pubblicata.
+    Restituisce (vector store, numero di chunk).
 
-    # ChromaDB (>=0.4) tiene in cache, per tutta la durata del processo, un "System"
-    # (con la connessione SQLite) per ogni persist_directory. Dopo la rmtree qui sopra,
-    # un nuovo client riuserebbe quella connessione ormai orfana — il file è stato
-    # cancellato — e alla prima scrittura SQLite risponde "attempt to write a readonly
-    # database". Quando il rebuild parte dalla GUI il processo Streamlit è long-running,
-    # quindi la cache sopravvive: va svuotata perché il rebuild apra una connessione nuova
-    # sul file appena ricreato. In un processo appena avviato la cache è vuota e questo
-    # è un no-op.
-    try:
-        from chromadb.api.client import SharedSystemClient
+    Ciclo 3 — FASE 19: i chunk arrivano a lotti di `INGEST_BATCH_SIZE` da
+    `_stream_batches` e ogni lotto è incorporato e scritto prima del successivo:
+    la memoria del rebuild dipende dalla dimensione del lotto, non dal corpus.
+
+    Le cache di pagine ed embedding sono quelle della radice `root` che contiene
+    `index_dir` (default `CHROMA_PERSIST_DIRECTORY`; il watcher passa la propria).
+    """
+    root = Path(root or CHROMA_PERSIST_DIRECTORY)
+    embeddings = _build_embeddings()
+    if EMBEDDING_CACHE_ENABLED:
+        # Ciclo 3 — FASE 17: solo i testi mai visti passano dal modello.
+        embeddings = CachedEmbeddings(
+            embeddings, EmbeddingCache(root / EMBEDDING_CACHE_FILE)
+        )
 
-        SharedSystemClient.clear_system_cache()
-    except Exception as exc:  # difensivo: il percorso dell'API può variare tra versioni
-        logger.warning("Impossibile svuotare la cache di sistema ChromaDB: %s", exc)
+    near_dedup = NearDuplicateFilter() if NEAR_DEDUP_ENABLED else None
+    partial: dict = {}
+    n_chunks = 0
+
+    def batches():
+        nonlocal n_chunks
+        for batch in _stream_batches(pdf_files, near_dedup=near_dedup, partial=partial, root=root):
+            n_chunks += len(batch)
+            yield [chunk.metadata[CHUNK_ID_KEY] for chunk in batch], batch
+
+    if VECTOR_BACKEND == "flat":
+        db = FlatVectorStore.build_batches(
+            batches(),
+            embeddings,
+            _flat_index_dir(index_dir),
+            dtype=FLAT_INDEX_DTYPE,
+            compact=FLAT_INDEX_COMPACT,
+            pca_dim=FLAT_INDEX_PCA_DIM,
+        )
+    else:
+        db = Chroma(
+            embedding_function=embeddings,
+            persist_directory=str(index_dir),
+            client_settings=_build_chroma_settings(index_dir),
+            collection_metadata=_hnsw_metadata(),
+        )
+        for chunk_ids, batch in batches():
+            db.add_documents(batch, ids=chunk_ids)
+
+    if not n_chunks:
+        raise ValueError("Nessun contenuto valido estratto dai PDF.")
+
+    ingestion = None
+    if near_dedup is not None:
+        _apply_provenance(db, near_dedup.metadata_updates())
+        ingestion = near_dedup.stats()
+        logger.info(
+            "Quasi duplicati scartati: %d su %d chunk (%.1f%%).",
+            near_dedup.collapsed,
+            near_dedup.seen,
+            100 * near_dedup.ratio,
+        )
+    if partial:
+        # PDF interrotti da un errore di lettura: indicizzati solo fino all'errore.
+        logger.warning("PDF indicizzati solo in parte: %s", ", ".join(sorted(partial)))
+        ingestion = {**(ingestion or {}), "partial_pdfs": partial}
+
+    _write_manifest(docs_signature, index_dir, ingestion)
+    # Ciclo 3 — FASE 22: gli artefatti derivati (indice dei documenti, FASE 14, e
+    # cache delle varianti, FASE 4) si scrivono qui, prima della pubblicazione: una
+    # generazione pubblicata non viene più modificata e i lettori li trovano pronti.
+    if TWO_STAGE_RETRIEVAL_ENABLED:
+        load_index_document_index(db, rebuild=True, index_dir=index_dir)
+    if VARIANT_CACHE_ENABLED and not TWO_STAGE_RETRIEVAL_ENABLED:
+        load_index_variant_cache(db, DEFAULT_K_RETRIEVAL, RETRIEVAL_PREFILTER_ENABLED, index_dir=index_dir)
+
+    return db, n_chunks
+
+
+def _apply_provenance(db, updates: dict) -> None:
+    """Scrive nei chunk canonici la provenienza dei quasi duplicati (Ciclo 3 — FASE 20).
+
+    I canonici sono già nell'indice quando arrivano le loro copie (ingestione a
+    lotti, FASE 19): i metadata si aggiornano a indice scritto, senza ricalcolare
+    gli embedding.
+    """
+    if not updates:
+        return
+    if VECTOR_BACKEND == "flat":
+        db.update_metadatas(updates)
+    else:
+        db._collection.update(ids=list(updates), metadatas=list(updates.values()))
 
 
-@st.cache_resource(show_spinner=False)
+def avvia_ricostruzione(docs_signature: dict | None = None) -> IndexRebuild:
+    """Ricostruisce l'indice in background in una nuova generazione (Ciclo 3 — FASE 16).
+
+    Le domande continuano a usare la generazione attiva; al termine il puntatore
+    viene sostituito e la prossima esecuzione della UI apre la nuova. Se una
+    ricostruzione è già in corso, restituisce quella.
+    """
+    pdf_files = _collect_pdf_files(DOCUMENTS_FOLDER)
+    docs_signature = docs_signature or calcola_firma_documenti(DOCUMENTS_FOLDER)
+    return start_rebuild(
+        lambda index_dir: _build_index(pdf_files, docs_signature, index_dir),
+        CHROMA_PERSIST_DIRECTORY,
+    )
+
+
+def _inizializza_in_lettura():
+    # Ciclo 3 — FASE 22: un processo lettore apre la generazione pubblicata così
+    # com'è, anche se i PDF sono cambiati: la nuova la costruisce lo scrittore.
+    index_dir = _index_dir()
+    touch_reader_lease(current_generation(CHROMA_PERSIST_DIRECTORY), CHROMA_PERSIST_DIRECTORY)
+    try:
+        db = apri_knowledge_base(_build_embeddings(), index_dir)
+        existing = db.get()
+    except Exception as exc:
+        logger.warning("Indice non apribile in sola lettura: %s", exc)
+        existing = None
+    if not existing or not existing.get("ids"):
+        return None, (
+            "⚠️ Nessun indice pubblicato. Il processo è in sola lettura "
+            "(UNILAW_INDEX_READ_ONLY): l'indice lo costruisce lo scrittore, "
+            "ad esempio `python ingestion_watcher.py`."
+        )
+    n_documents = len((_read_manifest(index_dir) or {}).get("documents", []))
+    return db, f"✅ Knowledge base in sola lettura. PDF indicizzati: {n_documents}."
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
 def inizializza_conoscenza(
     docs_signature: dict | None = None,
     force_rebuild: bool = False,
+    generation: str | None = None,
 ):
     """
     Inizializza o ricostruisce la knowledge base ChromaDB.
+
+    Ciclo 3 — FASE 16: `generation` (la generazione attiva, vedi
+    `index_generations.current_generation`) fa parte della chiave della cache di
+    Streamlit: dopo la pubblicazione di una nuova generazione la chiamata
+    successiva apre il nuovo indice. Se i PDF sono cambiati ma esiste un indice
+    utilizzabile con gli stessi parametri, questo resta in uso mentre il nuovo
+    viene costruito in background; senza indice (o con `force_rebuild`) la
+    costruzione è sincrona. La cache tiene al più due voci (attiva e
+    precedente): gli indici delle generazioni superate non restano aperti.
+
+    Ciclo 3 — FASE 22: con `INDEX_READ_ONLY` il processo è un lettore e apre
+    soltanto la generazione pubblicata, senza mai costruire l'indice.
     """
+    if INDEX_READ_ONLY:
+        return _inizializza_in_lettura()
+
     folder_path = DOCUMENTS_FOLDER
 
     if not os.path.exists(folder_path):
@@ -249,53 +647,53 @@ def inizializza_conoscenza(
 
     docs_signature = docs_signature or calcola_firma_documenti(folder_path)
     rebuild = _should_rebuild(force_rebuild, docs_signature)
-
-    if rebuild:
-        _delete_existing_index()
-
-    Path(CHROMA_PERSIST_DIRECTORY).mkdir(parents=True, exist_ok=True)
-
-    embeddings = _build_embeddings()
-    chroma_settings = _build_chroma_settings()
+    index_dir = _index_dir()
+    manifest = _read_manifest(index_dir)
 
     try:
-        if rebuild:
-            all_chunks = _load_and_split_documents(pdf_files)
-
-            if not all_chunks:
-                return None, "⚠️ Nessun contenuto valido estratto dai PDF."
-
-            db = Chroma.from_documents(
-                documents=all_chunks,
-                embedding=embeddings,
-                persist_directory=CHROMA_PERSIST_DIRECTORY,
-                client_settings=chroma_settings,
-            )
-
-            _write_manifest(docs_signature)
-
-            return (
-                db,
-                f"✅ Knowledge base ricostruita. PDF letti: {len(pdf_files)}. Chunk creati: {len(all_chunks)}.",
-            )
-
-        db = Chroma(
-            persist_directory=CHROMA_PERSIST_DIRECTORY,
-            embedding_function=embeddings,
-            client_settings=chroma_settings,
+        # Indice attivo servibile: aggiornato, oppure da ricostruire solo perché i
+        # PDF sono cambiati (stessi parametri dell'indice).
+        servable = not rebuild or (
+            not force_rebuild
+            and manifest is not None
+            and manifest.get("index", _LEGACY_INDEX_SETTINGS) == _index_settings()
+        )
+        if servable:
+            db = apri_knowledge_base(_build_embeddings(), index_dir)
+            existing = db.get()
+            if existing and existing.get("ids"):
+                if not rebuild:
+                    return db, f"✅ Knowledge base caricata da disco. PDF disponibili: {len(pdf_files)}."
+                # Ciclo 3 — FASE 21: con un watcher attivo il rebuild è compito suo.
+                from ingestion_watcher import watcher_active
+
+                if watcher_active():
+                    return (
+                        db,
+                        f"⏳ PDF cambiati: knowledge base attuale in uso, il watcher dei documenti "
+                        f"pubblicherà la nuova versione. PDF disponibili: {len(pdf_files)}.",
+                    )
+                avvia_ricostruzione(docs_signature)
+                return (
+                    db,
+                    f"⏳ PDF cambiati: knowledge base attuale in uso, la nuova versione è in "
+                    f"costruzione in background. PDF disponibili: {len(pdf_files)}.",
+                )
+
+        Path(CHROMA_PERSIST_DIRECTORY).mkdir(parents=True, exist_ok=True)
+        build = IndexRebuild(
+            lambda new_dir: _build_index(pdf_files, docs_signature, new_dir),
+            CHROMA_PERSIST_DIRECTORY,
+        )
+        build.run()
+        if build.error is not None:
+            return None, f"⚠️ Errore inizializzazione knowledge base: {build.error}"
+
+        db, n_chunks = build.result
+        return (
+            db,
+            f"✅ Knowledge base ricostruita. PDF letti: {len(pdf_files)}. Chunk creati: {n_chunks}.",
         )
-
-        existing = db.get()
-        has_documents = bool(existing and existing.get("ids"))
-
-        if not has_documents:
-            inizializza_conoscenza.clear()
-            return inizializza_conoscenza(
-                docs_signature=docs_signature,
-                force_rebuild=True,
-            )
-
-        return db, f"✅ Knowledge base caricata da disco. PDF disponibili: {len(pdf_files)}."
 
     except Exception as exc:
         logger.exception("Errore inizializzazione knowledge base")
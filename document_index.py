@@ -0,0 +1,182 @@
+"""Indice a livello di documento per il retrieval a due stadi (Ciclo 3 — FASE 14).
+
+`retrieval.run_vector_queries` interroga, per ogni variante, tutti i chunk di
+tutti i PDF, anche se quasi ogni domanda riguarda una sola famiglia di documenti
+(il regolamento di un corso, il bando Erasmus, il bando della borsa). Qui ogni PDF
+viene riassunto da pochi centroidi: la media normalizzata dei vettori dei chunk
+di alcune sezioni consecutive di pagine (un regolamento lungo tocca argomenti
+diversi, un solo centroide li confonderebbe). Il primo stadio sceglie i documenti
+con il centroide più vicino alla query, il secondo cerca solo fra i loro chunk.
+
+L'indice si ricava dai vettori già memorizzati nel vector store (nessun nuovo
+embedding): è costruito all'indicizzazione e salvato accanto al manifest, legato
+alla sua firma come la cache delle varianti (FASE 4); se la firma non coincide
+viene ricalcolato al caricamento.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from config import (
+    CHROMA_PERSIST_DIRECTORY,
+    DOCUMENT_INDEX_CENTROIDS,
+    DOCUMENT_INDEX_FILE,
+    INDEX_MANIFEST_FILE,
+    INDEX_READ_ONLY,
+)
+from index_generations import active_index_dir, store_index_dir, write_index_artifact
+from variant_cache import manifest_digest
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+class DocumentIndex:
+    """Centroidi per documento: `centroids[i]` appartiene al documento `owners[i]`."""
+
+    def __init__(self, sources, course_tags, owners, centroids, signature: str | None = None):
+        self.sources = list(sources)
+        self.course_tags = list(course_tags)
+        self.owners = np.asarray(owners, dtype=np.int64)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.signature = signature
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    @classmethod
+    def build(
+        cls,
+        metadatas: list,
+        embeddings,
+        sections: int = DOCUMENT_INDEX_CENTROIDS,
+        signature: str | None = None,
+    ) -> "DocumentIndex":
+        """Raggruppa i chunk per `source`, in ordine di pagina, e ne calcola i centroidi."""
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        rows_by_source: dict = {}
+        for row, metadata in enumerate(metadatas):
+            metadata = metadata or {}
+            rows_by_source.setdefault(metadata.get("source", ""), []).append(row)
+
+        sources, course_tags, owners, centroids = [], [], [], []
+        for owner, (source, rows) in enumerate(sorted(rows_by_source.items())):
+            rows.sort(key=lambda r: ((metadatas[r] or {}).get("page", 0), r))
+            sources.append(source)
+            course_tags.append((metadatas[rows[0]] or {}).get("course_tag", "generale"))
+            for section in np.array_split(np.array(rows), min(max(1, sections), len(rows))):
+                centroids.append(vectors[section].mean(axis=0))
+                owners.append(owner)
+
+        dim = vectors.shape[1] if vectors.ndim == 2 else 0
+        matrix = _normalize(np.array(centroids, dtype=np.float32).reshape(-1, dim))
+        return cls(sources, course_tags, owners, matrix, signature)
+
+    @classmethod
+    def from_vector_db(
+        cls, vector_db, sections: int = DOCUMENT_INDEX_CENTROIDS, signature: str | None = None
+    ) -> "DocumentIndex":
+        """Costruisce l'indice dai metadata e dai vettori memorizzati nel vector store."""
+        data = vector_db.get(include=["metadatas", "embeddings"])
+        embeddings = data.get("embeddings")
+        if embeddings is None or len(embeddings) != len(data.get("ids") or []):
+            raise ValueError("il vector store non restituisce i vettori dei chunk")
+        return cls.build(data["metadatas"], embeddings, sections, signature)
+
+    def select(self, query_vec, n: int, course_tags: list[str] | None = None) -> list[str]:
+        """Primo stadio: i `n` documenti più vicini alla query (coseno, massimo sui centroidi).
+
+        Con `course_tags` si considerano solo i documenti di quei corsi (stessa regola
+        di `reranking.filter_documents_by_course`, vedi `prefilter_course_tags`).
+        """
+        if not len(self.sources) or n <= 0:
+            return []
+        query = _normalize(np.asarray(query_vec, dtype=np.float32))
+        scores = np.full(len(self.sources), -np.inf, dtype=np.float32)
+        np.maximum.at(scores, self.owners, self.centroids @ query)
+        if course_tags:
+            allowed = set(course_tags)
+            scores[[tag not in allowed for tag in self.course_tags]] = -np.inf
+
+        order = np.argsort(-scores, kind="stable")[:n]
+        return [self.sources[i] for i in order if np.isfinite(scores[i])]
+
+    def save(self, path: Path) -> None:
+        write_index_artifact(path, lambda fh: np.savez(
+            fh,
+            sources=np.array(self.sources, dtype=str),
+            course_tags=np.array(self.course_tags, dtype=str),
+            owners=self.owners,
+            centroids=self.centroids,
+            signature=np.array(self.signature or ""),
+        ))
+
+    @classmethod
+    def load(cls, path: Path) -> "DocumentIndex":
+        with np.load(path) as data:
+            return cls(
+                data["sources"].tolist(),
+                data["course_tags"].tolist(),
+                data["owners"],
+                data["centroids"],
+                str(data["signature"]) or None,
+            )
+
+
+def load_index_document_index(
+    vector_db, rebuild: bool = False, index_dir: Path | None = None
+) -> DocumentIndex | None:
+    """Indice dei documenti per l'indice persistito in `index_dir`.
+
+    Senza `index_dir`, la cartella da cui è stato aperto `vector_db`
+    (`store_index_dir`) o la generazione attiva sotto `CHROMA_PERSIST_DIRECTORY`
+    (FASE 16). Legge il file se è legato alla firma del manifest corrente,
+    altrimenti (o con `rebuild`, dopo una reindicizzazione) lo ricalcola dal
+    vector store e lo salva.
+    Ogni errore è gestito con un avviso e restituisce None: il retrieval torna
+    allora alla ricerca su tutti i chunk.
+    """
+    if vector_db is None:
+        return None
+
+    index_dir = Path(index_dir or store_index_dir(vector_db) or active_index_dir(CHROMA_PERSIST_DIRECTORY))
+    path = index_dir / DOCUMENT_INDEX_FILE
+    try:
+        manifest = json.loads((index_dir / INDEX_MANIFEST_FILE).read_text(encoding="utf-8"))
+    except Exception as exc:
+        logger.warning("Manifest non leggibile, indice dei documenti non legato a una firma: %s", exc)
+        manifest = None
+    signature = manifest_digest(manifest)
+
+    if not rebuild and signature is not None and path.exists():
+        try:
+            index = DocumentIndex.load(path)
+            if index.signature == signature:
+                return index
+        except Exception as exc:
+            logger.warning("Indice dei documenti non leggibile, si ricalcola: %s", exc)
+
+    try:
+        index = DocumentIndex.from_vector_db(vector_db, signature=signature)
+    except Exception as exc:
+        logger.warning("Indice dei documenti non disponibile, retrieval su tutti i chunk: %s", exc)
+        return None
+
+    # Ciclo 3 — FASE 22: un lettore non scrive mai nella generazione pubblicata.
+    if signature is not None and not INDEX_READ_ONLY:
+        try:
+            index.save(path)
+        except Exception as exc:
+            logger.warning("Indice dei documenti non salvato: %s", exc)
+
+    logger.info(
+        "Indice dei documenti: %d PDF, %d centroidi.", len(index), len(index.centroids)
+    )
+    return index
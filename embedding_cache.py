@@ -0,0 +1,150 @@
+"""Cache degli embedding dei chunk indirizzata per contenuto (Ciclo 3 — FASE 17).
+
+Ogni rebuild ricalcolava l'embedding di tutti i chunk, anche quando cambiavano
+solo `CHUNK_SIZE`/`CHUNK_OVERLAP` o una pagina di un PDF: la gran parte dei
+testi era identica a quella del rebuild precedente. Qui il vettore di ogni testo
+viene salvato con chiave hash(modello, testo) in un piccolo archivio
+chiave-valore SQLite (chiave di 16 byte, vettore float32 grezzo) nella radice
+di `CHROMA_PERSIST_DIRECTORY`, condiviso da tutte le generazioni dell'indice
+(FASE 16). `CachedEmbeddings` avvolge il modello: `embed_documents` legge
+dall'archivio i testi già visti e calcola solo i mancanti, in un'unica chiamata.
+
+La chiave contiene il nome del modello e la sua precisione (float o int8, FASE
+10): un cambio di modello non riusa vettori non compatibili.
+"""
+
+import hashlib
+import logging
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from config import EMBEDDING_MODEL_NAME, MODEL_QUANTIZATION_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# Limite prudente ai parametri di una query SQLite (`?` per IN).
+_SQL_BATCH = 500
+
+
+def embedding_model_key(
+    model_name: str = EMBEDDING_MODEL_NAME, quantize: bool = MODEL_QUANTIZATION_ENABLED
+) -> str:
+    """Identità del modello che produce i vettori (nome e precisione)."""
+    return f"{model_name}|{'int8' if quantize else 'float'}"
+
+
+def embedding_key(model_key: str, text: str) -> bytes:
+    """Chiave di contenuto: i primi 16 byte dello SHA-256 di modello e testo."""
+    return hashlib.sha256(f"{model_key}\x00{text}".encode("utf-8")).digest()[:16]
+
+
+class EmbeddingCache:
+    """Archivio chiave → vettore float32 su un file SQLite.
+
+    Ogni operazione apre e chiude la propria connessione: l'archivio si usa dal
+    thread del rebuild (FASE 16) senza condividere connessioni fra thread.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL) WITHOUT ROWID"
+        )
+        return conn
+
+    def __len__(self) -> int:
+        if not self.path.exists():
+            return 0
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        finally:
+            conn.close()
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """Vettori presenti nell'archivio per le chiavi date (le assenti sono omesse)."""
+        if not keys or not self.path.exists():
+            return {}
+        found = {}
+        conn = self._connect()
+        try:
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        finally:
+            conn.close()
+        return found
+
+    def put_many(self, items: dict[bytes, np.ndarray]) -> None:
+        if not items:
+            return
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()],
+                )
+        finally:
+            conn.close()
+
+
+class CachedEmbeddings:
+    """Funzione di embedding che consulta `cache` prima del modello.
+
+    Solo `embed_documents` (i chunk) passa dalla cache; `embed_query` e gli altri
+    attributi sono quelli del modello avvolto. `hits`/`misses` contano i testi
+    dell'ultima chiamata.
+    """
+
+    def __init__(self, embeddings, cache: EmbeddingCache, model_key: str | None = None):
+        self._embeddings = embeddings
+        self.cache = cache
+        self.model_key = model_key or embedding_model_key()
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self._embeddings, name)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embeddings.embed_query(text)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [embedding_key(self.model_key, text) for text in texts]
+        try:
+            vectors = self.cache.get_many(keys)
+        except Exception as exc:
+            logger.warning("Cache degli embedding non leggibile, si ricalcola tutto: %s", exc)
+            vectors = {}
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            computed = self._embeddings.embed_documents(list(missing.values()))
+            new = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, computed)}
+            vectors.update(new)
+            try:
+                self.cache.put_many(new)
+            except Exception as exc:
+                logger.warning("Cache degli embedding non aggiornata: %s", exc)
+
+        self.hits = len(texts) - len(missing)
+        self.misses = len(missing)
+        logger.info(
+            "Embedding dei chunk: %d dalla cache, %d calcolati.", self.hits, self.misses
+        )
+        return [vectors[key].tolist() for key in keys]
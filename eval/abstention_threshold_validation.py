@@ -42,8 +42,6 @@ os.chdir(ROOT)
 warnings.filterwarnings("ignore")
 logging.disable(logging.CRITICAL)
 
-from langchain_community.vectorstores import Chroma  # noqa: E402
-
 from abstention import (  # noqa: E402
     INSUFFICIENT_EVIDENCE,
     OUT_OF_DOMAIN,
@@ -60,7 +58,7 @@ from config import (  # noqa: E402
     CHROMA_PERSIST_DIRECTORY,
     DEFAULT_MODEL_NAME,
 )
-from database import _build_chroma_settings, _build_embeddings  # noqa: E402
+from database import apri_knowledge_base  # noqa: E402
 
 DATASET = os.path.join(ROOT, "eval", "questions_baseline.jsonl")
 REPORTS_DIR = os.path.join(ROOT, "eval", "reports")
@@ -88,10 +86,21 @@ def measure_strength(
     retrieval); con `embedder=None` vale 0.0 (la sezione semantica resta vuota).
     """
     intent = responder._infer_query_intent(question, {})
+    responder._last_query_vectors = {}
     docs = responder._retrieve_documents(question, intent)
     sources = responder._prepare_sources(docs) if docs else []
     lexical = retrieval_strength(question, sources)
-    semantic = semantic_retrieval_strength(question, sources, embedder) if embedder else 0.0
+    # Ciclo 3 — FASE 1: stessi vettori (memorizzati/già calcolati) usati dal responder.
+    semantic = (
+        semantic_retrieval_strength(
+            question,
+            sources,
+            embedder,
+            query_vector=responder._last_query_vectors.get(question),
+        )
+        if embedder
+        else 0.0
+    )
     return lexical, semantic, len(sources)
 
 
@@ -118,11 +127,7 @@ def evaluate_split(rows: list[dict], threshold: float, key: str = "strength") ->
 
 def main() -> None:
     print(f"Caricamento indice ChromaDB da {CHROMA_PERSIST_DIRECTORY} ...")
-    db = Chroma(
-        persist_directory=CHROMA_PERSIST_DIRECTORY,
-        embedding_function=_build_embeddings(),
-        client_settings=_build_chroma_settings(),
-    )
+    db = apri_knowledge_base()
     if not db.get().get("ids"):
         raise SystemExit("Indice vuoto: ricostruisci la knowledge base.")
     responder = UniLawResponder(db)
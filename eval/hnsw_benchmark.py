@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Benchmark dei parametri HNSW (Ciclo 3 — FASE 12): recall e latenza vs ricerca esatta.
+
+Per ogni combinazione di (M, construction_ef, search_ef) costruisce una collezione
+Chroma in memoria con gli stessi vettori dell'indice e misura, rispetto alla
+ricerca esatta (un prodotto matrice-vettore in NumPy, come l'indice piatto di
+FASE 11):
+- recall@k dell'arm vettoriale, con k = fetch_k dell'MMR (`max(2·DEFAULT_K_RETRIEVAL, 20)`);
+- latenza per query p50/p95 (ms) e tempo di costruzione.
+
+Corpora: l'indice reale (query = varianti di `questions_baseline.jsonl` incorporate
+con il modello di embedding) e corpora sintetici ingranditi (`--sizes`), ottenuti
+campionando i vettori reali con rumore gaussiano (query = vettori del corpus
+perturbati). Con `--synthetic-only` non servono né l'indice né il modello: i vettori
+sono casuali di dimensione `--dim`.
+
+Per ogni corpus indica la combinazione più veloce (p95) con recall ≥ `--target-recall`:
+è il valore da riportare in `config.py` (HNSW_*) quando il corpus cresce.
+
+Con `--compact int8,float16,int8:128` (Ciclo 3 — FASE 13) misura anche l'indice
+piatto con vettori compatti (modalità[:dimensioni PCA]) e rescoring esatto: recall
+rispetto alla ricerca esatta, latenza e MB dei vettori compatti (solo spazio L2).
+
+Uso:
+    python eval/hnsw_benchmark.py
+    python eval/hnsw_benchmark.py --sizes 5000,20000 --m 8,16,32 --search-ef 10,32,64,128
+    python eval/hnsw_benchmark.py --synthetic-only --dim 384 --sizes 10000
+    python eval/hnsw_benchmark.py --compact int8,int8:128 --m 16 --search-ef 10,64
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+warnings.filterwarnings("ignore")
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+import numpy as np  # noqa: E402
+
+from config import DEFAULT_K_RETRIEVAL, HNSW_SPACE  # noqa: E402
+
+DATASET = os.path.join(ROOT, "eval", "questions_baseline.jsonl")
+REPORTS_DIR = os.path.join(ROOT, "eval", "reports")
+FETCH_K = max(DEFAULT_K_RETRIEVAL * 2, 20)
+
+
+def _ints(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def load_real_corpus():
+    """Vettori dell'indice persistito e vettori delle varianti di query del dataset."""
+    from database import apri_knowledge_base
+    from intent import infer_query_intent
+    from retrieval import build_query_variants
+
+    vdb = apri_knowledge_base()
+    data = vdb.get(include=["embeddings"])
+    if not data.get("ids"):
+        raise SystemExit("Indice vuoto: ricostruisci la knowledge base (o usa --synthetic-only).")
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+
+    with open(DATASET, encoding="utf-8") as fh:
+        questions = [json.loads(line)["question"] for line in fh if line.strip()]
+    variants = []
+    for question in questions:
+        variants.extend(build_query_variants(question, infer_query_intent(question, {})))
+    variants = list(dict.fromkeys(variants))
+    queries = np.asarray([vdb._embedding_function.embed_query(v) for v in variants], dtype=np.float32)
+    return vectors, queries
+
+
+def enlarge(base, size, rng, noise=0.1):
+    """Corpus sintetico di `size` vettori: righe di `base` campionate + rumore."""
+    rows = base[rng.integers(0, len(base), size)]
+    scale = noise * base.std(axis=0, keepdims=True)
+    return (rows + rng.normal(size=rows.shape) * scale).astype(np.float32)
+
+
+def exact_search(vectors, queries, k, space):
+    """Top-k esatto e latenze per query (ms) con lo stesso spazio della collezione."""
+    if space == "cosine":
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+    truth, latencies = [], []
+    for query in queries:
+        t0 = time.perf_counter()
+        if space == "cosine":
+            scores = vectors @ (query / np.linalg.norm(query))
+        elif space == "ip":
+            scores = vectors @ query
+        else:
+            scores = 2.0 * (vectors @ query) - sq_norms
+        truth.append(set(np.argsort(-scores, kind="stable")[:k].tolist()))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return truth, latencies
+
+
+def hnsw_search(client, vectors, queries, truth, k, space, m, construction_ef, search_ef):
+    name = f"bench_{m}_{construction_ef}_{search_ef}"
+    collection = client.create_collection(
+        name,
+        metadata={
+            "hnsw:space": space,
+            "hnsw:M": m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": search_ef,
+        },
+    )
+    t0 = time.perf_counter()
+    for start in range(0, len(vectors), 5000):
+        chunk = vectors[start:start + 5000]
+        collection.add(
+            ids=[str(i) for i in range(start, start + len(chunk))],
+            embeddings=chunk.tolist(),
+        )
+    build_s = time.perf_counter() - t0
+
+    recalls, latencies = [], []
+    for query, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found = {int(i) for i in result["ids"][0]}
+        recalls.append(len(found & expected) / max(1, len(expected)))
+
+    client.delete_collection(name)
+    return float(np.mean(recalls)), latencies, build_s
+
+
+def compact_search(vectors, queries, truth, k, spec):
+    """Indice piatto con vettori compatti (`spec` = "int8" o "int8:128") e rescoring esatto."""
+    from vector_store import FlatVectorStore
+
+    mode, _, pca_dim = spec.partition(":")
+    n = len(vectors)
+    with tempfile.TemporaryDirectory() as directory:
+        t0 = time.perf_counter()
+        store = FlatVectorStore.from_vectors(
+            directory, [str(i) for i in range(n)], [""] * n, [{}] * n, vectors,
+            compact=mode, pca_dim=int(pca_dim or 0),
+        )
+        build_s = time.perf_counter() - t0
+        recalls, latencies = [], []
+        for query, expected in zip(queries, truth):
+            t0 = time.perf_counter()
+            found = {int(i) for i in store.query(query, k)["ids"]}
+            latencies.append((time.perf_counter() - t0) * 1000)
+            recalls.append(len(found & expected) / max(1, len(expected)))
+        compact_mb = store.footprint()["compact_bytes"] / (1024 * 1024)
+    return float(np.mean(recalls)), latencies, build_s, compact_mb
+
+
+def _pct(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_corpus(client, label, vectors, queries, grid, k, space, target_recall, compact=()):
+    truth, exact_lat = exact_search(vectors, queries, k, space)
+    rows = [
+        {
+            "corpus": label,
+            "n": len(vectors),
+            "config": "esatta",
+            "recall": 1.0,
+            "p50_ms": _pct(exact_lat, 50),
+            "p95_ms": _pct(exact_lat, 95),
+            "build_s": 0.0,
+        }
+    ]
+    for m, construction_ef, search_ef in grid:
+        recall, latencies, build_s = hnsw_search(
+            client, vectors, queries, truth, k, space, m, construction_ef, search_ef
+        )
+        rows.append(
+            {
+                "corpus": label,
+                "n": len(vectors),
+                "config": f"M={m} cef={construction_ef} sef={search_ef}",
+                "m": m,
+                "construction_ef": construction_ef,
+                "search_ef": search_ef,
+                "recall": recall,
+                "p50_ms": _pct(latencies, 50),
+                "p95_ms": _pct(latencies, 95),
+                "build_s": build_s,
+            }
+        )
+
+    for spec in compact if space == "l2" else ():
+        recall, latencies, build_s, compact_mb = compact_search(vectors, queries, truth, k, spec)
+        rows.append(
+            {
+                "corpus": label,
+                "n": len(vectors),
+                "config": f"piatto {spec} ({compact_mb:.1f} MB)",
+                "compact": spec,
+                "compact_mb": compact_mb,
+                "full_mb": vectors.nbytes / (1024 * 1024),
+                "recall": recall,
+                "p50_ms": _pct(latencies, 50),
+                "p95_ms": _pct(latencies, 95),
+                "build_s": build_s,
+            }
+        )
+
+    for row in rows:
+        print(
+            f"{row['corpus']:>12} | {row['n']:7d} | {row['config']:>26} | {row['recall']:.3f} | "
+            f"{row['p50_ms']:7.2f} | {row['p95_ms']:7.2f} | {row['build_s']:6.1f}"
+        )
+    eligible = [r for r in rows[1:] if r["recall"] >= target_recall]
+    best = min(eligible, key=lambda r: r["p95_ms"]) if eligible else None
+    print(
+        f"{'':>12}   consigliato (recall ≥ {target_recall}): "
+        f"{best['config'] if best else 'nessuno: alzare search_ef o usare la ricerca esatta'}\n"
+    )
+    return rows, best
+
+
+def main():
+    import argparse
+
+    import chromadb
+    from chromadb.config import Settings
+
+    parser = argparse.ArgumentParser(description="Benchmark HNSW UniLaw Agent")
+    parser.add_argument("--m", default="8,16,32", help="Valori di M (default: %(default)s).")
+    parser.add_argument("--construction-ef", default="100,200", help="Valori di construction_ef.")
+    parser.add_argument("--search-ef", default="10,32,64,128", help="Valori di search_ef.")
+    parser.add_argument("--sizes", default="5000,20000", help="Corpora sintetici (vettori).")
+    parser.add_argument("--queries", type=int, default=200, help="Query per i corpora sintetici.")
+    parser.add_argument("--k", type=int, default=FETCH_K, help="k del recall (default: fetch_k MMR).")
+    parser.add_argument("--space", default=HNSW_SPACE, choices=["l2", "cosine", "ip"])
+    parser.add_argument("--target-recall", type=float, default=0.99)
+    parser.add_argument("--synthetic-only", action="store_true", help="Niente indice né modello.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimensione con --synthetic-only.")
+    parser.add_argument(
+        "--compact",
+        default="",
+        help="Indice piatto con vettori compatti, es. int8,float16,int8:128 (solo spazio l2).",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    grid = list(itertools.product(_ints(args.m), _ints(args.construction_ef), _ints(args.search_ef)))
+
+    corpora = []
+    if args.synthetic_only:
+        base = rng.normal(size=(1000, args.dim)).astype(np.float32)
+    else:
+        print("Caricamento indice e incorporamento delle varianti di query ...")
+        base, real_queries = load_real_corpus()
+        corpora.append(("reale", base, real_queries))
+    for size in _ints(args.sizes):
+        vectors = enlarge(base, size, rng)
+        queries = enlarge(vectors, args.queries, rng, noise=0.2)
+        corpora.append(("sintetico", vectors, queries))
+
+    client = chromadb.EphemeralClient(Settings(anonymized_telemetry=False))
+    print(f"spazio={args.space} k={args.k} | {len(grid)} combinazioni\n")
+    print(f"{'corpus':>12} | {'n':>7} | {'configurazione':>26} | recall | p50 ms  | p95 ms  | build s")
+    print("-" * 96)
+
+    report = {"space": args.space, "k": args.k, "target_recall": args.target_recall, "corpora": []}
+    for label, vectors, queries in corpora:
+        rows, best = run_corpus(
+            client, label, vectors, queries, grid, args.k, args.space, args.target_recall,
+            compact=[spec for spec in args.compact.split(",") if spec.strip()],
+        )
+        report["corpora"].append({"corpus": label, "n": len(vectors), "rows": rows, "best": best})
+
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    out = os.path.join(REPORTS_DIR, "hnsw_benchmark.json")
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"Report: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Benchmark di memoria dell'ingestione (Ciclo 3 — FASE 19): `load()` vs streaming.
+
+Genera un PDF sintetico di `--pages` pagine (testo di regolamento, ~3.000
+caratteri a pagina) e lo indicizza nell'indice piatto in due modi, ognuno in un
+processo separato:
+- `load`: il percorso precedente alla FASE 19, `PyPDFLoader.load()` di tutte le
+  pagine, `split_documents`, embedding dell'intero corpus in una chiamata,
+  `FlatVectorStore.build`;
+- `stream`: il percorso di `database._build_index`, pagine con `lazy_load`, lotti
+  di `--batch` chunk da `_stream_batches`, `FlatVectorStore.build_batches`.
+
+Per ciascuno riporta il picco delle allocazioni Python e NumPy (tracemalloc), il
+picco di RSS del processo e il tempo. Gli embedding sono finti (vettori
+deterministici di `--dim` float, come li restituisce `HuggingFaceEmbeddings`:
+liste di float Python) così la misura riguarda l'ingestione, non il modello; con
+`--model` si usa il modello di embedding vero. Le cache di pagine ed embedding
+(FASE 17-18) sono disattivate.
+
+Uso:
+    python eval/ingestion_memory_benchmark.py
+    python eval/ingestion_memory_benchmark.py --pages 3000 --batch 128
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+warnings.filterwarnings("ignore")
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+import numpy as np  # noqa: E402
+
+REPORTS_DIR = os.path.join(ROOT, "eval", "reports")
+
+_SENTENCES = [
+    "Lo studente che non raggiunge la soglia del TOLC-I è ammesso con obbligo formativo aggiuntivo",
+    "Il piano di studi può essere modificato entro i termini stabiliti dal calendario accademico",
+    "La prova finale consiste nella discussione di un elaborato concordato con il relatore",
+    "Le attività di mobilità Erasmus sono riconosciute previa approvazione del learning agreement",
+    "I crediti formativi universitari acquisiti sono registrati nella carriera dello studente",
+]
+
+
+def write_synthetic_pdf(path: str, pages: int) -> None:
+    """PDF di `pages` pagine di testo (Helvetica, ~45 righe) scritto con pypdf."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+    for number in range(pages):
+        page = writer.add_blank_page(595, 842)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+        lines = [f"Art. {number + 1}.{i + 1} {_SENTENCES[(number + i) % len(_SENTENCES)]} (pagina {number + 1})."
+                 for i in range(30)]
+        body = b" ".join(b"(%s) '" % line.encode("latin-1") for line in lines)
+        stream = DecodedStreamObject()
+        stream.set_data(b"BT /F1 7 Tf 30 810 Td 9 TL " + body + b" ET")
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    with open(path, "wb") as fh:
+        writer.write(fh)
+
+
+class _FakeEmbeddings:
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        rng = np.random.default_rng(len(texts))
+        return rng.standard_normal((len(texts), self.dim)).astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return [0.0] * self.dim
+
+
+def _run_mode(mode: str, pdf_path: str, batch: int, dim: int, model: bool) -> dict:
+    import database
+    from vector_store import FlatVectorStore
+
+    database.PAGE_CACHE_ENABLED = False
+    embeddings = database._build_embeddings() if model else _FakeEmbeddings(dim)
+    out_dir = tempfile.mkdtemp(prefix=f"ingest-{mode}-")
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    if mode == "load":
+        from langchain_community.document_loaders import PyPDFLoader
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        pages = PyPDFLoader(pdf_path).load()
+        for page in pages:
+            database._enrich_metadata(page, pdf_path)
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=database.CHUNK_SIZE, chunk_overlap=database.CHUNK_OVERLAP
+        )
+        chunks = list(database._unique_chunks(splitter.split_documents(pages), set()))
+        store = FlatVectorStore.build(
+            chunks, embeddings, out_dir, ids=[c.metadata["chunk_id"] for c in chunks]
+        )
+    else:
+        store = FlatVectorStore.build_batches(
+            (
+                ([c.metadata["chunk_id"] for c in chunks], chunks)
+                for chunks in database._stream_batches([pdf_path], batch_size=batch)
+            ),
+            embeddings,
+            out_dir,
+        )
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "mode": mode,
+        "chunks": len(store),
+        "seconds": round(elapsed, 2),
+        "traced_peak_mb": round(peak / 2**20, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark di memoria dell'ingestione UniLaw Agent")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=None, help="chunk per lotto (default: INGEST_BATCH_SIZE)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--model", action="store_true", help="usa il modello di embedding vero")
+    parser.add_argument("--_mode", help=argparse.SUPPRESS)
+    parser.add_argument("--_pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from config import INGEST_BATCH_SIZE
+
+    batch = args.batch or INGEST_BATCH_SIZE
+    if args._mode:
+        print(json.dumps(_run_mode(args._mode, args._pdf, batch, args.dim, args.model)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "regolamento_sintetico.pdf")
+        write_synthetic_pdf(pdf_path, args.pages)
+        size_mb = os.path.getsize(pdf_path) / 2**20
+        print(f"PDF sintetico: {args.pages} pagine, {size_mb:.1f} MB, lotti di {batch} chunk\n")
+
+        results = []
+        for mode in ("load", "stream"):
+            cmd = [sys.executable, os.path.abspath(__file__), "--_mode", mode, "--_pdf", pdf_path,
+                   "--batch", str(batch), "--dim", str(args.dim)] + (["--model"] if args.model else [])
+            output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'modo':>7} | chunk | tempo s | picco allocazioni MB | picco RSS MB")
+    print("-" * 66)
+    for r in results:
+        print(f"{r['mode']:>7} | {r['chunks']:5d} | {r['seconds']:7.2f} | {r['traced_peak_mb']:20.1f} | "
+              f"{r['max_rss_mb']:12.1f}")
+
+    report = {"pages": args.pages, "batch": batch, "dim": args.dim, "model": args.model, "results": results}
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    out = os.path.join(REPORTS_DIR, "ingestion_memory.json")
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"\nReport: {out}")
+
+
+if __name__ == "__main__":
+    main()
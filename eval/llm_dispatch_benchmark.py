@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Benchmark del dispatcher delle chiamate al modello (Ciclo 3 — FASE 25).
+
+Misura la latenza delle domande interattive mentre un job batch chiama lo
+stesso Ollama con `--batch-concurrency` richieste sempre in corso, in tre modi:
+
+- `solo`: solo domande interattive, nessun job batch (riferimento);
+- `fifo`: domande e batch vanno direttamente a Ollama, che le serve in ordine
+  di arrivo (come prima di questa fase);
+- `dispatcher`: tutto passa dal gateway di `llm_dispatcher.py` con classi
+  `interactive` e `batch`.
+
+Ollama è simulato da un server locale che genera al più `--parallel` risposte
+alla volta (come `OLLAMA_NUM_PARALLEL`) e impiega `--gen-ms` ms per risposta:
+nessun modello né indice serve. Le domande arrivano con tempi di interarrivo
+esponenziali (`--rate` al secondo). Riporta p50/p95 della latenza interattiva,
+le generazioni batch completate e le attese in coda per classe del gateway.
+
+Uso:
+    python eval/llm_dispatch_benchmark.py
+    python eval/llm_dispatch_benchmark.py --parallel 2 --batch-concurrency 8 --questions 80
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+import numpy as np  # noqa: E402
+
+REPORTS_DIR = os.path.join(ROOT, "eval", "reports")
+
+
+def _fake_ollama(parallel: int, gen_s: float) -> ThreadingHTTPServer:
+    slots = threading.Semaphore(parallel)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with slots:  # i thread in attesa sono serviti in ordine di arrivo
+                time.sleep(gen_s)
+            body = json.dumps({"message": {"role": "assistant", "content": "ok"}, "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _chat(url: str, priority: str) -> float:
+    from llm_dispatcher import PRIORITY_HEADER
+
+    data = json.dumps({"model": "finto", "messages": [{"role": "user", "content": "?"}], "stream": False})
+    request = urllib.request.Request(
+        url + "/api/chat", data=data.encode(), headers={"Content-Type": "application/json", PRIORITY_HEADER: priority}
+    )
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        response.read()
+    return time.perf_counter() - t0
+
+
+def run_mode(mode: str, args, ollama_url: str) -> dict:
+    from llm_dispatcher import PRIORITY_BATCH, PRIORITY_INTERACTIVE, DispatcherGateway, LLMDispatcher
+
+    gateway = None
+    url = ollama_url
+    if mode == "dispatcher":
+        gateway = DispatcherGateway(("127.0.0.1", 0), ollama_url, LLMDispatcher(max_inflight=args.parallel))
+        threading.Thread(target=gateway.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{gateway.server_address[1]}"
+
+    stop = threading.Event()
+    batch_done = [0]
+
+    def batch_loop():
+        while not stop.is_set():
+            _chat(url, PRIORITY_BATCH)
+            batch_done[0] += 1
+
+    batch = [threading.Thread(target=batch_loop, daemon=True) for _ in range(args.batch_concurrency if mode != "solo" else 0)]
+    for thread in batch:
+        thread.start()
+    time.sleep(args.gen_ms / 1000 * 2)  # il job batch è già a regime
+
+    rng = random.Random(25)
+    latencies: list[float] = []
+    lock = threading.Lock()
+
+    def ask():
+        latency = _chat(url, PRIORITY_INTERACTIVE)
+        with lock:
+            latencies.append(latency)
+
+    t0 = time.perf_counter()
+    questions = []
+    for _ in range(args.questions):
+        thread = threading.Thread(target=ask)
+        thread.start()
+        questions.append(thread)
+        time.sleep(rng.expovariate(args.rate))
+    for thread in questions:
+        thread.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for thread in batch:
+        thread.join()
+
+    result = {
+        "mode": mode,
+        "interactive_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "interactive_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "batch_per_s": round(batch_done[0] / elapsed, 2),
+        "gateway": gateway.dispatcher.stats() if gateway else None,
+    }
+    if gateway:
+        gateway.shutdown()
+        gateway.server_close()
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del dispatcher delle chiamate al modello")
+    parser.add_argument("--parallel", type=int, default=1, help="generazioni in parallelo di Ollama")
+    parser.add_argument("--gen-ms", type=int, default=200, help="durata di una generazione simulata")
+    parser.add_argument("--batch-concurrency", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=60)
+    parser.add_argument("--rate", type=float, default=1.0, help="domande interattive al secondo")
+    args = parser.parse_args()
+
+    ollama = _fake_ollama(args.parallel, args.gen_ms / 1000)
+    ollama_url = f"http://127.0.0.1:{ollama.server_address[1]}"
+    print(
+        f"Ollama simulato: {args.parallel} in parallelo, {args.gen_ms} ms per generazione; "
+        f"batch con {args.batch_concurrency} richieste in corso; {args.questions} domande a {args.rate}/s\n"
+    )
+    results = [run_mode(mode, args, ollama_url) for mode in ("solo", "fifo", "dispatcher")]
+    ollama.shutdown()
+
+    print(f"{'modo':>10} | interattive p50 ms | interattive p95 ms | batch/s")
+    print("-" * 62)
+    for r in results:
+        print(f"{r['mode']:>10} | {r['interactive_p50_ms']:18.1f} | {r['interactive_p95_ms']:18.1f} | {r['batch_per_s']:7.2f}")
+    classes = results[-1]["gateway"]["classes"]
+    print("\nAttesa nel gateway (modo dispatcher):")
+    for name, c in classes.items():
+        print(f"  {name:>11}: p50 {c['wait_ms_p50']} ms, p95 {c['wait_ms_p95']} ms, {c['granted']} generazioni")
+
+    report = {"parameters": vars(args), "results": results}
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    out = os.path.join(REPORTS_DIR, "llm_dispatch.json")
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"\nReport: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Benchmark del server preload-then-fork (Ciclo 3 — FASE 23): memoria e avvio per worker.
+
+Confronta N worker che servono lo stesso indice in due modi:
+- `independent`: N processi separati, ognuno carica modelli, indice, BM25 e
+  responder per conto suo (come N istanze Streamlit);
+- `prefork`: un padre carica lo stato una volta (`prefork.preload_state`), esegue
+  `gc.freeze()` e crea N worker con `fork` (`prefork.PreforkServer`).
+
+Ogni worker, una volta pronto, esegue un retrieval completo (varianti, vettoriale,
+BM25, reranking euristico) per toccare lo stato come farebbe una domanda reale.
+Per ogni worker riporta il tempo di avvio (processo nuovo: caricamento completo;
+fork: dal `fork` al worker pronto) e RSS, PSS e memoria privata (USS) letti da
+`/proc/<pid>/smaps_rollup` mentre tutti i worker sono vivi. La somma delle PSS è
+la memoria realmente occupata dai worker, padre compreso in `prefork`.
+
+Per default usa l'indice attivo e il modello di embedding veri. Con `--synthetic`
+non servono né l'indice né il modello: indice piatto di `--chunks` chunk sintetici
+e un modello finto deterministico con una tabella di pesi da `--model-mb` MB, che
+rende visibile quanta memoria del modello i worker condividono.
+
+Solo Linux (`/proc`).
+
+Uso:
+    python eval/prefork_benchmark.py --workers 4
+    python eval/prefork_benchmark.py --synthetic --workers 4 --model-mb 400 --chunks 20000
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+warnings.filterwarnings("ignore")
+import logging  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+import numpy as np  # noqa: E402
+
+REPORTS_DIR = os.path.join(ROOT, "eval", "reports")
+QUESTION = "Qual è la soglia del TOLC-I per l'accesso a Informatica senza OFA?"
+
+_SENTENCES = [
+    "Lo studente che non raggiunge la soglia del TOLC-I è ammesso con obbligo formativo aggiuntivo",
+    "Il piano di studi può essere modificato entro i termini stabiliti dal calendario accademico",
+    "La prova finale consiste nella discussione di un elaborato concordato con il relatore",
+    "Le attività di mobilità Erasmus sono riconosciute previa approvazione del learning agreement",
+    "I crediti formativi universitari acquisiti sono registrati nella carriera dello studente",
+]
+_COURSES = ["informatica", "scienze_educazione", "scienze_amministrazione"]
+
+
+class _HashEmbeddings:
+    """Modello finto: media delle righe di una tabella di pesi indicizzate per token."""
+
+    def __init__(self, model_mb: int, dim: int):
+        rows = max(1, model_mb * 2**20 // (4 * dim))
+        self.weights = np.random.default_rng(23).standard_normal((rows, dim), dtype=np.float32)
+
+    def _embed(self, text: str) -> list[float]:
+        rows = [zlib.crc32(token.encode("utf-8")) % len(self.weights) for token in text.lower().split()]
+        return self.weights[rows or [0]].mean(axis=0).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def build_synthetic_index(directory: str, chunks: int, model_mb: int, dim: int) -> None:
+    from langchain_core.documents import Document
+
+    from database import _flat_index_dir
+    from vector_store import FlatVectorStore
+
+    docs = []
+    for i in range(chunks):
+        course = _COURSES[i % len(_COURSES)]
+        text = f"Art. {i // 10 + 1}.{i % 10} {_SENTENCES[i % len(_SENTENCES)]} ({course}, comma {i})."
+        docs.append(Document(page_content=text, metadata={
+            "filename": f"regolamento_{course}_{i // 200}.pdf",
+            "page": i % 40,
+            "course_tag": course,
+            "doc_type": "regolamento",
+        }))
+    FlatVectorStore.build(docs, _HashEmbeddings(model_mb, dim), _flat_index_dir(directory),
+                          ids=[f"c{i}" for i in range(chunks)])
+
+
+def _preload(args):
+    import prefork
+
+    if not args.synthetic:
+        return prefork.preload_state()
+    from database import _flat_index_dir
+    from vector_store import FlatVectorStore
+
+    store = FlatVectorStore.load(_flat_index_dir(args.index), _HashEmbeddings(args.model_mb, args.dim))
+    return prefork.preload_state(store)
+
+
+def _touch(responder) -> None:
+    from intent import infer_query_intent
+    from rag_types import RagTrace
+
+    responder.last_trace = RagTrace(question=QUESTION)
+    responder._retrieve_documents(QUESTION, infer_query_intent(QUESTION, {}))
+
+
+def _run_independent_worker(args) -> None:
+    t0 = time.perf_counter()
+    responder = _preload(args)
+    _touch(responder)
+    print(json.dumps({"pid": os.getpid(), "startup_s": round(time.perf_counter() - t0, 2)}), flush=True)
+    sys.stdin.read()  # vivo finché il driver non chiude stdin
+
+
+def _run_prefork_server(args) -> None:
+    import prefork
+
+    def worker(responder, index):
+        _touch(responder)
+        os.write(ready_w, b"x")
+        while True:
+            time.sleep(3600)
+
+    ready_r, ready_w = os.pipe()
+    server = prefork.PreforkServer(lambda: _preload(args), worker, workers=args.workers).start()
+    for _ in range(args.workers):  # attende il retrieval di ogni worker
+        os.read(ready_r, 1)
+    report = server.report()
+    server.stop()
+    print(json.dumps(report), flush=True)
+
+
+def run_independent(args, base_cmd) -> dict:
+    procs = [subprocess.Popen(base_cmd + ["--_mode", "independent"], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+    workers = []
+    try:
+        for index, proc in enumerate(procs):
+            ready = json.loads(proc.stdout.readline())
+            workers.append({"index": index, **ready})
+        import prefork
+
+        for worker in workers:
+            worker.update(prefork.memory_usage(worker["pid"]))
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+    return {"preload_s": None, "parent": None, "workers": workers}
+
+
+def run_prefork(args, base_cmd) -> dict:
+    output = subprocess.run(base_cmd + ["--_mode", "prefork"], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _summary(mode: str, result: dict) -> dict:
+    workers = result["workers"]
+    processes = workers + ([result["parent"]] if result["parent"] else [])
+    return {
+        "mode": mode,
+        "preload_s": result["preload_s"],
+        "startup_s_max": max(w["startup_s"] for w in workers),
+        "rss_mb_per_worker": round(sum(w["rss_mb"] for w in workers) / len(workers), 1),
+        "uss_mb_per_worker": round(sum(w["uss_mb"] for w in workers) / len(workers), 1),
+        "pss_mb_total": round(sum(p["pss_mb"] for p in processes), 1),
+    }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark del server preload-then-fork di UniLaw Agent")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--synthetic", action="store_true", help="indice e modello finti")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--model-mb", type=int, default=400)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--_mode", help=argparse.SUPPRESS)
+    parser.add_argument("--index", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._mode == "independent":
+        _run_independent_worker(args)
+        return
+    if args._mode == "prefork":
+        _run_prefork_server(args)
+        return
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        raise SystemExit("Serve /proc/<pid>/smaps_rollup (Linux).")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base_cmd = [sys.executable, os.path.abspath(__file__), "--workers", str(args.workers)]
+        env_note = "indice attivo e modello reali"
+        if args.synthetic:
+            build_synthetic_index(tmp, args.chunks, args.model_mb, args.dim)
+            base_cmd += ["--synthetic", "--index", tmp, "--chunks", str(args.chunks),
+                         "--model-mb", str(args.model_mb), "--dim", str(args.dim)]
+            env_note = f"sintetico: {args.chunks} chunk, modello finto da {args.model_mb} MB"
+        print(f"{args.workers} worker, {env_note}\n")
+        results = {"independent": run_independent(args, base_cmd), "prefork": run_prefork(args, base_cmd)}
+
+    summaries = [_summary(mode, result) for mode, result in results.items()]
+    print(f"{'modo':>11} | precarico s | avvio worker s (max) | RSS/worker MB | USS/worker MB | PSS totale MB")
+    print("-" * 98)
+    for s in summaries:
+        preload = f"{s['preload_s']:.2f}" if s["preload_s"] is not None else "-"
+        print(f"{s['mode']:>11} | {preload:>11} | {s['startup_s_max']:20.3f} | {s['rss_mb_per_worker']:13.1f} | "
+              f"{s['uss_mb_per_worker']:13.1f} | {s['pss_mb_total']:13.1f}")
+
+    report = {
+        "workers": args.workers,
+        "synthetic": args.synthetic,
+        "chunks": args.chunks if args.synthetic else None,
+        "model_mb": args.model_mb if args.synthetic else None,
+        "summary": summaries,
+        "results": results,
+    }
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    out = os.path.join(REPORTS_DIR, "prefork_memory.json")
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"\nReport: {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Benchmark della quantizzazione int8 (Ciclo 3 — FASE 10): float vs int8, senza LLM.
+
+Confronta il modello di embedding in float e quantizzato in int8 (dinamico, layer
+lineari) su:
+- embeddings/s su un campione di chunk dell'indice;
+- memoria: peso dei pesi del modello e RSS del processo dopo il caricamento;
+- accordo fra i vettori (coseno medio float vs int8 sugli stessi testi);
+- retrieval-hit@5 sulle domande di `eval/questions_baseline.jsonl` con risposta
+  attesa (pipeline di `retrieval_ablation.retrieve`), interrogando lo stesso
+  indice con le query incorporate dall'uno o dall'altro modello.
+
+Con `--reranker` confronta anche il cross-encoder float vs int8 (coppie/s e hit@5
+dopo il reranking). Il gate: l'hit@5 int8 non deve scendere di più di
+`--tolerance` rispetto al float; in caso contrario lo script esce con codice 1.
+
+Uso:
+    python eval/quantization_benchmark.py
+    python eval/quantization_benchmark.py --reranker --tolerance 0.03
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+# retrieval_ablation prepara sys.path, cwd e logging come gli altri script di eval.
+from retrieval_ablation import DATASET, REPORTS_DIR, basename, load_dataset, retrieve  # noqa: E402
+
+from config import MAX_CONTEXT_DOCUMENTS, RERANKER_MODEL_NAME  # noqa: E402
+from database import apri_knowledge_base  # noqa: E402
+from intent import infer_query_intent  # noqa: E402
+from model_registry import get_embeddings, model_size_mb, process_rss_mb  # noqa: E402
+from neural_reranker import CrossEncoderReranker  # noqa: E402
+from retrieval import build_bm25_index  # noqa: E402
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+def load_embeddings(quantize):
+    rss = process_rss_mb()
+    t0 = time.perf_counter()
+    model = get_embeddings(quantize=quantize)
+    return model, {
+        "load_s": time.perf_counter() - t0,
+        "weights_mb": model_size_mb(model),
+        "rss_delta_mb": process_rss_mb() - rss,
+    }
+
+
+def throughput(embeddings, texts):
+    embeddings.embed_documents(texts[:4])  # primo batch fuori misura (init di torch)
+    t0 = time.perf_counter()
+    vectors = embeddings.embed_documents(texts)
+    return vectors, len(texts) / (time.perf_counter() - t0)
+
+
+def hit_rate(vdb, bm25, dataset, neural_reranker=None):
+    hits = 0
+    for q in dataset:
+        intent = infer_query_intent(q["question"], {})
+        docs = retrieve(vdb, bm25, q["question"], intent, True, neural_reranker=neural_reranker)
+        topk = [basename(d) for d in docs[:MAX_CONTEXT_DOCUMENTS]]
+        hits += any(d in topk for d in q["expected_docs"])
+    return hits / len(dataset)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark float vs int8 UniLaw Agent")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="Calo massimo ammesso dell'hit@5 int8 rispetto al float (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--texts",
+        type=int,
+        default=256,
+        help="Chunk dell'indice usati per misurare embeddings/s (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--reranker",
+        action="store_true",
+        help="Confronta anche il cross-encoder float vs int8.",
+    )
+    args = parser.parse_args()
+
+    dataset = [
+        q
+        for q in load_dataset(DATASET)
+        if q["expected_behavior"] == "answer" and q.get("expected_docs")
+    ]
+
+    report = {"n": len(dataset), "tolerance": args.tolerance, "embedding": {}, "reranker": {}}
+    vectors = {}
+    bm25 = None
+    texts = []
+    for label, quantize in (("float", False), ("int8", True)):
+        model, stats = load_embeddings(quantize)
+        vdb = apri_knowledge_base(model)
+        if bm25 is None:
+            if not vdb.get().get("ids"):
+                raise SystemExit("Indice vuoto: ricostruisci la knowledge base.")
+            bm25 = build_bm25_index(vdb)
+            texts = [t for t in vdb.get(limit=args.texts)["documents"] if t]
+        vectors[label], stats["embeddings_per_s"] = throughput(model, texts)
+        stats["hit_at_5"] = hit_rate(vdb, bm25, dataset)
+        report["embedding"][label] = stats
+
+    report["embedding"]["mean_cosine_float_int8"] = sum(
+        _cosine(a, b) for a, b in zip(vectors["float"], vectors["int8"])
+    ) / max(1, len(texts))
+
+    if args.reranker:
+        vdb = apri_knowledge_base(get_embeddings(quantize=False))
+        for label, quantize in (("float", False), ("int8", True)):
+            reranker = CrossEncoderReranker(RERANKER_MODEL_NAME, quantize=quantize, cache_size=0)
+            if not reranker.available():
+                raise SystemExit("Cross-encoder non disponibile: impossibile confrontarlo.")
+            t0 = time.perf_counter()
+            hit = hit_rate(vdb, bm25, dataset, neural_reranker=reranker)
+            report["reranker"][label] = {
+                "weights_mb": model_size_mb(reranker._model),
+                "questions_per_s": len(dataset) / (time.perf_counter() - t0),
+                "hit_at_5": hit,
+            }
+
+    print(f"{'modello':>22} | hit@5 | pesi MB | RSS +MB | emb/s (domande/s)")
+    print("-" * 72)
+    for kind, rows in (("embedding", report["embedding"]), ("reranker", report["reranker"])):
+        for label in ("float", "int8"):
+            row = rows.get(label)
+            if row is None:
+                continue
+            speed = row.get("embeddings_per_s", row.get("questions_per_s"))
+            print(
+                f"{kind + ' ' + label:>22} | {row['hit_at_5']:.3f} | {row['weights_mb']:7.0f} | "
+                f"{row.get('rss_delta_mb', 0):7.0f} | {speed:8.1f}"
+            )
+    print(f"\ncoseno medio float/int8: {report['embedding']['mean_cosine_float_int8']:.4f}")
+
+    failures = [
+        kind
+        for kind, rows in (("embedding", report["embedding"]), ("reranker", report["reranker"]))
+        if rows and rows["int8"]["hit_at_5"] < rows["float"]["hit_at_5"] - args.tolerance
+    ]
+    report["gate_passed"] = not failures
+
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    out = os.path.join(REPORTS_DIR, "quantization_benchmark.json")
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"Report: {out}")
+
+    if failures:
+        raise SystemExit(
+            f"Gate non superato: hit@5 int8 oltre la tolleranza {args.tolerance} per "
+            f"{', '.join(failures)}."
+        )
+    print(f"Gate superato: hit@5 int8 entro {args.tolerance} dal float.")
+
+
+if __name__ == "__main__":
+    main()
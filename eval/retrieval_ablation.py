@@ -7,12 +7,31 @@ metadata -> top-k) in due modalità:
 - `vector`: solo arm vettoriale (riproduce la baseline pre-FASE 3);
 - `hybrid`: arm vettoriale + BM25 fusi con RRF.
 
+Con `--prefilter` (Ciclo 3 — FASE 2) confronta invece hybrid vs hybrid con il
+pre-filtro per corso dentro la query; `--k` fissa il k per variante della
+configurazione con pre-filtro (per verificare se un k più piccolo mantiene lo
+stesso retrieval-hit).
+
+Con `--budget 10,20,40` (Ciclo 3 — FASE 5) misura invece, per ogni budget di
+candidati dopo la fusione RRF (statico e adattivo), il recall@5 (retrieval-hit
+sui primi MAX_CONTEXT_DOCUMENTS) e il numero medio di candidati rerankati,
+rispetto alla pipeline senza limite. Con `--reranker --cascade` (FASE 7)
+confronta il cross-encoder sempre attivo con la cascata e conta le invocazioni.
+
+Con `--two-stage` (Ciclo 3 — FASE 14) confronta hybrid vs hybrid con l'arm
+vettoriale a due stadi (indice dei documenti, poi chunk dei soli documenti
+scelti) e riporta il tempo medio di recupero delle due configurazioni.
+
 Riporta, per ciascuna modalità: retrieval-hit, rango medio del primo documento
 atteso nella lista ri-ordinata, e quante domande migliorano/peggiorano/restano
 uguali passando da vector a hybrid. NON richiede Ollama (nessuna generazione).
 
 Uso:
     python eval/retrieval_ablation.py
+    python eval/retrieval_ablation.py --prefilter --k 8
+    python eval/retrieval_ablation.py --budget 10,20,40
+    python eval/retrieval_ablation.py --reranker --cascade
+    python eval/retrieval_ablation.py --two-stage
 """
 
 from __future__ import annotations
@@ -20,6 +39,7 @@ from __future__ import annotations
 import json
 import os
 import sys
+import time
 import warnings
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -31,19 +51,25 @@ import logging  # noqa: E402
 
 logging.disable(logging.CRITICAL)
 
-from langchain_community.vectorstores import Chroma  # noqa: E402
-
 from config import (  # noqa: E402
     CHROMA_PERSIST_DIRECTORY,
+    DEFAULT_K_RETRIEVAL,
     MAX_CONTEXT_DOCUMENTS,
     RERANKER_MODEL_NAME,
     RERANKER_TOP_N,
 )
-from database import _build_chroma_settings, _build_embeddings  # noqa: E402
+from database import apri_knowledge_base  # noqa: E402
+from document_index import load_index_document_index  # noqa: E402
 from intent import infer_query_intent  # noqa: E402
+from model_registry import describe_memory  # noqa: E402
 from neural_reranker import CrossEncoderReranker  # noqa: E402
 from rag_types import RagTrace  # noqa: E402
-from reranking import filter_documents_by_course, rerank_documents  # noqa: E402
+from reranking import (  # noqa: E402
+    filter_documents_by_course,
+    needs_cross_encoder,
+    rerank_documents,
+    rerank_within_budget,
+)
 from retrieval import build_bm25_index, hybrid_retrieve  # noqa: E402
 
 DATASET = os.path.join(ROOT, "eval", "questions_baseline.jsonl")
@@ -59,16 +85,97 @@ def basename(doc):
     return os.path.basename((doc.metadata or {}).get("source", ""))
 
 
-def retrieve(vector_db, bm25_index, question, intent, use_bm25, neural_reranker=None):
+def retrieve(
+    vector_db,
+    bm25_index,
+    question,
+    intent,
+    use_bm25,
+    neural_reranker=None,
+    prefilter=False,
+    k=DEFAULT_K_RETRIEVAL,
+    cascade=False,
+    ce_calls=None,
+    document_index=None,
+    timings=None,
+):
     trace = RagTrace()
-    docs = hybrid_retrieve(vector_db, bm25_index, question, intent, trace, use_bm25=use_bm25)
-    docs = rerank_documents(question, docs, intent, trace)
+    t0 = time.perf_counter()
+    docs = hybrid_retrieve(
+        vector_db,
+        bm25_index,
+        question,
+        intent,
+        trace,
+        k=k,
+        use_bm25=use_bm25,
+        prefilter=prefilter,
+        document_index=document_index,
+    )
+    if timings is not None:
+        timings.append(time.perf_counter() - t0)
+    scores = []
+    docs = rerank_documents(question, docs, intent, trace, scores)
+    score_by_doc = {id(doc): score for doc, score in zip(docs, scores)}
     docs = filter_documents_by_course(docs, intent)
     if neural_reranker is not None:
+        # Cascata (Ciclo 3 — FASE 7): cross-encoder solo se l'euristica è incerta.
+        if cascade and not needs_cross_encoder([score_by_doc[id(doc)] for doc in docs]):
+            return docs
+        if ce_calls is not None:
+            ce_calls.append(question)
         docs = neural_reranker.rerank(question, docs, RERANKER_TOP_N)
     return docs
 
 
+def run_budget_ablation(vdb, bm25, dataset, budgets):
+    """recall@5 e candidati rerankati per budget (statico/adattivo) vs nessun limite."""
+    configs = [("illimitato", 0, False)]
+    for budget in budgets:
+        configs.append((f"budget={budget}", budget, False))
+        configs.append((f"budget={budget}+adattivo", budget, True))
+
+    hits = {label: 0 for label, _, _ in configs}
+    reranked = {label: 0 for label, _, _ in configs}
+    fused_total = 0
+
+    for q in dataset:
+        intent = infer_query_intent(q["question"], {})
+        fused = hybrid_retrieve(vdb, bm25, q["question"], intent, RagTrace())
+        fused_total += len(fused)
+
+        for label, budget, adaptive in configs:
+            trace = RagTrace()
+            docs = rerank_within_budget(
+                q["question"], fused, intent, trace, budget=budget, adaptive=adaptive
+            )
+            docs = filter_documents_by_course(docs, intent)
+            topk = [basename(d) for d in docs[:MAX_CONTEXT_DOCUMENTS]]
+            hits[label] += any(d in topk for d in q["expected_docs"])
+            used = trace.candidate_budget.split("/")[0] if trace.candidate_budget else len(fused)
+            reranked[label] += int(used)
+
+    n = len(dataset)
+    print(f"candidati medi dopo la fusione RRF: {fused_total / n:.1f}\n")
+    print(f"{'configurazione':>24} | recall@5 | candidati rerankati (media)")
+    print("-" * 66)
+    rows = []
+    for label, budget, adaptive in configs:
+        print(f"{label:>24} | {hits[label] / n:8.3f} | {reranked[label] / n:8.1f}")
+        rows.append(
+            {
+                "config": label,
+                "budget": budget,
+                "adaptive": adaptive,
+                "recall_at_5": hits[label] / n,
+                "hits": hits[label],
+                "mean_reranked": reranked[label] / n,
+            }
+        )
+
+    return {"n": n, "mean_fused": fused_total / n, "rows": rows}
+
+
 def gold_rank(docs, expected_docs):
     """Rango (1-based) del primo documento atteso nella lista ri-ordinata; None se assente."""
     for i, doc in enumerate(docs):
@@ -79,7 +186,6 @@ def gold_rank(docs, expected_docs):
 
 def main():
     import argparse
-    import time
 
     parser = argparse.ArgumentParser(description="Ablation del retrieval UniLaw Agent")
     parser.add_argument(
@@ -87,20 +193,58 @@ def main():
         action="store_true",
         help="Confronta hybrid vs hybrid+cross-encoder (carica il reranker neurale).",
     )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="Confronta hybrid vs hybrid con pre-filtro per corso nella query.",
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=DEFAULT_K_RETRIEVAL,
+        help="k per variante della configurazione con pre-filtro (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Con --reranker: confronta cross-encoder sempre attivo vs cascata.",
+    )
+    parser.add_argument(
+        "--two-stage",
+        action="store_true",
+        help="Confronta hybrid vs hybrid con arm vettoriale a due stadi (documenti, poi chunk).",
+    )
+    parser.add_argument(
+        "--budget",
+        default="",
+        help="Budget di candidati da confrontare, separati da virgola (es. 10,20,40).",
+    )
     args = parser.parse_args()
 
     print(f"Caricamento indice ChromaDB da {CHROMA_PERSIST_DIRECTORY} ...")
-    vdb = Chroma(
-        persist_directory=CHROMA_PERSIST_DIRECTORY,
-        embedding_function=_build_embeddings(),
-        client_settings=_build_chroma_settings(),
-    )
+    vdb = apri_knowledge_base()
     if not vdb.get().get("ids"):
         raise SystemExit("Indice vuoto: ricostruisci la knowledge base.")
 
     bm25 = build_bm25_index(vdb)
     print(f"Indice BM25: {len(bm25)} chunk.\n")
 
+    dataset = [
+        q
+        for q in load_dataset(DATASET)
+        if q["expected_behavior"] == "answer" and q.get("expected_docs")
+    ]
+
+    if args.budget:
+        budgets = [int(b) for b in args.budget.split(",") if b.strip()]
+        report = run_budget_ablation(vdb, bm25, dataset, budgets)
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        out = os.path.join(REPORTS_DIR, "retrieval_ablation_budget.json")
+        with open(out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"\nReport: {out}")
+        return
+
     # Definisce le due configurazioni a confronto (colonna A vs colonna B).
     if args.reranker:
         reranker = CrossEncoderReranker(RERANKER_MODEL_NAME)
@@ -108,22 +252,41 @@ def main():
         ok = reranker.available()  # forza il caricamento e misura il costo una tantum
         print(
             f"Reranker neurale: {'caricato' if ok else 'NON disponibile (fallback euristico)'} "
-            f"in {time.time() - t0:.1f}s\n"
+            f"in {time.time() - t0:.1f}s"
         )
-        label_a, label_b = "hybrid", "hyb+ce"
+        print(f"Memoria: {describe_memory()}\n")
+        ce_calls = []
+        if args.cascade:
+            label_a, label_b = "hyb+ce", "hyb+casc"
+            cfg_a = dict(use_bm25=True, neural_reranker=reranker)
+            cfg_b = dict(use_bm25=True, neural_reranker=reranker, cascade=True, ce_calls=ce_calls)
+        else:
+            label_a, label_b = "hybrid", "hyb+ce"
+            cfg_a = dict(use_bm25=True, neural_reranker=None)
+            cfg_b = dict(use_bm25=True, neural_reranker=reranker)
+    elif args.two_stage:
+        document_index = load_index_document_index(vdb)
+        if document_index is None:
+            raise SystemExit("Indice dei documenti non disponibile.")
+        print(f"Indice dei documenti: {len(document_index)} PDF.\n")
+        label_a, label_b = "hybrid", "hyb+2st"
+        timings = {label_a: [], label_b: []}
+        cfg_a = dict(use_bm25=True, neural_reranker=None, timings=timings[label_a])
+        cfg_b = dict(
+            use_bm25=True,
+            neural_reranker=None,
+            document_index=document_index,
+            timings=timings[label_b],
+        )
+    elif args.prefilter:
+        label_a, label_b = "hybrid", f"hyb+pf{args.k}"
         cfg_a = dict(use_bm25=True, neural_reranker=None)
-        cfg_b = dict(use_bm25=True, neural_reranker=reranker)
+        cfg_b = dict(use_bm25=True, neural_reranker=None, prefilter=True, k=args.k)
     else:
         label_a, label_b = "vector", "hybrid"
         cfg_a = dict(use_bm25=False, neural_reranker=None)
         cfg_b = dict(use_bm25=True, neural_reranker=None)
 
-    dataset = [
-        q
-        for q in load_dataset(DATASET)
-        if q["expected_behavior"] == "answer" and q.get("expected_docs")
-    ]
-
     rows = []
     improved = worsened = equal = 0
     hit_a = hit_b = 0
@@ -186,10 +349,20 @@ def main():
     print(f"  top-k identico tra le due configurazioni: {identical}/{n}")
 
     os.makedirs(REPORTS_DIR, exist_ok=True)
-    out = os.path.join(
-        REPORTS_DIR,
-        "retrieval_ablation_reranker.json" if args.reranker else "retrieval_ablation.json",
-    )
+    if args.reranker and args.cascade:
+        print(f"  cross-encoder invocato in cascata: {len(ce_calls)}/{n}")
+        report_name = "retrieval_ablation_cascade.json"
+    elif args.reranker:
+        report_name = "retrieval_ablation_reranker.json"
+    elif args.two_stage:
+        for label, values in timings.items():
+            print(f"  tempo medio di recupero {label}: {1000 * sum(values) / len(values):.1f} ms")
+        report_name = "retrieval_ablation_two_stage.json"
+    elif args.prefilter:
+        report_name = f"retrieval_ablation_prefilter_k{args.k}.json"
+    else:
+        report_name = "retrieval_ablation.json"
+    out = os.path.join(REPORTS_DIR, report_name)
     with open(out, "w", encoding="utf-8") as fh:
         json.dump(
             {
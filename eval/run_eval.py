@@ -29,6 +29,11 @@ Uso
     python eval/run_eval.py --limit 9       # solo le prime 9 (smoke test, no LLM)
     python eval/run_eval.py --questions eval/questions_baseline.jsonl
     python eval/run_eval.py --repeat 5      # 5 esecuzioni: media±σ delle metriche
+
+Le chiamate al modello usano la classe di priorità `batch` del dispatcher
+(Ciclo 3 — FASE 25): con il gateway attivo (`UNILAW_LLM_GATEWAY`) una
+valutazione non rallenta le domande degli studenti. `--priority interactive`
+ripristina la classe delle domande.
 I report vengono salvati in eval/reports/ (JSON + Markdown).
 """
 
@@ -123,15 +128,9 @@ def load_dataset(path: str) -> list[dict]:
 def load_vector_db():
     # Import pesanti differiti: questo modulo deve restare importabile offline
     # dai test (Ciclo 2 — FASE 5) senza caricare Chroma/embeddings.
-    from langchain_community.vectorstores import Chroma
-    from config import CHROMA_PERSIST_DIRECTORY
-    from database import _build_chroma_settings, _build_embeddings
-
-    db = Chroma(
-        persist_directory=CHROMA_PERSIST_DIRECTORY,
-        embedding_function=_build_embeddings(),
-        client_settings=_build_chroma_settings(),
-    )
+    from database import apri_knowledge_base
+
+    db = apri_knowledge_base()
     got = db.get()
     if not got.get("ids"):
         raise SystemExit(
@@ -254,6 +253,7 @@ def evaluate_question(responder: UniLawResponder, item: dict) -> dict:
         "retrieval_hit": retrieval_hit,
         "citation_hit": citation_hit,
         "answer_excerpt": " ".join(answer.split())[:300],
+        "llm_queue_wait_ms": getattr(trace, "llm_queue_wait_ms", None),
     }
 
 
@@ -558,6 +558,7 @@ def _error_result(item: dict, exc: Exception) -> dict:
         "retrieval_hit": False,
         "citation_hit": False,
         "answer_excerpt": f"ERRORE: {exc}",
+        "llm_queue_wait_ms": None,
     }
 
 
@@ -634,6 +635,12 @@ def main():
         "profilo di risposta non autorizza l'uso della regola generale quando un "
         "regolamento generale sulla tesi è fra le fonti (serve all'A/B).",
     )
+    parser.add_argument(
+        "--priority",
+        choices=["batch", "interactive"],
+        default="batch",
+        help="Classe di priorità delle chiamate al modello (Ciclo 3 — FASE 25).",
+    )
     parser.add_argument(
         "--repeat",
         type=int,
@@ -680,7 +687,11 @@ def main():
         use_semantic_grounding=True if args.semantic_grounding else None,
         use_semantic_abstention=True if args.semantic_abstention else None,
         use_general_tesi_hint=False if args.no_general_tesi_hint else None,
+        llm_priority=args.priority,
     )
+    from model_registry import describe_memory
+
+    print(f"Memoria: {describe_memory()}")
 
     repeat = max(1, args.repeat)
     runs_results: list[list[dict]] = []
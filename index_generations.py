@@ -0,0 +1,513 @@
+"""Generazioni dell'indice e rebuild blue/green (Ciclo 3 — FASE 16).
+
+Il rebuild dalla GUI cancellava l'indice in uso (`rmtree` della cartella e
+svuotamento della cache di sistema di ChromaDB) e lo ricostruiva nello stesso
+posto: finché il re-embedding non terminava, ogni sessione restava bloccata o
+riceveva errori. Qui ogni ricostruzione scrive in una cartella nuova
+(`generations/<nome>`), in un thread in background, mentre le domande
+continuano a usare la generazione attiva. A indice completo il puntatore
+(`INDEX_POINTER_FILE`) viene riscritto in modo atomico (file temporaneo +
+`os.replace`): chi legge vede la vecchia generazione o la nuova, mai una a
+metà. Le generazioni oltre le ultime `INDEX_GENERATIONS_KEEP` vengono poi
+cancellate.
+
+Senza puntatore la cartella radice stessa è l'indice attivo: gli indici scritti
+prima della FASE 16 restano validi fino alla prima generazione.
+
+Ciclo 3 — FASE 22: più processi possono servire domande sullo stesso indice.
+Una generazione pubblicata non viene più modificata (il database SQLite di
+Chroma passa in modalità WAL prima della pubblicazione), lo scrittore è uno
+solo (lock di `INDEX_WRITER_LOCK_FILE`, e nessuna scrittura nei processi con
+`INDEX_READ_ONLY`), il puntatore porta un numero di generazione crescente e i
+lettori (`IndexReader`) lo controllano a intervalli, registrando la generazione
+in uso perché la pulizia non la cancelli.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Callable
+
+from config import (
+    CHROMA_PERSIST_DIRECTORY,
+    EMBEDDING_CACHE_FILE,
+    INDEX_GENERATIONS_DIR,
+    INDEX_GENERATIONS_KEEP,
+    INDEX_POINTER_FILE,
+    INDEX_POLL_S,
+    INDEX_READ_ONLY,
+    INDEX_READERS_DIR,
+    INDEX_WRITER_LOCK_FILE,
+    PAGE_CACHE_DIR,
+    WATCHER_HEARTBEAT_FILE,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: nessun lock fra processi, resta un solo scrittore per processo
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Una generazione con questo file è ancora in costruzione: la pulizia la salta,
+# salvo che sia più vecchia di STALE_BUILD_S (costruzione interrotta).
+BUILDING_MARKER = ".building"
+STALE_BUILD_S = 6 * 3600
+
+# Una registrazione di un lettore più vecchia di così è di un processo terminato.
+READER_LEASE_S = 600
+
+# Voci della radice che non appartengono a nessuna generazione: le cache degli
+# embedding e delle pagine (FASE 17 e 18), condivise da tutte, l'heartbeat del
+# watcher (FASE 21), il lock dello scrittore e le registrazioni dei lettori (FASE 22).
+_ROOT_ENTRIES = {
+    INDEX_GENERATIONS_DIR,
+    INDEX_POINTER_FILE,
+    EMBEDDING_CACHE_FILE,
+    PAGE_CACHE_DIR,
+    WATCHER_HEARTBEAT_FILE,
+    INDEX_WRITER_LOCK_FILE,
+    INDEX_READERS_DIR,
+}
+
+
+class IndexWriterBusy(RuntimeError):
+    """L'indice è già in scrittura in un altro processo (o thread)."""
+
+
+def _root(root=None) -> Path:
+    return Path(root if root is not None else CHROMA_PERSIST_DIRECTORY)
+
+
+def _read_pointer(root=None) -> dict:
+    pointer = _root(root) / INDEX_POINTER_FILE
+    if not pointer.exists():
+        return {}
+    try:
+        return json.loads(pointer.read_text(encoding="utf-8"))
+    except Exception as exc:
+        logger.warning("Puntatore dell'indice non leggibile, si usa la radice: %s", exc)
+        return {}
+
+
+def current_generation(root=None) -> str | None:
+    """Nome della generazione attiva, o None (nessun puntatore: indice nella radice)."""
+    return _read_pointer(root).get("generation")
+
+
+def generation_number(root=None) -> int:
+    """Numero crescente della generazione attiva (0 senza puntatore), da confrontare fra lettori.
+
+    I puntatori scritti prima della FASE 22 non hanno numero e contano come 1.
+    """
+    pointer = _read_pointer(root)
+    if "generation" not in pointer:
+        return 0
+    return int(pointer.get("number", 1))
+
+
+def _generation_dir(root: Path, generation: str | None) -> Path:
+    if generation is None:
+        return root
+    path = root / INDEX_GENERATIONS_DIR / generation
+    if not path.is_dir():
+        logger.warning("Generazione %s assente, si usa la radice dell'indice.", generation)
+        return root
+    return path
+
+
+def active_index_dir(root=None) -> Path:
+    """Cartella dell'indice da interrogare: la generazione attiva, o la radice."""
+    root = _root(root)
+    return _generation_dir(root, current_generation(root))
+
+
+def store_index_dir(vector_db) -> Path | None:
+    """Cartella della generazione da cui è stato aperto `vector_db`, o None se non si sa.
+
+    Gli artefatti derivati dall'indice (cache delle varianti, indice dei documenti)
+    vanno letti accanto ai chunk e ai vettori del vector store in uso: un lettore
+    che serve ancora la generazione N non deve usare quelli della N+1 appena
+    pubblicata.
+    """
+    directory = getattr(vector_db, "_persist_directory", None)
+    if directory:
+        return Path(directory)
+    flat = getattr(vector_db, "directory", None)  # indice piatto: <generazione>/flat_index
+    return Path(flat).parent if flat is not None else None
+
+
+def write_index_artifact(path: Path, write: Callable[[object], None]) -> None:
+    """Scrive un artefatto dell'indice con file temporaneo + `os.replace`.
+
+    `write` riceve il file temporaneo aperto in binario. Chi legge vede il file
+    vecchio o quello completo, mai uno a metà.
+    """
+    path = Path(path)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as fh:
+            write(fh)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def new_generation(root=None) -> Path:
+    """Crea (vuota, marcata "in costruzione") la cartella di una nuova generazione.
+
+    Il nome inizia con data e ora: l'ordine alfabetico è quello di creazione.
+    """
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    path = _root(root) / INDEX_GENERATIONS_DIR / name
+    path.mkdir(parents=True)
+    (path / BUILDING_MARKER).write_text(str(os.getpid()), encoding="utf-8")
+    return path
+
+
+def publish_generation(path, root=None) -> None:
+    """Rende attiva la generazione `path` sostituendo il puntatore in modo atomico."""
+    root = _root(root)
+    path = Path(path)
+    _prepare_for_readers(path)
+    (path / BUILDING_MARKER).unlink(missing_ok=True)
+
+    pointer = root / INDEX_POINTER_FILE
+    number = generation_number(root) + 1
+    tmp = pointer.with_name(f"{pointer.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump({"generation": path.name, "number": number, "published_at": time.time()}, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, pointer)
+    logger.info("Generazione dell'indice attiva: %s (n. %d)", path.name, number)
+
+
+def _prepare_for_readers(path: Path) -> None:
+    # Il database SQLite di Chroma passa in modalità WAL: i lettori di più processi
+    # non si bloccano fra loro né con le scritture di servizio che Chroma esegue
+    # all'apertura (migrazioni, tenant di default). La modalità resta nel file.
+    db_file = path / "chroma.sqlite3"
+    if not db_file.exists():
+        return
+    try:
+        with closing(sqlite3.connect(db_file, timeout=30)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as exc:
+        logger.warning("Modalità WAL non attivata per %s: %s", path.name, exc)
+
+
+@contextmanager
+def writer_lock(root=None):
+    """Lock esclusivo dello scrittore dell'indice, fra processi; non attende.
+
+    Solleva `IndexWriterBusy` se un altro scrittore lo tiene. Il lock è del file
+    aperto, non del processo: due rebuild nello stesso processo si escludono.
+    """
+    root = _root(root)
+    root.mkdir(parents=True, exist_ok=True)
+    with open(root / INDEX_WRITER_LOCK_FILE, "a+", encoding="utf-8") as fh:
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise IndexWriterBusy("l'indice è già in scrittura in un altro processo") from None
+        fh.seek(0)
+        fh.truncate()
+        fh.write(f"{socket.gethostname()} {os.getpid()}")
+        fh.flush()
+        yield  # il lock si rilascia con la chiusura del file
+
+
+def collect_garbage(root=None, keep: int = INDEX_GENERATIONS_KEEP) -> list[str]:
+    """Cancella le generazioni vecchie e, dopo la prima, l'indice nella radice.
+
+    Si tengono l'attiva e le più recenti fino a `keep` in tutto, più quelle ancora
+    in costruzione. Restituisce i nomi cancellati.
+    """
+    root = _root(root)
+    active = current_generation(root)
+    if active is None:
+        return []
+
+    leased = leased_generations(root)
+    generations_dir = root / INDEX_GENERATIONS_DIR
+    finished = []
+    for path in sorted(generations_dir.iterdir() if generations_dir.is_dir() else [], reverse=True):
+        if not path.is_dir() or path.name == active:
+            continue
+        if path.name in leased:  # FASE 22: ancora aperta da un lettore
+            continue
+        marker = path / BUILDING_MARKER
+        if marker.exists() and time.time() - marker.stat().st_mtime < STALE_BUILD_S:
+            continue
+        finished.append(path)
+
+    removed = []
+    for path in finished[max(0, keep - 1):]:
+        _remove_index_dir(path)
+        removed.append(path.name)
+
+    # Indice precedente alla FASE 16, scritto direttamente nella radice: conta come
+    # la generazione più vecchia e si cancella quando le altre riempiono `keep`.
+    if len(finished) >= keep - 1 and None not in leased:
+        _release_chroma_system(root)
+        for entry in root.iterdir():
+            if entry.name in _ROOT_ENTRIES or entry.name.endswith(".tmp"):
+                continue
+            _remove_index_dir(entry)
+            removed.append(entry.name)
+
+    if removed:
+        logger.info("Generazioni dell'indice cancellate: %s", ", ".join(removed))
+    return removed
+
+
+# ChromaDB tiene in cache un "System" (con la connessione SQLite) per ogni
+# persist_directory, in un attributo privato di `SharedSystemClient`. Con
+# chromadb==0.4.24 (la versione fissata in requirements.txt) si chiama
+# `_identifer_to_system`, con l'errore di battitura; si prova anche la grafia
+# corretta, nel caso una versione successiva lo rinomini.
+_CHROMA_SYSTEM_CACHE_ATTRS = ("_identifer_to_system", "_identifier_to_system")
+
+
+def chroma_system_cache() -> dict | None:
+    """Cache dei `System` di ChromaDB per persist_directory, o None se non trovata."""
+    try:
+        import chromadb
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return None
+    for name in _CHROMA_SYSTEM_CACHE_ATTRS:
+        cache = getattr(SharedSystemClient, name, None)
+        if isinstance(cache, dict):
+            return cache
+    logger.warning(
+        "ChromaDB %s: cache dei System non trovata (%s); connessioni SQLite non rilasciate",
+        getattr(chromadb, "__version__", "?"),
+        " / ".join(_CHROMA_SYSTEM_CACHE_ATTRS),
+    )
+    return None
+
+
+def _release_chroma_system(path: Path) -> None:
+    # Si rilascia il System dell'indice cancellato. I nomi delle generazioni non
+    # si ripetono, quindi nessun client lo riuserà.
+    cache = chroma_system_cache()
+    if cache is None:
+        return
+    system = cache.pop(str(path), None)
+    if system is None:
+        return
+    try:
+        system.stop()
+    except Exception as exc:
+        logger.warning("Sistema ChromaDB non fermato per %s: %s", path, exc)
+
+
+def _remove_index_dir(path: Path) -> None:
+    _release_chroma_system(path)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class IndexRebuild:
+    """Costruisce una nuova generazione in un thread e la pubblica al termine.
+
+    `build(cartella)` scrive l'indice nella cartella della nuova generazione. Se
+    solleva, la generazione viene cancellata e quella attiva resta in uso.
+    """
+
+    def __init__(self, build: Callable[[Path], object], root=None):
+        self._build = build
+        self._root = _root(root)
+        self._done = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.generation: str | None = None
+        self.result = None
+        self.error: str | None = None
+        self.elapsed: float | None = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._done.wait(timeout)
+
+    def start(self) -> "IndexRebuild":
+        self._thread = threading.Thread(target=self.run, name="unilaw-rebuild", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self) -> None:
+        t0 = time.perf_counter()
+        path = None
+        try:
+            if INDEX_READ_ONLY:
+                raise PermissionError("processo in sola lettura: l'indice lo costruisce il processo scrittore")
+            with writer_lock(self._root):
+                path = new_generation(self._root)
+                self.generation = path.name
+                self.result = self._build(path)
+                publish_generation(path, self._root)
+                collect_garbage(self._root)
+        except (PermissionError, IndexWriterBusy) as exc:
+            logger.warning("Ricostruzione dell'indice non avviata: %s", exc)
+            self.error = str(exc)
+        except Exception as exc:
+            logger.exception("Ricostruzione dell'indice non riuscita")
+            self.error = str(exc)
+            if path is not None and current_generation(self._root) != path.name:
+                _remove_index_dir(path)
+        finally:
+            self.elapsed = time.perf_counter() - t0
+            self._done.set()
+
+    def status(self) -> str:
+        """Stato leggibile, per la UI e i log."""
+        if not self.done:
+            return f"in corso (generazione {self.generation or '...'})"
+        if self.error:
+            return f"non riuscita: {self.error}"
+        return f"completata in {self.elapsed:.0f} s (generazione {self.generation})"
+
+
+_REBUILD: IndexRebuild | None = None
+_REBUILD_LOCK = threading.Lock()
+
+
+def start_rebuild(build: Callable[[Path], object], root=None) -> IndexRebuild:
+    """Avvia una ricostruzione in background; se una è già in corso, restituisce quella."""
+    global _REBUILD
+    with _REBUILD_LOCK:
+        if _REBUILD is None or _REBUILD.done:
+            _REBUILD = IndexRebuild(build, root).start()
+        return _REBUILD
+
+
+def rebuild_in_progress() -> IndexRebuild | None:
+    """Ultima ricostruzione avviata dal processo (in corso o terminata), se esiste."""
+    return _REBUILD
+
+
+def _lease_path(root) -> Path:
+    return _root(root) / INDEX_READERS_DIR / f"{socket.gethostname()}-{os.getpid()}.json"
+
+
+def touch_reader_lease(generation: str | None, root=None) -> None:
+    """Registra (o rinnova) la generazione aperta da questo processo lettore."""
+    path = _lease_path(root)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp")
+        tmp.write_text(json.dumps({"generation": generation, "time": time.time()}), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError as exc:
+        logger.warning("Registrazione del lettore non scritta: %s", exc)
+
+
+def release_reader_lease(root=None) -> None:
+    _lease_path(root).unlink(missing_ok=True)
+
+
+def leased_generations(root=None, max_age: float = READER_LEASE_S) -> set[str | None]:
+    """Generazioni aperte da lettori vivi (None: l'indice nella radice).
+
+    Le registrazioni scadute (processi terminati senza `release_reader_lease`)
+    vengono cancellate.
+    """
+    readers_dir = _root(root) / INDEX_READERS_DIR
+    leased = set()
+    for path in readers_dir.glob("*.json") if readers_dir.is_dir() else []:
+        try:
+            lease = json.loads(path.read_text(encoding="utf-8"))
+            if time.time() - float(lease["time"]) < max_age:
+                leased.add(lease["generation"])
+                continue
+        except Exception:
+            pass
+        path.unlink(missing_ok=True)
+    return leased
+
+
+class IndexReader:
+    """Indice aperto in sola lettura da un processo che serve domande (FASE 22).
+
+    `open_index(cartella)` apre una generazione. `get()` restituisce
+    `(generazione, indice)` e, al più ogni `poll_interval` secondi, controlla il
+    puntatore: se è stata pubblicata una generazione nuova la apre e da quel
+    momento la restituisce. Il controllo costa una `stat` del puntatore; il file
+    si rilegge solo quando cambia.
+
+    L'indice della generazione lasciata resta utilizzabile da chi lo sta già
+    interrogando; la cache di sistema di Chroma viene rilasciata al cambio
+    successivo, quando nessuna richiesta lo usa più.
+    """
+
+    def __init__(self, open_index: Callable[[Path], object], root=None, poll_interval: float = INDEX_POLL_S):
+        self._open = open_index
+        self._root = _root(root)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._checked = -math.inf
+        self._stamp = None
+        self._retired: Path | None = None
+        self.generation: str | None = None
+        self.number = 0
+        self.path: Path | None = None
+        self.store = None
+
+    def get(self) -> tuple[str | None, object]:
+        with self._lock:
+            now = time.monotonic()
+            if self.store is None or now - self._checked >= self.poll_interval:
+                self._checked = now
+                self._refresh()
+            return self.generation, self.store
+
+    def _refresh(self) -> None:
+        try:
+            stat = (self._root / INDEX_POINTER_FILE).stat()
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if self.store is not None and stamp == self._stamp:
+            touch_reader_lease(self.generation, self._root)
+            return
+
+        pointer = _read_pointer(self._root)
+        generation = pointer.get("generation")
+        if self.store is None or generation != self.generation:
+            path = _generation_dir(self._root, generation)
+            touch_reader_lease(generation, self._root)
+            try:
+                store = self._open(path)
+            except Exception:
+                if self.store is None:
+                    raise
+                logger.exception("Generazione %s non apribile, resta in uso %s", generation, self.generation)
+                touch_reader_lease(self.generation, self._root)
+                return
+            if self._retired is not None:
+                _release_chroma_system(self._retired)
+            self._retired = self.path
+            self.store, self.path, self.generation = store, path, generation
+            logger.info("Lettore dell'indice sulla generazione %s", generation or "radice")
+        self.number = int(pointer.get("number", 1)) if generation is not None else 0
+        self._stamp = stamp
+
+    def close(self) -> None:
+        release_reader_lease(self._root)
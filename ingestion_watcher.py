@@ -0,0 +1,216 @@
+"""Watcher della cartella dei documenti: ingestione continua in background (Ciclo 3 — FASE 21).
+
+I nuovi bandi e regolamenti entravano nell'indice solo quando qualcuno apriva
+l'app Streamlit (che confrontava `calcola_firma_documenti` con il manifest) o
+premeva il pulsante di rebuild. Questo processo separato controlla
+`DOCUMENTS_FOLDER` a intervalli regolari (polling su nome, dimensione e mtime dei
+PDF: nessuna dipendenza da inotify), aspetta che la cartella resti ferma per
+`WATCHER_DEBOUNCE_S` (un PDF in copia cambia dimensione a ogni controllo) e
+pubblica una nuova generazione dell'indice (FASE 16). I processi che servono le
+domande la aprono al primo rerun, senza rebuild manuali.
+
+L'ingestione è incrementale nel lavoro, non nella scrittura: con le cache delle
+pagine e degli embedding (FASE 17-18) vengono estratti e incorporati solo i PDF
+aggiunti o modificati, mentre la nuova generazione viene scritta completa, così
+una generazione pubblicata non viene mai modificata mentre qualcuno la legge.
+
+Finché il watcher è attivo scrive un heartbeat nella radice dell'indice: l'app
+non avvia rebuild propri quando i PDF cambiano e lascia il lavoro al watcher.
+
+Uso:
+    python ingestion_watcher.py
+    python ingestion_watcher.py --interval 10 --debounce 5
+    python ingestion_watcher.py --once
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from config import (
+    CHROMA_PERSIST_DIRECTORY,
+    DOCUMENTS_FOLDER,
+    WATCHER_DEBOUNCE_S,
+    WATCHER_HEARTBEAT_FILE,
+    WATCHER_POLL_S,
+)
+
+logger = logging.getLogger(__name__)
+
+# Attesa massima fra due tentativi dopo ingestioni fallite (raddoppia a ogni errore).
+RETRY_MAX_S = 600
+
+
+def folder_snapshot(folder: str = DOCUMENTS_FOLDER) -> dict[str, tuple[int, int]]:
+    """Nome → (dimensione, mtime in ns) dei PDF: economico, senza leggere i file."""
+    snapshot = {}
+    for entry in os.scandir(folder) if os.path.isdir(folder) else []:
+        if entry.is_file() and entry.name.lower().endswith(".pdf"):
+            stat = entry.stat()
+            snapshot[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def diff_snapshots(old: dict, new: dict) -> dict[str, list[str]]:
+    """PDF aggiunti, rimossi e modificati fra due snapshot."""
+    return {
+        "added": sorted(set(new) - set(old)),
+        "removed": sorted(set(old) - set(new)),
+        "modified": sorted(name for name in set(old) & set(new) if old[name] != new[name]),
+    }
+
+
+def watcher_active(root=None, max_age: float | None = None) -> bool:
+    """True se un watcher ha scritto l'heartbeat da meno di `max_age` secondi."""
+    path = Path(root if root is not None else CHROMA_PERSIST_DIRECTORY) / WATCHER_HEARTBEAT_FILE
+    max_age = max_age if max_age is not None else 3 * WATCHER_POLL_S
+    try:
+        beat = json.loads(path.read_text(encoding="utf-8"))
+        return time.time() - float(beat["time"]) < max_age
+    except Exception:
+        return False
+
+
+class FolderWatcher:
+    """Controlla la cartella e ripubblica l'indice quando i PDF cambiano.
+
+    `poll` va chiamato a ogni intervallo: restituisce le modifiche solo quando la
+    cartella è rimasta ferma per `debounce` secondi. `ingest` costruisce e
+    pubblica la nuova generazione nel processo del watcher.
+    """
+
+    def __init__(
+        self,
+        folder: str = DOCUMENTS_FOLDER,
+        root=None,
+        interval: float = WATCHER_POLL_S,
+        debounce: float = WATCHER_DEBOUNCE_S,
+    ):
+        self.folder = folder
+        self.root = Path(root if root is not None else CHROMA_PERSIST_DIRECTORY)
+        self.interval = interval
+        self.debounce = debounce
+        self._indexed: dict | None = None  # snapshot dell'ultima ingestione
+        self._last: dict | None = None
+        self._stable_since = 0.0
+        self._failures = 0  # ingestioni fallite di fila
+        self._retry_at = 0.0  # prima del prossimo tentativo non si riprova
+        self.last_result: dict | None = None
+
+    def poll(self, now: float | None = None) -> dict[str, list[str]] | None:
+        """Modifiche pronte da ingerire (cartella ferma da `debounce` s), o None."""
+        now = time.monotonic() if now is None else now
+        snapshot = folder_snapshot(self.folder)
+        if snapshot != self._last:
+            self._last = snapshot
+            self._stable_since = now
+        if self._indexed is not None and snapshot == self._indexed:
+            return None
+        if now - self._stable_since < self.debounce or now < self._retry_at:
+            return None
+        return diff_snapshots(self._indexed or {}, snapshot)
+
+    def ingest(self, changes: dict[str, list[str]] | None = None, now: float | None = None) -> dict:
+        """Pubblica una nuova generazione se il contenuto dei PDF differisce dall'indice.
+
+        Il confronto finale è quello dell'app (`_should_rebuild` sulla firma
+        SHA-256, sull'indice sotto `self.root`, dove vanno anche la nuova
+        generazione e le cache di pagine ed embedding): un PDF solo "toccato" non produce
+        generazioni nuove. Se l'ingestione fallisce, o un altro processo sta già
+        scrivendo l'indice, le modifiche restano in sospeso e `poll` le ripropone
+        dopo un'attesa che raddoppia a ogni errore (fino a `RETRY_MAX_S`).
+        """
+        from database import _build_index, _collect_pdf_files, _should_rebuild, calcola_firma_documenti
+        from index_generations import IndexRebuild
+
+        snapshot = self._last if self._last is not None else folder_snapshot(self.folder)
+        signature = calcola_firma_documenti(self.folder)
+        result = {"changes": changes or {}, "published": None, "error": None, "seconds": 0.0}
+        if not _should_rebuild(False, signature, self.root):
+            logger.info("PDF invariati rispetto all'indice attivo: nessuna nuova generazione.")
+        else:
+            pdf_files = _collect_pdf_files(self.folder)
+            logger.info("Ingestione: %s", changes or "allineamento iniziale")
+            rebuild = IndexRebuild(
+                lambda index_dir: _build_index(pdf_files, signature, index_dir, self.root), self.root
+            )
+            rebuild.run()
+            result.update(published=None if rebuild.error else rebuild.generation, error=rebuild.error)
+            result["seconds"] = round(rebuild.elapsed or 0.0, 2)
+            logger.info("Ingestione %s", rebuild.status())
+        self.last_result = result
+        if result["error"]:
+            # La generazione attiva resta la precedente; lo snapshot non è segnato
+            # come ingerito, così le modifiche non vanno perse.
+            self._failures += 1
+            delay = min(RETRY_MAX_S, max(self.interval, 1) * 2 ** (self._failures - 1))
+            self._retry_at = (time.monotonic() if now is None else now) + delay
+            logger.warning("Ingestione non riuscita (%s): nuovo tentativo fra %.0f s", result["error"], delay)
+            return result
+        self._failures = 0
+        self._retry_at = 0.0
+        self._indexed = snapshot
+        return result
+
+    def heartbeat(self) -> None:
+        path = self.root / WATCHER_HEARTBEAT_FILE
+        beat = {"pid": os.getpid(), "time": time.time(), "last_result": self.last_result}
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(beat, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception as exc:
+            logger.warning("Heartbeat del watcher non scritto: %s", exc)
+
+    def run(self, stop: threading.Event | None = None) -> None:
+        """Ciclo del watcher: allinea subito l'indice, poi controlla ogni `interval` s.
+
+        L'heartbeat ha un thread suo: un'ingestione lunga non deve far credere
+        all'app che il watcher sia fermo.
+        """
+        stop = stop or threading.Event()
+        self.heartbeat()
+        beat = threading.Thread(target=self._beat, args=(stop,), name="unilaw-watcher-beat", daemon=True)
+        beat.start()
+        try:
+            self.ingest()
+            while not stop.wait(self.interval):
+                changes = self.poll()
+                if changes is not None:
+                    self.ingest(changes)
+        finally:
+            stop.set()
+            beat.join()
+            (self.root / WATCHER_HEARTBEAT_FILE).unlink(missing_ok=True)
+
+    def _beat(self, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            self.heartbeat()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Watcher della cartella documenti di UniLaw Agent")
+    parser.add_argument("--interval", type=float, default=WATCHER_POLL_S, help="secondi fra due controlli")
+    parser.add_argument("--debounce", type=float, default=WATCHER_DEBOUNCE_S, help="secondi di cartella ferma")
+    parser.add_argument("--once", action="store_true", help="allinea l'indice una volta ed esce")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    watcher = FolderWatcher(interval=args.interval, debounce=args.debounce)
+    if args.once:
+        print(json.dumps(watcher.ingest(), ensure_ascii=False))
+        return
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
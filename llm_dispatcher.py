@@ -0,0 +1,330 @@
+"""Dispatcher delle chiamate al modello con classi di priorità (Ciclo 3 — FASE 25).
+
+Le domande degli studenti e i job in background (`eval/run_eval.py`, precalcoli
+notturni) chiamavano lo stesso Ollama locale con `ChatOllama.invoke`, senza
+ordine: una valutazione in corso riempiva la coda di Ollama e ogni domanda
+interattiva aspettava dietro decine di generazioni batch.
+
+`LLMDispatcher` assegna i posti di generazione (`LLM_MAX_INFLIGHT`, quanti
+Ollama ne esegue in parallelo) alle richieste in attesa:
+
+- fra le classi di priorità (`interactive`, `batch`) con un round robin pesato
+  (`LLM_PRIORITY_WEIGHTS`, default 8:1): con entrambe le classi in attesa la
+  batch riceve un posto ogni nove, quindi avanza ma non affama le domande;
+- dentro una classe, a turno fra i client (una coda FIFO per client): un client
+  con molte richieste non scavalca gli altri;
+- la classe `batch` non occupa più di `LLM_BATCH_MAX_INFLIGHT` posti.
+
+Una generazione già avviata non viene interrotta: con un solo posto una domanda
+aspetta al più la generazione batch in corso.
+
+Il dispatcher ordina le chiamate del processo. Fra processi diversi (Streamlit,
+API, valutazione) lo stesso dispatcher gira nel gateway HTTP di questo modulo
+(`python llm_dispatcher.py`), davanti a Ollama: i client puntano al gateway
+(`UNILAW_LLM_GATEWAY`) e dichiarano la classe con l'intestazione
+`X-UniLaw-Priority`. Il gateway aggiunge l'attesa in coda all'ultima riga della
+risposta di Ollama (`unilaw_queue`), che il responder somma nel `RagTrace`.
+
+Uso:
+    python llm_dispatcher.py                    # gateway su UNILAW_LLM_GATEWAY_PORT
+    UNILAW_LLM_GATEWAY=http://127.0.0.1:11435 streamlit run app_agent.py
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import (
+    LLM_BATCH_MAX_INFLIGHT,
+    LLM_GATEWAY_PORT,
+    LLM_GATEWAY_URL,
+    LLM_MAX_INFLIGHT,
+    LLM_PRIORITY_WEIGHTS,
+    OLLAMA_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITY_HEADER = "X-UniLaw-Priority"
+CLIENT_HEADER = "X-Client-Id"
+
+# Attese recenti conservate per classe, per i percentili di `stats()`.
+WAIT_SAMPLES = 1000
+# Rotte di Ollama che generano testo: solo queste passano dal dispatcher nel gateway.
+GENERATION_ROUTES = ("/api/chat", "/api/generate")
+
+
+class _Ticket:
+    __slots__ = ("priority", "enqueued_at", "granted")
+
+    def __init__(self, priority: str):
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+
+
+class LLMDispatcher:
+    """Posti di generazione condivisi dai thread del processo, assegnati per priorità."""
+
+    def __init__(
+        self,
+        max_inflight: int = LLM_MAX_INFLIGHT,
+        weights: dict[str, int] | None = None,
+        limits: dict[str, int] | None = None,
+    ):
+        self.max_inflight = max(1, max_inflight)
+        self.weights = {name: max(1, weight) for name, weight in (weights or LLM_PRIORITY_WEIGHTS).items()}
+        if limits is None:
+            limits = {PRIORITY_BATCH: LLM_BATCH_MAX_INFLIGHT or max(1, self.max_inflight - 1)}
+        self.limits = dict(limits)
+        self._cond = threading.Condition()
+        self._queues: dict[str, OrderedDict[str, deque]] = {name: OrderedDict() for name in self.weights}
+        self._running = dict.fromkeys(self.weights, 0)
+        self._granted = dict.fromkeys(self.weights, 0)
+        self._credit = dict.fromkeys(self.weights, 0)
+        self._waits = {name: deque(maxlen=WAIT_SAMPLES) for name in self.weights}
+
+    @contextmanager
+    def slot(self, priority: str, client: str = ""):
+        """Attende un posto per una generazione; restituisce i secondi di attesa."""
+        if priority not in self.weights:
+            raise ValueError(f"classe di priorità sconosciuta: {priority!r}")
+        ticket = _Ticket(priority)
+        with self._cond:
+            self._queues[priority].setdefault(client, deque()).append(ticket)
+            self._dispatch()
+            try:
+                while not ticket.granted:
+                    self._cond.wait()
+            except BaseException:
+                # Interrotto in attesa: esce dalla coda, o restituisce il posto appena avuto.
+                if ticket.granted:
+                    self._release(priority)
+                else:
+                    self._discard(ticket, client)
+                raise
+        try:
+            yield time.perf_counter() - ticket.enqueued_at
+        finally:
+            with self._cond:
+                self._release(priority)
+
+    def _release(self, priority: str) -> None:
+        self._running[priority] -= 1
+        self._dispatch()
+
+    def _discard(self, ticket: _Ticket, client: str) -> None:
+        queue = self._queues[ticket.priority][client]
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.priority][client]
+
+    def _dispatch(self) -> None:
+        """Assegna i posti liberi; da chiamare con il lock acquisito."""
+        granted = False
+        while sum(self._running.values()) < self.max_inflight:
+            eligible = [
+                name for name, clients in self._queues.items()
+                if clients and self._running[name] < self.limits.get(name, self.max_inflight)
+            ]
+            if not eligible:
+                break
+            # Round robin pesato "smooth": ogni classe in attesa accumula il proprio
+            # peso, vince quella con più credito, che paga il totale dei pesi.
+            for name in eligible:
+                self._credit[name] += self.weights[name]
+            chosen = max(eligible, key=lambda name: self._credit[name])
+            self._credit[chosen] -= sum(self.weights[name] for name in eligible)
+
+            clients = self._queues[chosen]
+            client, queue = next(iter(clients.items()))
+            ticket = queue.popleft()
+            if queue:
+                clients.move_to_end(client)  # il client torna in fondo al turno
+            else:
+                del clients[client]
+            ticket.granted = True
+            self._running[chosen] += 1
+            self._granted[chosen] += 1
+            self._waits[chosen].append(time.perf_counter() - ticket.enqueued_at)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Posti occupati, richieste in attesa e attese p50/p95 (ms) per classe."""
+        with self._cond:
+            classes = {}
+            for name in self.weights:
+                waits = sorted(self._waits[name])
+                classes[name] = {
+                    "weight": self.weights[name],
+                    "limit": self.limits.get(name, self.max_inflight),
+                    "running": self._running[name],
+                    "waiting": sum(len(queue) for queue in self._queues[name].values()),
+                    "granted": self._granted[name],
+                    "wait_ms_p50": _percentile_ms(waits, 50),
+                    "wait_ms_p95": _percentile_ms(waits, 95),
+                }
+        return {"max_inflight": self.max_inflight, "classes": classes}
+
+
+def _percentile_ms(sorted_values: list[float], q: int) -> float | None:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+
+_DISPATCHER: LLMDispatcher | None = None
+_DISPATCHER_LOCK = threading.Lock()
+
+
+def get_dispatcher() -> LLMDispatcher:
+    """Dispatcher del processo, creato al primo uso e condiviso da tutti i responder."""
+    global _DISPATCHER
+    with _DISPATCHER_LOCK:
+        if _DISPATCHER is None:
+            _DISPATCHER = LLMDispatcher()
+        return _DISPATCHER
+
+
+def ollama_client_options(priority: str, client: str = "") -> dict:
+    """Argomenti per `ChatOllama`: con il gateway configurato, indirizzo e classe."""
+    if not LLM_GATEWAY_URL:
+        return {}
+    headers = {PRIORITY_HEADER: priority}
+    if client:
+        headers[CLIENT_HEADER] = client
+    return {"base_url": LLM_GATEWAY_URL, "headers": headers}
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    server_version = "UniLawLLMGateway/1.0"
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/dispatcher":
+            self._send_json(200, self.server.dispatcher.stats())
+        else:
+            self._proxy(None)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.split("?")[0] not in GENERATION_ROUTES:
+            self._proxy(body)
+            return
+        priority = self.headers.get(PRIORITY_HEADER) or self.server.default_priority
+        client = self.headers.get(CLIENT_HEADER) or self.client_address[0]
+        try:
+            with self.server.dispatcher.slot(priority, client) as waited:
+                queue = {"priority": priority, "wait_ms": round(waited * 1000, 1)}
+                self._proxy(body, queue)
+        except ValueError as exc:
+            self._send_json(400, {"error": str(exc)})
+
+    def _proxy(self, body: bytes | None, queue: dict | None = None) -> None:
+        request = urllib.request.Request(
+            self.server.upstream + self.path,
+            data=body,
+            headers={"Content-Type": self.headers.get("Content-Type", "application/json")},
+            method=self.command,
+        )
+        try:
+            upstream = urllib.request.urlopen(request, timeout=self.server.timeout_s)
+        except urllib.error.HTTPError as exc:
+            upstream = exc
+        except OSError as exc:
+            self._send_json(502, {"error": f"Ollama non raggiungibile: {exc}"})
+            return
+        with upstream:
+            self.send_response(upstream.status)
+            self.send_header("Content-Type", upstream.headers.get("Content-Type", "application/json"))
+            self.send_header("Connection", "close")
+            self.end_headers()
+            # Riga per riga: lo streaming NDJSON di Ollama arriva al client senza ritardi.
+            for line in upstream:
+                if queue is not None and b'"done"' in line:
+                    line = _annotate_final_line(line, queue)
+                self.wfile.write(line)
+                self.wfile.flush()
+        self.close_connection = True
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def _annotate_final_line(line: bytes, queue: dict) -> bytes:
+    """Aggiunge `unilaw_queue` all'ultima riga di Ollama (`done: true`)."""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return line
+    if not isinstance(event, dict) or event.get("done") is not True:
+        return line
+    event["unilaw_queue"] = queue
+    return json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+class DispatcherGateway(ThreadingHTTPServer):
+    """Proxy HTTP davanti a Ollama: le generazioni di tutti i processi passano dal dispatcher."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", LLM_GATEWAY_PORT),
+        upstream: str = OLLAMA_URL,
+        dispatcher: LLMDispatcher | None = None,
+        default_priority: str = PRIORITY_INTERACTIVE,
+        timeout_s: float = 600,
+    ):
+        super().__init__(address, _GatewayHandler)
+        self.upstream = upstream.rstrip("/")
+        self.dispatcher = dispatcher or LLMDispatcher()
+        self.default_priority = default_priority
+        self.timeout_s = timeout_s
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Gateway con classi di priorità davanti a Ollama")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=LLM_GATEWAY_PORT)
+    parser.add_argument("--upstream", default=OLLAMA_URL, help="indirizzo di Ollama")
+    parser.add_argument("--max-inflight", type=int, default=LLM_MAX_INFLIGHT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    gateway = DispatcherGateway(
+        (args.host, args.port), args.upstream, LLMDispatcher(max_inflight=args.max_inflight)
+    )
+    logger.info(
+        "Gateway su http://%s:%d verso %s (%d generazioni in parallelo, pid %d)",
+        *gateway.server_address[:2], gateway.upstream, gateway.dispatcher.max_inflight, os.getpid(),
+    )
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Registro dei modelli condiviso dal processo (Ciclo 3 — FASE 9).
+
+`database._build_embeddings` creava un nuovo `HuggingFaceEmbeddings` a ogni
+chiamata: un rebuild dalla GUI (che svuota la cache di `inizializza_conoscenza`)
+ricaricava il modello di embedding, e ogni nuovo responder ricaricava il
+cross-encoder. Qui ogni modello viene caricato una sola volta per processo, per
+(tipo, nome, parametri), e condiviso da vector store, intent semantico, grounding,
+astensione e script di valutazione.
+
+Il registro espone anche una stima della memoria residente: RSS del processo e
+peso dei parametri di ogni modello caricato.
+
+Ciclo 3 — FASE 10: con `quantize=True` i layer lineari del modello vengono
+quantizzati in int8 (quantizzazione dinamica di torch) subito dopo il
+caricamento; la versione float e quella int8 sono voci distinte del registro,
+così il benchmark può confrontarle nello stesso processo.
+"""
+
+import logging
+import os
+import threading
+from typing import Callable
+
+from config import EMBEDDING_MODEL_NAME, MODEL_QUANTIZATION_ENABLED
+
+logger = logging.getLogger(__name__)
+
+_MODELS: dict[tuple, object] = {}
+_LOCKS: dict[tuple, threading.Lock] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_model(key: tuple, factory: Callable[[], object]) -> object:
+    """Restituisce il modello registrato sotto `key`, caricandolo al primo uso.
+
+    Un lock per chiave: due thread (es. warm-up e prima domanda) che chiedono lo
+    stesso modello ne caricano uno solo, mentre modelli diversi possono caricarsi
+    in parallelo. Se `factory` solleva, nulla viene registrato e l'eccezione
+    risale al chiamante (che decide il fallback).
+    """
+    model = _MODELS.get(key)
+    if model is not None:
+        return model
+
+    with _REGISTRY_LOCK:
+        lock = _LOCKS.setdefault(key, threading.Lock())
+
+    with lock:
+        model = _MODELS.get(key)
+        if model is None:
+            model = factory()
+            _MODELS[key] = model
+            logger.info(
+                "Modello caricato nel registro: %s (%.0f MB di parametri)",
+                _label(key),
+                model_size_mb(model),
+            )
+    return model
+
+
+def get_embeddings(
+    model_name: str = EMBEDDING_MODEL_NAME,
+    device: str = "cpu",
+    quantize: bool = MODEL_QUANTIZATION_ENABLED,
+):
+    """`HuggingFaceEmbeddings` condiviso per `model_name` (default: quello dell'indice)."""
+    quantize = quantize and device == "cpu"
+
+    def factory():
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": device})
+        return quantize_int8(embeddings) if quantize else embeddings
+
+    return get_model(("embedding", model_name, device) + _precision(quantize), factory)
+
+
+def get_cross_encoder(
+    model_name: str,
+    device: str = "cpu",
+    max_length: int = 512,
+    quantize: bool = MODEL_QUANTIZATION_ENABLED,
+):
+    """`CrossEncoder` di sentence-transformers condiviso (import pigro, come in FASE 4)."""
+    quantize = quantize and device == "cpu"
+
+    def factory():
+        from sentence_transformers import CrossEncoder
+
+        model = CrossEncoder(model_name, device=device, max_length=max_length)
+        return quantize_int8(model) if quantize else model
+
+    return get_model(("cross-encoder", model_name, device, max_length) + _precision(quantize), factory)
+
+
+def _precision(quantize: bool) -> tuple:
+    # La chiave float resta quella di FASE 9: la voce int8 si aggiunge in coda.
+    return ("int8",) if quantize else ()
+
+
+def quantize_int8(model):
+    """Quantizza in int8 (dinamica, sul posto) i `torch.nn.Linear` del modello.
+
+    Pesi int8, attivazioni quantizzate al volo: nessuna calibrazione, solo CPU.
+    Se torch non è disponibile o il modello non è un modulo torch, il modello
+    resta in float con un avviso (stessa politica di fallback del reranker).
+    """
+    module = _torch_module(model)
+    if module is None:
+        logger.warning("Quantizzazione int8 non applicabile a %s: resta in float.", type(model).__name__)
+        return model
+    try:
+        import torch
+
+        torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    except Exception as exc:  # torch assente o backend di quantizzazione non supportato
+        logger.warning("Quantizzazione int8 non riuscita (%s): il modello resta in float.", exc)
+    return model
+
+
+def loaded_models() -> list[str]:
+    return [_label(key) for key in _MODELS]
+
+
+def clear_models() -> None:
+    """Dimentica i modelli registrati (test, o rilascio esplicito della memoria)."""
+    with _REGISTRY_LOCK:
+        _MODELS.clear()
+        _LOCKS.clear()
+
+
+def _label(key: tuple) -> str:
+    label = f"{key[0]}:{key[1]}"
+    return f"{label} (int8)" if key[-1] == "int8" else label
+
+
+def _torch_module(model):
+    """Modulo torch dietro i wrapper noti (HuggingFaceEmbeddings.client, CrossEncoder.model)."""
+    for candidate in (model, getattr(model, "client", None), getattr(model, "model", None)):
+        if candidate is not None and callable(getattr(candidate, "parameters", None)):
+            return candidate
+    return None
+
+
+def _tensor_bytes(value) -> int:
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in value)
+    if callable(getattr(value, "numel", None)) and callable(getattr(value, "element_size", None)):
+        return value.numel() * value.element_size()
+    return 0
+
+
+def model_size_mb(model) -> float:
+    """Peso dei pesi del modello in MB (0 se non è un modulo torch).
+
+    Si contano i tensori dello `state_dict`, non solo i `parameters()`: dopo la
+    quantizzazione dinamica i pesi int8 dei layer lineari sono "packed params",
+    che non compaiono fra i parametri.
+    """
+    module = _torch_module(model)
+    if module is None:
+        return 0.0
+    try:
+        state_dict = getattr(module, "state_dict", None)
+        if callable(state_dict):
+            total = sum(_tensor_bytes(value) for value in state_dict().values())
+        else:
+            total = sum(_tensor_bytes(p) for p in module.parameters())
+    except Exception:  # difensivo: wrapper con `parameters` non standard
+        return 0.0
+    return total / (1024 * 1024)
+
+
+def process_rss_mb() -> float:
+    """Memoria residente del processo in MB (/proc su Linux, picco RSS altrove)."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as fh:
+            resident_pages = int(fh.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in KB su Linux e in byte su macOS.
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except Exception:
+        return 0.0
+
+
+def memory_report() -> dict[str, float]:
+    """RSS del processo e peso di ogni modello registrato, in MB."""
+    report = {"processo (RSS)": round(process_rss_mb(), 1)}
+    for key, model in list(_MODELS.items()):
+        report[_label(key)] = round(model_size_mb(model), 1)
+    return report
+
+
+def describe_memory() -> str:
+    """Riga leggibile per log, UI e script di valutazione."""
+    return ", ".join(f"{name} {mb:.0f} MB" for name, mb in memory_report().items())
@@ -0,0 +1,149 @@
+"""Chunk quasi duplicati eliminati all'indicizzazione con MinHash/LSH (Ciclo 3 — FASE 20).
+
+Il corpus contiene documenti molto sovrapposti (RAD, regolamento e piano di
+studi dello stesso corso ripetono interi articoli): i chunk quasi identici
+costano embedding e spazio nell'indice e, a runtime, occupano posti dell'MMR
+con lo stesso contenuto. Gli ID di contenuto della FASE 15 scartano solo le
+ripetizioni esatte nello stesso PDF.
+
+Qui ogni chunk è riassunto da una firma MinHash (`MINHASH_PERMUTATIONS` minimi
+di permutazioni hash sui trigrammi di parole) e le firme sono indicizzate per
+bande (LSH): i candidati sono i chunk che condividono almeno una banda, e un
+candidato con somiglianza di Jaccard stimata ≥ `NEAR_DEDUP_THRESHOLD` rende il
+chunk un duplicato. Resta il primo chunk visto (il canonico), che riceve nei
+metadata la provenienza di tutte le copie: `provenance` (JSON, lista di
+`[filename, page]`) e `duplicate_count`.
+
+Il confronto avviene solo fra chunk con lo stesso `course_tag`: un canonico di
+un altro corso sparirebbe dai risultati filtrati per corso.
+"""
+
+import json
+import logging
+import re
+import zlib
+
+import numpy as np
+
+from config import MINHASH_BANDS, MINHASH_PERMUTATIONS, NEAR_DEDUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Primo di Mersenne 2^31 - 1: a·x + b resta sotto 2^63 in uint64.
+_PRIME = (1 << 31) - 1
+_SHINGLE_WORDS = 3
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text: str) -> np.ndarray:
+    """Hash (CRC32, stabile fra processi) dei trigrammi di parole, senza ripetizioni."""
+    words = _WORD_RE.findall((text or "").lower())
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    n = max(1, len(words) - _SHINGLE_WORDS + 1)
+    grams = {" ".join(words[i:i + _SHINGLE_WORDS]) for i in range(n)}
+    hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+    return hashes % _PRIME
+
+
+class MinHasher:
+    """Firme MinHash con permutazioni `(a·x + b) mod p` a seme fisso."""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = 20):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, _PRIME, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, _PRIME, permutations, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray | None:
+        """Firma del testo, o None per un testo senza parole (mai considerato duplicato)."""
+        x = shingles(text)
+        if not len(x):
+            return None
+        return ((self.a[:, None] * x[None, :] + self.b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateFilter:
+    """Decide, chunk dopo chunk, se è una copia quasi identica di uno già tenuto.
+
+    Pensato per lo streaming della FASE 19: tiene in memoria solo le firme (4 byte
+    per permutazione) e la provenienza dei chunk tenuti. La provenienza dei
+    canonici con copie si applica a indice scritto (`metadata_updates`).
+    """
+
+    def __init__(
+        self,
+        threshold: float = NEAR_DEDUP_THRESHOLD,
+        permutations: int = MINHASH_PERMUTATIONS,
+        bands: int = MINHASH_BANDS,
+    ):
+        if permutations % bands:
+            raise ValueError("il numero di permutazioni deve essere multiplo delle bande")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self.hasher = MinHasher(permutations)
+        self._buckets: dict[tuple, list[int]] = {}
+        self._signatures: list[np.ndarray] = []
+        self._ids: list[str] = []
+        self._origins: list[list] = []
+        self._duplicated: set[int] = set()
+        self.seen = 0
+        self.collapsed = 0
+
+    def is_duplicate(self, chunk, chunk_id: str) -> bool:
+        """True se `chunk` va scartato; altrimenti lo registra come canonico."""
+        self.seen += 1
+        signature = self.hasher.signature(chunk.page_content)
+        if signature is None:
+            return False
+
+        metadata = chunk.metadata or {}
+        origin = [metadata.get("filename", ""), metadata.get("page")]
+        group = metadata.get("course_tag", "")
+        keys = [
+            (group, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+        best, best_similarity = None, 0.0
+        for candidate in {i for key in keys for i in self._buckets.get(key, ())}:
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity > best_similarity:
+                best, best_similarity = candidate, similarity
+
+        if best is not None and best_similarity >= self.threshold:
+            self._origins[best].append(origin)
+            self._duplicated.add(best)
+            self.collapsed += 1
+            return True
+
+        index = len(self._ids)
+        self._signatures.append(signature)
+        self._ids.append(chunk_id)
+        self._origins.append([origin])
+        for key in keys:
+            self._buckets.setdefault(key, []).append(index)
+        return False
+
+    @property
+    def ratio(self) -> float:
+        """Quota dei chunk scartati come quasi duplicati."""
+        return self.collapsed / self.seen if self.seen else 0.0
+
+    def metadata_updates(self) -> dict[str, dict]:
+        """Metadata di provenienza per i canonici che hanno assorbito copie."""
+        return {
+            self._ids[i]: {
+                "provenance": json.dumps(self._origins[i], ensure_ascii=False),
+                "duplicate_count": len(self._origins[i]) - 1,
+            }
+            for i in sorted(self._duplicated)
+        }
+
+    def stats(self) -> dict:
+        return {
+            "chunks": self.seen,
+            "near_duplicates": self.collapsed,
+            "dedup_ratio": round(self.ratio, 4),
+            "threshold": self.threshold,
+        }
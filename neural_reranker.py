@@ -14,14 +14,42 @@ Il cross-encoder riceve coppie (domanda, testo del chunk) e produce un punteggio
 di pertinenza; viene applicato solo ai primi `top_n` candidati già ordinati
 dall'euristica e filtrati per corso, così da raffinare la selezione finale senza
 perdere i priori di dominio.
+
+Ciclo 3 — FASE 6: batch size e thread configurabili, cache LRU dei punteggi per
+(hash della domanda, ID del chunk) e, opzionalmente, punteggio calcolato sulla
+finestra di evidenza (`evidence.select_passage`) invece che sull'intero chunk,
+che oltre `max_length` token verrebbe comunque troncato.
 """
 
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from typing import Callable, Optional
 
+from langchain_core.documents import Document
+
+from config import (
+    EVIDENCE_MAX_CHARS,
+    EVIDENCE_MAX_SENTENCES,
+    EVIDENCE_MIN_SENTENCES,
+    MODEL_QUANTIZATION_ENABLED,
+    RERANKER_BATCH_SIZE,
+    RERANKER_CACHE_SIZE,
+    RERANKER_EVIDENCE_WINDOW,
+    RERANKER_NUM_THREADS,
+)
+from evidence import select_passage
+from model_registry import get_cross_encoder
+from retrieval import CHUNK_ID_KEY
+
 logger = logging.getLogger(__name__)
 
 
+def _digest(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
 def rerank_by_scores(docs: list, scores: list) -> list:
     """Riordina i documenti per punteggio decrescente (ordinamento stabile).
 
@@ -41,24 +69,59 @@ class CrossEncoderReranker:
         device: str = "cpu",
         max_length: int = 512,
         scorer: Optional[Callable[[str, list], Optional[list]]] = None,
+        batch_size: int = RERANKER_BATCH_SIZE,
+        num_threads: int = RERANKER_NUM_THREADS,
+        cache_size: int = RERANKER_CACHE_SIZE,
+        evidence_window: bool = RERANKER_EVIDENCE_WINDOW,
+        quantize: bool = MODEL_QUANTIZATION_ENABLED,
     ):
         self.model_name = model_name
         self.device = device
         self.max_length = max_length
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.cache_size = cache_size
+        self.evidence_window = evidence_window
+        self.quantize = quantize  # int8 dinamico dopo il caricamento (Ciclo 3 — FASE 10)
         self._scorer = scorer  # iniettabile nei test
         self._model = None
         self._load_failed = False
+        # Cache LRU dei punteggi: (hash domanda, ID chunk, finestra) -> punteggio.
+        # Ciclo 3 — FASE 24: il reranker è condiviso dai thread dell'API, quindi la
+        # cache ha un lock e i punteggi in cache dell'ultima chiamata sono per thread.
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._local = threading.local()
+        # Il caricamento può partire sia dal warm-up in background sia dalla
+        # prima richiesta (Ciclo 3 — FASE 8): un solo thread carica il modello.
+        self._load_lock = threading.Lock()
+
+    @property
+    def last_cache_hits(self) -> int:
+        """Punteggi letti dalla cache nell'ultima `score` del thread corrente."""
+        return getattr(self._local, "cache_hits", 0)
 
     def _ensure_model(self) -> None:
         if self._scorer is not None or self._model is not None or self._load_failed:
             return
+        with self._load_lock:
+            if self._model is None and not self._load_failed:
+                self._load_model()
+
+    def _load_model(self) -> None:
         try:
-            from sentence_transformers import CrossEncoder
+            if self.num_threads > 0:
+                import torch
+
+                torch.set_num_threads(self.num_threads)
 
-            self._model = CrossEncoder(
+            # Ciclo 3 — FASE 9: il modello è condiviso dal registro di processo,
+            # quindi un nuovo responder (es. dopo un rebuild) non lo ricarica.
+            self._model = get_cross_encoder(
                 self.model_name,
                 device=self.device,
                 max_length=self.max_length,
+                quantize=self.quantize,
             )
             logger.info("Reranker neurale caricato: %s", self.model_name)
         except Exception as exc:  # modello assente o errore di import/caricamento
@@ -68,13 +131,40 @@ class CrossEncoderReranker:
             )
             self._load_failed = True
 
+    def warm_up(self) -> bool:
+        """Carica il modello ed esegue un'inferenza fittizia (fuori dalla cache).
+
+        La prima `predict` paga l'inizializzazione di torch: farla qui, in
+        background, la toglie dalla prima domanda reale.
+        """
+        if not self.available():
+            return False
+        self._predict("riscaldamento", [Document(page_content="riscaldamento")])
+        return True
+
     def available(self) -> bool:
         """True se è possibile produrre punteggi (scorer iniettato o modello caricabile)."""
         self._ensure_model()
         return self._scorer is not None or self._model is not None
 
-    def score(self, question: str, docs: list) -> Optional[list]:
-        """Punteggi di pertinenza per i documenti; None se il modello non è disponibile."""
+    def _scoring_doc(self, question: str, doc) -> Document:
+        """Documento effettivamente valutato: il chunk o la sua finestra di evidenza."""
+        if not self.evidence_window:
+            return doc
+        passage = select_passage(
+            question,
+            doc.page_content,
+            max_sentences=EVIDENCE_MAX_SENTENCES,
+            min_sentences=EVIDENCE_MIN_SENTENCES,
+            max_chars=EVIDENCE_MAX_CHARS,
+        )
+        return Document(page_content=passage, metadata=doc.metadata)
+
+    def _cache_key(self, question_key: str, doc) -> tuple:
+        chunk_id = (doc.metadata or {}).get(CHUNK_ID_KEY) or _digest(doc.page_content)
+        return (question_key, chunk_id, self.evidence_window)
+
+    def _predict(self, question: str, docs: list) -> Optional[list]:
         if self._scorer is not None:
             return self._scorer(question, docs)
 
@@ -83,7 +173,40 @@ class CrossEncoderReranker:
             return None
 
         pairs = [(question, doc.page_content) for doc in docs]
-        return [float(s) for s in self._model.predict(pairs)]
+        scores = self._model.predict(pairs, batch_size=self.batch_size)
+        return [float(s) for s in scores]
+
+    def score(self, question: str, docs: list) -> Optional[list]:
+        """Punteggi di pertinenza per i documenti; None se il modello non è disponibile.
+
+        Le coppie già valutate sono lette dalla cache LRU; le altre sono inviate
+        al modello in un'unica chiamata (a lotti di `batch_size`).
+        """
+        question_key = _digest(question)
+        keys = [self._cache_key(question_key, doc) for doc in docs]
+
+        with self._cache_lock:
+            values = {key: self._cache[key] for key in keys if key in self._cache}
+        missing = [i for i, key in enumerate(keys) if key not in values]
+        self._local.cache_hits = len(docs) - len(missing)
+
+        # Il modello gira fuori dal lock: altri thread possono usare la cache intanto.
+        if missing:
+            fresh = self._predict(
+                question, [self._scoring_doc(question, docs[i]) for i in missing]
+            )
+            if fresh is None:
+                return None
+            values.update((keys[i], value) for i, value in zip(missing, fresh))
+
+        with self._cache_lock:
+            for key in keys:
+                self._cache[key] = values[key]
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return [values[key] for key in keys]
 
     def rerank(self, question: str, docs: list, top_n: int) -> list:
         """Riordina i primi `top_n` documenti col cross-encoder; il resto invariato.
@@ -0,0 +1,96 @@
+"""Cache su disco del testo estratto dalle pagine dei PDF (Ciclo 3 — FASE 18).
+
+L'indicizzazione in `database` rileggeva ogni PDF con `PyPDFLoader` a
+ogni rebuild, anche se i byte del file (e il loro SHA-256, già calcolato da
+`calcola_firma_documenti`) non erano cambiati. Qui il testo e i metadata di ogni
+pagina vengono salvati in un file JSON Lines per PDF (una pagina per riga: dalla
+FASE 19 si leggono e scrivono una alla volta), con chiave SHA-256 del file e
+versione dell'estrattore, nella radice di `CHROMA_PERSIST_DIRECTORY` (fuori
+dalle generazioni della FASE 16). Rebuild e prove di chunking rileggono solo i
+PDF nuovi o modificati.
+
+Un aggiornamento di pypdf, o un cambio nel modo di estrarre (`_EXTRACTOR_REVISION`),
+cambia la chiave: le pagine vengono estratte di nuovo.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Da incrementare se cambia l'estrazione a parità di versione di pypdf.
+_EXTRACTOR_REVISION = 1
+
+try:
+    from pypdf import __version__ as _PYPDF_VERSION
+except ImportError:  # PyPDFLoader solleverà comunque all'estrazione
+    _PYPDF_VERSION = "assente"
+
+EXTRACTOR_VERSION = f"pypdf-{_PYPDF_VERSION}-r{_EXTRACTOR_REVISION}"
+
+
+class PageCache:
+    """Pagine estratte per SHA-256 del PDF: un file `<sha256>.<estrattore>.jsonl`."""
+
+    def __init__(self, directory, extractor: str = EXTRACTOR_VERSION):
+        self.directory = Path(directory)
+        self.extractor = extractor
+
+    def _path(self, sha256: str) -> Path:
+        return self.directory / f"{sha256}.{self.extractor}.jsonl"
+
+    def __contains__(self, sha256: str) -> bool:
+        return self._path(sha256).exists()
+
+    def iter_pages(self, sha256: str) -> Iterator[Document]:
+        """Pagine salvate per il PDF, una alla volta (solleva se il file è illeggibile)."""
+        with open(self._path(sha256), encoding="utf-8") as fh:
+            for line in fh:
+                page = json.loads(line)
+                yield Document(page_content=page["text"], metadata=page["metadata"])
+
+    def get(self, sha256: str) -> list[Document] | None:
+        """Pagine salvate per il PDF, o None se assenti (o illeggibili)."""
+        if sha256 not in self:
+            return None
+        try:
+            return list(self.iter_pages(sha256))
+        except Exception as exc:
+            logger.warning("Pagine in cache non leggibili (%s), si estrae di nuovo: %s", sha256[:12], exc)
+            return None
+
+    def put(self, sha256: str, pages: Iterable[Document]) -> None:
+        for _ in self.tee(sha256, pages):
+            pass
+
+    def tee(self, sha256: str, pages: Iterable[Document]) -> Iterator[Document]:
+        """Restituisce le pagine una alla volta e intanto le salva.
+
+        Il file viene pubblicato (file temporaneo + `os.replace`, un rebuild
+        concorrente non legge mai un file a metà) solo se il PDF è letto fino in
+        fondo: un errore di estrazione o un'interruzione non lasciano voci parziali.
+        """
+        path = self._path(sha256)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            fh = open(tmp, "w", encoding="utf-8")
+        except Exception as exc:
+            logger.warning("Pagine di %s non salvate in cache: %s", sha256[:12], exc)
+            yield from pages
+            return
+
+        try:
+            with fh:
+                for page in pages:
+                    record = {"text": page.page_content, "metadata": dict(page.metadata)}
+                    fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    yield page
+            os.replace(tmp, path)
+        finally:
+            tmp.unlink(missing_ok=True)
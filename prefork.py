@@ -0,0 +1,301 @@
+"""Server preload-then-fork: stato di sola lettura condiviso fra i worker (Ciclo 3 — FASE 23).
+
+Ogni processo che serve domande caricava per conto suo il modello di embedding,
+apriva l'indice, costruiva BM25, la cache delle varianti e gli anchor
+dell'intent semantico e istanziava `UniLawResponder`: centinaia di MB uguali
+ripetuti in ogni processo. Qui il processo padre costruisce una volta tutto lo
+stato di sola lettura (`preload_state`: responder e modelli, riscaldati in modo
+sincrono), esegue `gc.freeze()` e crea con `fork` N worker che ne condividono le
+pagine in copy-on-write.
+
+`gc.freeze()` sposta gli oggetti esistenti nella generazione permanente: le
+raccolte cicliche dei worker non li visitano più e non ne sporcano le pagine. I
+contatori di riferimento restano scritti a ogni accesso, quindi la condivisione
+vale soprattutto per i buffer grandi (pesi dei modelli, matrici NumPy dei
+vettori e degli anchor), che sono il grosso della memoria.
+
+Dopo il `fork` (`after_fork`) il worker riapre ciò che non si condivide fra
+processi: le connessioni SQLite di Chroma (l'indice piatto, in `mmap`, è già
+condiviso dalla cache delle pagine). Il padre non serve richieste: sorveglia i
+worker, sostituisce quelli terminati e, quando viene pubblicata una nuova
+generazione dell'indice (FASE 22), ricarica lo stato e sostituisce i worker.
+
+Solo sistemi con `os.fork` (Linux, macOS).
+"""
+
+import gc
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from typing import Callable
+
+from config import INDEX_POLL_S, SERVER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Secondi concessi a un worker per segnalare di essere pronto, e per terminare.
+READY_TIMEOUT_S = 60
+STOP_TIMEOUT_S = 10
+
+
+def preload_state(vector_db=None):
+    """Responder con tutto lo stato di sola lettura già costruito e riscaldato.
+
+    Il riscaldamento (FASE 8) gira nel processo chiamante, non in un thread: al
+    `fork` nessun thread deve tenere lock del registro dei modelli.
+    """
+    # I tokenizer Rust di Hugging Face disattiverebbero comunque il parallelismo
+    # nel figlio, con un avviso per worker.
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    from agent import UniLawResponder
+    from database import apri_knowledge_base
+    from warmup import Warmup, warmup_steps
+
+    vector_db = vector_db if vector_db is not None else apri_knowledge_base()
+    responder = UniLawResponder(vector_db)
+    responder.warmup = Warmup(warmup_steps(responder))
+    responder.warmup.run()
+    return responder
+
+
+def after_fork(responder) -> None:
+    """Nel worker appena creato: riapre le risorse che non si condividono fra processi."""
+    from index_generations import chroma_system_cache
+
+    # Senza `stop()`: le connessioni ereditate appartengono al padre, non si
+    # chiudono né si riusano.
+    cache = chroma_system_cache()
+    if cache is not None:
+        cache.clear()
+
+    from vector_store import FlatVectorStore
+
+    vector_db = responder.vector_db
+    if vector_db is None or isinstance(vector_db, FlatVectorStore):
+        return
+    from database import apri_knowledge_base
+
+    responder.vector_db = apri_knowledge_base(
+        vector_db._embedding_function, getattr(vector_db, "_persist_directory", None)
+    )
+
+
+def memory_usage(pid: int | None = None) -> dict:
+    """RSS, PSS e memoria privata (USS) in MB del processo, da `/proc` (solo Linux).
+
+    La PSS divide ogni pagina condivisa fra i processi che la mappano: la somma
+    delle PSS dei worker è la loro memoria reale complessiva, a differenza della
+    somma delle RSS.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid or os.getpid()}/smaps_rollup", encoding="ascii") as fh:
+            for line in fh:
+                name, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    fields[name] = int(value.split()[0])
+    except OSError:
+        return {}
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "uss_mb": round(private / 1024, 1),
+    }
+
+
+class PreforkServer:
+    """Costruisce lo stato nel padre e lo serve con `workers` processi figli.
+
+    `preload()` restituisce lo stato condiviso; `worker(stato, indice)` è il
+    corpo di un worker (di norma un ciclo che non termina) ed è eseguito dopo
+    `setup(stato)`, per default `after_fork`.
+    """
+
+    def __init__(
+        self,
+        preload: Callable[[], object],
+        worker: Callable[[object, int], None],
+        workers: int = SERVER_WORKERS,
+        setup: Callable[[object], None] = after_fork,
+    ):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("il server preload-then-fork richiede os.fork (Linux o macOS)")
+        self._preload = preload
+        self._worker = worker
+        self._setup = setup
+        self.size = workers
+        self.state = None
+        self.preload_s: float | None = None
+        self.generation_number = 0
+        self.workers: dict[int, dict] = {}  # pid → indice, avvio, pronto in s
+
+    def start(self) -> "PreforkServer":
+        """Carica lo stato e avvia i worker; ritorna quando tutti sono pronti."""
+        from index_generations import generation_number
+
+        self.generation_number = generation_number()
+        self._load()
+        for index in range(self.size):
+            self._spawn(index)
+        return self
+
+    def _load(self) -> None:
+        t0 = time.perf_counter()
+        state = self._build()
+        self._install(state, t0)
+
+    def _build(self):
+        gc.disable()  # nessuna raccolta a metà costruzione: oggetti compatti, poi congelati
+        try:
+            return self._preload()
+        finally:
+            gc.enable()
+
+    def _install(self, state, t0: float) -> None:
+        gc.unfreeze()  # lo stato precedente (se c'è) torna raccoglibile
+        self.state = state
+        gc.collect()
+        gc.freeze()
+        self.preload_s = time.perf_counter() - t0
+        logger.info("Stato precaricato in %.1f s (%d oggetti congelati)", self.preload_s, gc.get_freeze_count())
+
+    def _spawn(self, index: int) -> int:
+        read_fd, write_fd = os.pipe()
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:  # worker
+            os.close(read_fd)
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C lo gestisce il padre
+                self._setup(self.state)
+                ready = {"startup_s": round(time.perf_counter() - forked_at, 4)}
+                os.write(write_fd, json.dumps(ready).encode())
+                os.close(write_fd)
+                self._worker(self.state, index)
+            except SystemExit as exc:
+                code = exc.code if isinstance(exc.code, int) else 0
+            except BaseException:
+                logger.exception("Worker %d terminato con errore", index)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        os.close(write_fd)
+        try:
+            ready = json.loads(self._read_ready(read_fd) or b"{}")
+        finally:
+            os.close(read_fd)
+        if not ready:
+            logger.warning("Worker %d (pid %d) non pronto", index, pid)
+        self.workers[pid] = {"index": index, "pid": pid, "startup_s": ready.get("startup_s")}
+        return pid
+
+    @staticmethod
+    def _read_ready(fd: int) -> bytes:
+        import select
+
+        chunks = []
+        deadline = time.monotonic() + READY_TIMEOUT_S
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not select.select([fd], [], [], remaining)[0]:
+                break
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def supervise(self, stop: threading.Event | None = None, poll_interval: float = INDEX_POLL_S) -> None:
+        """Sostituisce i worker terminati e ricarica lo stato alle nuove generazioni dell'indice."""
+        from index_generations import current_generation, generation_number, touch_reader_lease
+
+        stop = stop or threading.Event()
+        generation = current_generation()
+        while not stop.wait(poll_interval):
+            self._reap(respawn=True)
+            number = generation_number()
+            if number != self.generation_number:
+                logger.info("Nuova generazione dell'indice (n. %d): ricarico i worker", number)
+                candidate = current_generation()
+                # Se lo stato non si carica si riprova al controllo successivo.
+                if self.reload():
+                    self.generation_number, generation = number, candidate
+            # Ciclo 3 — FASE 24: la generazione servita dai worker non va cancellata.
+            touch_reader_lease(generation)
+
+    def _reap(self, respawn: bool) -> None:
+        for pid in list(self.workers):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, 0
+            if done:
+                info = self.workers.pop(pid)
+                logger.warning("Worker %d (pid %d) terminato, stato %d", info["index"], pid, status)
+                if respawn:
+                    self._spawn(info["index"])
+
+    def reload(self) -> bool:
+        """Ricarica lo stato e sostituisce tutti i worker (i vecchi servono fino al cambio).
+
+        Se il caricamento fallisce (generazione rovinata o non apribile) restano
+        lo stato e i worker attuali, come in `IndexReader`; ritorna False.
+        """
+        old = list(self.workers)
+        t0 = time.perf_counter()
+        try:
+            state = self._build()
+        except Exception:
+            logger.exception("Nuovo stato non caricato: i worker restano sulla generazione precedente")
+            return False
+        self._install(state, t0)
+        for pid in old:
+            self._spawn(self.workers[pid]["index"])
+        self._terminate(old)
+        gc.collect()
+        return True
+
+    def _terminate(self, pids: list[int]) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + STOP_TIMEOUT_S
+        for pid in pids:
+            while True:
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if done:
+                    break
+                if time.monotonic() > deadline:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                    break
+                time.sleep(0.05)
+            self.workers.pop(pid, None)
+
+    def stop(self) -> None:
+        self._terminate(list(self.workers))
+
+    def report(self) -> dict:
+        """Tempo di precaricamento e, per il padre e ogni worker, avvio e memoria."""
+        return {
+            "preload_s": round(self.preload_s or 0.0, 2),
+            "parent": {"pid": os.getpid(), **memory_usage()},
+            "workers": [
+                {**info, **memory_usage(pid)}
+                for pid, info in sorted(self.workers.items(), key=lambda item: item[1]["index"])
+            ],
+        }
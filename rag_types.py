@@ -7,7 +7,7 @@ comportamento; restano importabili da `agent` per retrocompatibilità.
 """
 
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Any, Optional
 
 
 @dataclass
@@ -27,6 +27,11 @@ class RetrievedSource:
     content: str
     course_tag: str
     doc_type: str
+    # Ciclo 3 — FASE 1: ID del chunk in ChromaDB e vettore già calcolato in fase
+    # di indicizzazione, propagati dal retrieval (None se non disponibili, es.
+    # vector store finti nei test o fonti costruite a mano).
+    chunk_id: Optional[str] = None
+    embedding: Optional[Any] = field(default=None, repr=False, compare=False)
 
     @property
     def citation_label(self) -> str:
@@ -47,14 +52,23 @@ class RagTrace:
     answer_profile: str = ""
     query_variants: list[str] = field(default_factory=list)
     selected_sources: list[str] = field(default_factory=list)
+    # Ciclo 3 — FASE 15: ID di contenuto dei chunk delle fonti selezionate.
+    selected_chunk_ids: list[str] = field(default_factory=list)
     rejected_hint: list[str] = field(default_factory=list)
     deterministic_rule_used: Optional[str] = None
     retrieval_mode: str = "vettoriale"
+    prefilter: str = ""
+    document_stage: str = ""
+    candidate_budget: str = ""
     fusion_scores: list[str] = field(default_factory=list)
     reranker: str = "euristico"
     evidence_chars: str = ""
     grounding: str = "n.d."
     abstention_reason: str = ""
+    # Ciclo 3 — FASE 25: classe di priorità della chiamata al modello e attesa di un
+    # posto (dispatcher del processo più gateway); None se il modello non è stato chiamato.
+    llm_priority: str = ""
+    llm_queue_wait_ms: Optional[float] = None
 
 
 COURSE_LABELS = {
@@ -7,11 +7,22 @@ opzionale) da un reranker neurale, mantenendo questa euristica come fallback.
 
 `filter_documents_by_course` è il filtro metadata della pipeline ibrida: evita
 che una domanda su un corso specifico sia risolta con documenti di altri corsi.
+
+`rerank_within_budget` (Ciclo 3 — FASE 5) limita il numero di candidati della
+fusione su cui lavorano reranking, filtro e cross-encoder; `needs_cross_encoder`
+(FASE 7) decide la cascata euristica → cross-encoder in base al distacco dei
+punteggi euristici al confine del contesto.
 """
 
 import os
 
-from config import MAX_CONTEXT_DOCUMENTS
+from config import (
+    CANDIDATE_BUDGET,
+    CANDIDATE_BUDGET_ADAPTIVE,
+    CANDIDATE_BUDGET_CLOSE_MARGIN,
+    MAX_CONTEXT_DOCUMENTS,
+    RERANKER_CASCADE_MARGIN,
+)
 from intent import (
     asks_borsa_graduatoria,
     asks_erasmus_end_mobility,
@@ -49,7 +60,13 @@ def filter_documents_by_course(docs: list, intent: QueryIntent) -> list:
     return filtered or docs
 
 
-def rerank_documents(question: str, docs: list, intent: QueryIntent, trace: RagTrace):
+def rerank_documents(
+    question: str,
+    docs: list,
+    intent: QueryIntent,
+    trace: RagTrace,
+    scores_out: list | None = None,
+):
     q = question.lower()
     ranked = []
 
@@ -425,4 +442,74 @@ def rerank_documents(question: str, docs: list, intent: QueryIntent, trace: RagT
         for score, doc in ranked[MAX_CONTEXT_DOCUMENTS:MAX_CONTEXT_DOCUMENTS + 5]
     ]
 
+    # Punteggi euristici in ordine di ranking, per chi deve ragionare sui margini
+    # (budget adattivo dei candidati, Ciclo 3 — FASE 5).
+    if scores_out is not None:
+        scores_out[:] = [score for score, _ in ranked]
+
     return [doc for _, doc in ranked]
+
+
+def heuristic_margin(scores: list, position: int = MAX_CONTEXT_DOCUMENTS) -> float:
+    """Distacco fra l'ultimo candidato che entra nel contesto e il primo escluso.
+
+    `scores` è ordinato in modo decrescente; senza candidati esclusi il
+    distacco è infinito (la selezione è già decisa).
+    """
+    if len(scores) <= position or position <= 0:
+        return float("inf")
+    return scores[position - 1] - scores[position]
+
+
+def needs_cross_encoder(scores: list, threshold: float = RERANKER_CASCADE_MARGIN) -> bool:
+    """Cascata (Ciclo 3 — FASE 7): il cross-encoder serve solo se l'euristica è incerta."""
+    return heuristic_margin(scores) < threshold
+
+
+def rerank_within_budget(
+    question: str,
+    docs: list,
+    intent: QueryIntent,
+    trace: RagTrace,
+    budget: int = CANDIDATE_BUDGET,
+    adaptive: bool = CANDIDATE_BUDGET_ADAPTIVE,
+    close_margin: int = CANDIDATE_BUDGET_CLOSE_MARGIN,
+    scores_out: list | None = None,
+):
+    """Reranking euristico dei soli primi `budget` candidati della fusione RRF.
+
+    Ciclo 3 — FASE 5. La fusione può restituire quasi cento candidati, ma solo
+    MAX_CONTEXT_DOCUMENTS arrivano al modello: il budget tronca la lista prima
+    di reranking, filtro per corso e cross-encoder. Con `adaptive` il budget
+    raddoppia (fino a tutti i candidati) finché, al confine della finestra di
+    contesto, i punteggi euristici restano entro `close_margin`: solo in quel
+    caso un candidato escluso ha una reale possibilità di entrare. `budget <= 0`
+    = nessun limite (comportamento precedente). `scores_out` riceve i punteggi
+    euristici nell'ordine restituito.
+    """
+    if budget <= 0:
+        return rerank_documents(question, docs, intent, trace, scores_out)
+
+    if len(docs) <= budget:
+        trace.candidate_budget = f"{len(docs)}/{len(docs)} candidati"
+        return rerank_documents(question, docs, intent, trace, scores_out)
+
+    window = budget
+    while True:
+        scores: list = []
+        ranked = rerank_documents(question, docs[:window], intent, trace, scores)
+
+        close = heuristic_margin(scores) <= close_margin
+        if not adaptive or not close or window >= len(docs):
+            break
+        window = min(window * 2, len(docs))
+
+    if scores_out is not None:
+        scores_out[:] = scores
+
+    trace.candidate_budget = "{used}/{total} candidati{extra}".format(
+        used=min(window, len(docs)),
+        total=len(docs),
+        extra=f" (adattivo, budget iniziale {budget})" if window > budget else "",
+    )
+    return ranked
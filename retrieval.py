@@ -11,23 +11,61 @@ alla scala dei punteggi. La fusione genera i *candidati*; l'ordinamento finale
 resta affidato al reranker euristico (vedi `reranking.py`). Con `use_bm25=False`
 l'RRF su un solo ranking preserva l'ordine vettoriale: la modalità "vettoriale"
 riproduce quindi esattamente il comportamento pre-FASE 3 (baseline).
+
+Dal Ciclo 3 — FASE 1 ogni candidato porta con sé, nei metadata in memoria,
+l'ID del chunk in ChromaDB (`CHUNK_ID_KEY`) e il vettore già calcolato in fase
+di indicizzazione (`EMBEDDING_KEY`): i consumatori a valle (astensione
+semantica, grounding) fanno solo prodotti scalari invece di ri-incorporare il
+testo delle fonti.
+
+Dal Ciclo 3 — FASE 2 (opt-in) la regola di `filter_documents_by_course` può
+essere applicata già in fase di recupero (`prefilter_course_tags`): clausola
+`where` su ChromaDB e filtro sui documenti BM25, con una query di fallback senza
+filtro quando il risultato filtrato è troppo piccolo. Dalla FASE 3 l'arm BM25
+filtrato valuta solo le partizioni per corso dell'indice lessicale.
+
+Dal Ciclo 3 — FASE 4 le varianti di query fisse (che non contengono la
+domanda) possono essere servite da una cache precalcolata (`variant_cache.py`).
+
+Dal Ciclo 3 — FASE 11 l'arm vettoriale passa per `vector_store.vector_backend`:
+lo stesso codice interroga la collezione Chroma o l'indice piatto esatto.
+
+Dal Ciclo 3 — FASE 14 (opt-in) l'arm vettoriale può lavorare in due stadi: un
+indice a livello di documento (`document_index.py`) sceglie i PDF più vicini a
+ogni variante, poi la ricerca MMR si restringe ai loro chunk.
+
+Dal Ciclo 3 — FASE 15 l'ID del chunk è un hash del contenuto assegnato
+all'indicizzazione (`database._chunk_content_id`): deduplica fra varianti e fusione
+RRF usano l'ID invece di affettare e confrontare il testo.
 """
 
 import logging
 import os
 import re
 
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
 from langchain_core.documents import Document
 from rank_bm25 import BM25Okapi
 
-from config import DEFAULT_K_RETRIEVAL
+from config import DEFAULT_K_RETRIEVAL, DOCUMENT_STAGE_TOP_N, RETRIEVAL_PREFILTER_MIN_RESULTS
 from intent import asks_tesi_consultazione
 from rag_types import QueryIntent, RagTrace
+from vector_store import vector_backend
 
 logger = logging.getLogger(__name__)
 
 RRF_K = 60
 
+# Chiavi dei metadata "in memoria" aggiunte ai candidati (Ciclo 3 — FASE 1): le
+# valorizza il retrieval leggendo ID e vettori dalla collezione. Dalla FASE 15
+# l'ID (hash del contenuto) è anche l'ID del chunk in ChromaDB ed è persistito
+# nei suoi metadata; il vettore resta solo in memoria.
+CHUNK_ID_KEY = "chunk_id"
+EMBEDDING_KEY = "_embedding"
+
+MMR_LAMBDA_MULT = 0.5
+
 _TOKEN_RE = re.compile(r"\w+", re.UNICODE)
 
 # Stopword italiane minime (parole funzione molto frequenti). Rimuoverle migliora
@@ -53,7 +91,11 @@ def tokenize(text: str) -> list[str]:
 
 
 def _doc_key(doc):
+    """Chiave di deduplica: l'ID del chunk se noto (FASE 15), altrimenti fonte, pagina e testo."""
     metadata = doc.metadata or {}
+    chunk_id = metadata.get(CHUNK_ID_KEY)
+    if chunk_id is not None:
+        return chunk_id
     return (
         metadata.get("source", ""),
         metadata.get("page", None),
@@ -181,21 +223,222 @@ def build_query_variants(question: str, intent: QueryIntent) -> list[str]:
     return query_variants
 
 
-def run_vector_queries(vector_db, query_variants: list[str], k: int = DEFAULT_K_RETRIEVAL) -> list:
-    """Esegue le query vettoriali (MMR, con fallback a similarity) e deduplica."""
-    all_docs = []
-    seen = set()
+def is_constant_variant(variant: str, question: str) -> bool:
+    """True se la variante non dipende dal testo della domanda (Ciclo 3 — FASE 4).
 
-    for qv in query_variants:
-        try:
+    Le espansioni dipendenti sono costruite come "<domanda> <termini>": una
+    variante che non inizia con la domanda è un testo fisso.
+    """
+    return not variant.startswith(question)
+
+
+def _with_chunk_data(text, metadata, chunk_id, embedding) -> Document:
+    """Documento candidato con ID del chunk e vettore memorizzato nei metadata."""
+    metadata = dict(metadata or {})
+    if chunk_id is not None:
+        metadata[CHUNK_ID_KEY] = chunk_id
+    if embedding is not None:
+        metadata[EMBEDDING_KEY] = np.asarray(embedding, dtype=np.float32)
+    return Document(page_content=text or "", metadata=metadata)
+
+
+def prefilter_course_tags(intent: QueryIntent) -> list[str] | None:
+    """Corsi ammessi dal pre-filtro di retrieval (Ciclo 3 — FASE 2).
+
+    Stessa regola di `reranking.filter_documents_by_course`: con un corso
+    riconosciuto si tengono il corso e i documenti generali, tranne per Erasmus e
+    borsa (bandi di Ateneo, validi per tutti). `None` = nessun filtro.
+    """
+    if not intent.course_tag or intent.topic in {"erasmus", "borsa"}:
+        return None
+    return [intent.course_tag, "generale"]
+
+
+def _course_where(course_tags: list[str] | None) -> dict | None:
+    """Clausola `where` di ChromaDB per i corsi ammessi."""
+    if not course_tags:
+        return None
+    return {"course_tag": {"$in": list(course_tags)}}
+
+
+def _source_where(where: dict | None, sources: list[str]) -> dict:
+    """Clausola `where` del secondo stadio: documenti scelti (e corsi ammessi, se presenti)."""
+    clause = {"source": {"$in": list(sources)}}
+    return {"$and": [where, clause]} if where else clause
+
+
+def _select_documents(vector_db, document_index, query, n, query_vectors, course_tags):
+    """Primo stadio (Ciclo 3 — FASE 14): documenti più vicini alla variante.
+
+    Il vettore della variante viene registrato in `query_vectors`, così la ricerca
+    MMR del secondo stadio non lo ricalcola. None se il vector store non espone un
+    backend di ricerca per vettore (vector store finti nei test).
+    """
+    backend = vector_backend(vector_db)
+    if backend is None:
+        return None
+    query_vec = query_vectors.get(query)
+    if query_vec is None:
+        query_vec = backend.embed_query(query)
+        query_vectors[query] = query_vec
+    return document_index.select(query_vec, n, course_tags)
+
+
+def _mmr_search_with_vectors(
+    vector_db, query: str, k: int, fetch_k: int, query_vectors=None, where=None
+):
+    """MMR su ChromaDB che conserva ID e vettori dei chunk (Ciclo 3 — FASE 1).
+
+    Replica `Chroma.max_marginal_relevance_search` (stessa query, stesso
+    `lambda_mult`, stesso ordine dei risultati) ma chiede alla collezione anche
+    gli ID e gli embedding già memorizzati, che LangChain scarta. Restituisce
+    `None` se il vector store non espone un backend di ricerca per vettore
+    (vector store finti nei test): il chiamante ricade allora sull'API pubblica.
+
+    Il vettore della query viene letto da `query_vectors` se già presente (la
+    query di fallback del pre-filtro non ricalcola l'embedding).
+    """
+    backend = vector_backend(vector_db)
+    if backend is None:
+        return None
+
+    query_vec = (query_vectors or {}).get(query)
+    if query_vec is None:
+        query_vec = backend.embed_query(query)
+    if query_vectors is not None:
+        query_vectors[query] = query_vec
+
+    results = backend.query(query_vec, fetch_k, where)
+    embeddings = results["embeddings"]
+    if not embeddings:
+        return []
+
+    selected = set(
+        maximal_marginal_relevance(
+            np.array(query_vec, dtype=np.float32),
+            embeddings,
+            k=k,
+            lambda_mult=MMR_LAMBDA_MULT,
+        )
+    )
+
+    return [
+        _with_chunk_data(text, metadata, chunk_id, embedding)
+        for i, (chunk_id, text, metadata, embedding) in enumerate(
+            zip(
+                results["ids"],
+                results["documents"],
+                results["metadatas"],
+                embeddings,
+            )
+        )
+        if i in selected
+    ]
+
+
+def _vector_search(vector_db, query: str, k: int, query_vectors: dict, where=None) -> list:
+    """Una query dell'arm vettoriale (MMR, con fallback a similarity)."""
+    # Il filtro si passa alle API LangChain solo se presente: i vector store
+    # finti dei test non accettano il parametro.
+    extra = {"filter": where} if where is not None else {}
+
+    try:
+        partial = _mmr_search_with_vectors(
+            vector_db, query, k, max(k * 2, 20), query_vectors, where
+        )
+        if partial is None:
             partial = vector_db.max_marginal_relevance_search(
-                qv,
+                query,
                 k=k,
                 fetch_k=max(k * 2, 20),
+                **extra,
             )
 
-        except Exception:
-            partial = vector_db.similarity_search(qv, k=k)
+    except Exception:
+        partial = vector_db.similarity_search(query, k=k, **extra)
+
+    return partial
+
+
+def run_vector_queries(
+    vector_db,
+    query_variants: list[str],
+    k: int = DEFAULT_K_RETRIEVAL,
+    query_vectors: dict | None = None,
+    course_tags: list[str] | None = None,
+    min_results: int = RETRIEVAL_PREFILTER_MIN_RESULTS,
+    fallbacks: list | None = None,
+    variant_cache=None,
+    question: str | None = None,
+    document_index=None,
+    document_course_tags: list[str] | None = None,
+    document_top_n: int = DOCUMENT_STAGE_TOP_N,
+    selected_documents: dict | None = None,
+) -> list:
+    """Esegue le query vettoriali (MMR, con fallback a similarity) e deduplica.
+
+    Se `query_vectors` è un dizionario, vi registra il vettore di ogni variante
+    (riusabile a valle senza ricalcolarlo).
+
+    Con `course_tags` (Ciclo 3 — FASE 2) ogni variante è interrogata con il
+    filtro per corso; se rende meno di `min_results` documenti si aggiungono, in
+    coda, quelli della stessa query senza filtro, e la variante viene annotata in
+    `fallbacks` (se fornita).
+
+    Con `variant_cache` (Ciclo 3 — FASE 4, `variant_cache.VariantResultCache`)
+    le varianti che non dipendono da `question` (tutte, se `question` è None)
+    sono lette dalla cache o vi vengono registrate dopo il primo calcolo. La
+    cache vale per la ricerca su tutti i chunk: con `document_index` è ignorata.
+
+    Con `document_index` (Ciclo 3 — FASE 14, `document_index.DocumentIndex`) ogni
+    variante calcolata sceglie prima i `document_top_n` documenti più vicini fra
+    quelli dei corsi `document_course_tags`, poi cerca solo fra i loro chunk; i
+    documenti scelti vengono annotati in `selected_documents` (se fornito). Se il
+    secondo stadio rende meno di `min_results` documenti, la variante viene
+    ripetuta sull'intero indice (con il solo filtro per corso, se presente).
+    """
+    all_docs = []
+    seen = set()
+    vectors = query_vectors if query_vectors is not None else {}
+    where = _course_where(course_tags)
+
+    for qv in query_variants:
+        cacheable = variant_cache is not None and document_index is None and (
+            question is None or is_constant_variant(qv, question)
+        )
+        cached = variant_cache.get(qv, k, course_tags) if cacheable else None
+
+        if cached is not None:
+            partial, fell_back = cached
+        else:
+            sources = (
+                _select_documents(
+                    vector_db, document_index, qv, document_top_n, vectors, document_course_tags
+                )
+                if document_index is not None
+                else None
+            )
+            if sources:
+                if selected_documents is not None:
+                    selected_documents[qv] = sources
+                partial = _vector_search(vector_db, qv, k, vectors, _source_where(where, sources))
+                if len(partial) < min_results:
+                    keys = {_doc_key(doc) for doc in partial}
+                    partial = list(partial) + [
+                        doc
+                        for doc in _vector_search(vector_db, qv, k, vectors, where)
+                        if _doc_key(doc) not in keys
+                    ]
+            else:
+                partial = _vector_search(vector_db, qv, k, vectors, where)
+            fell_back = where is not None and len(partial) < min_results
+            if fell_back:
+                partial = list(partial) + list(_vector_search(vector_db, qv, k, vectors))
+            if cacheable:
+                variant_cache.put(qv, k, course_tags, partial, fell_back)
+
+        if fell_back and fallbacks is not None:
+            fallbacks.append(qv)
 
         for doc in partial:
             key = _doc_key(doc)
@@ -208,7 +451,14 @@ def run_vector_queries(vector_db, query_variants: list[str], k: int = DEFAULT_K_
 
 
 class Bm25Index:
-    """Indice BM25 (Okapi) costruito sui chunk già presenti in ChromaDB."""
+    """Indice BM25 (Okapi) costruito sui chunk già presenti in ChromaDB.
+
+    Dal Ciclo 3 — FASE 3 i chunk sono anche partizionati per
+    (`course_tag`, `doc_type`): una ricerca ristretta a certi corsi/tipi
+    valuta solo le partizioni pertinenti, con le statistiche globali del
+    corpus (IDF e lunghezza media), quindi con gli stessi punteggi della
+    ricerca sull'intero indice.
+    """
 
     def __init__(self, documents: list):
         self._docs = list(documents)
@@ -217,37 +467,86 @@ class Bm25Index:
         # token sentinella che non compare nelle query reali.
         tokenized = [tokenize(d.page_content) or ["∅"] for d in self._docs]
         self._bm25 = BM25Okapi(tokenized) if self._docs else None
+        self._doc_len = np.asarray(self._bm25.doc_len, dtype=float) if self._bm25 else None
+
+        partitions: dict = {}
+        for i, doc in enumerate(self._docs):
+            metadata = doc.metadata or {}
+            key = (metadata.get("course_tag", "generale"), metadata.get("doc_type", "altro"))
+            partitions.setdefault(key, []).append(i)
+        self._partitions = partitions
 
     def __len__(self) -> int:
         return len(self._docs)
 
-    def search(self, query: str, k: int) -> list:
+    def partition_ids(self, course_tags=None, doc_types=None) -> list[int]:
+        """Indici (ordinati) dei chunk nelle partizioni dei corsi/tipi indicati."""
+        return sorted(
+            i
+            for (course_tag, doc_type), ids in self._partitions.items()
+            if (not course_tags or course_tag in course_tags)
+            and (not doc_types or doc_type in doc_types)
+            for i in ids
+        )
+
+    def _scores(self, tokens: list[str], ids: list[int]) -> np.ndarray:
+        """Punteggi BM25 dei soli chunk `ids`, con IDF e avgdl globali."""
+        bm25 = self._bm25
+        doc_len = self._doc_len[ids]
+        norm = bm25.k1 * (1 - bm25.b + bm25.b * doc_len / bm25.avgdl)
+        scores = np.zeros(len(ids))
+        for token in tokens:
+            idf = bm25.idf.get(token)
+            if not idf:
+                continue
+            freq = np.array([bm25.doc_freqs[i].get(token, 0) for i in ids], dtype=float)
+            scores += idf * (freq * (bm25.k1 + 1) / (freq + norm))
+        return scores
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        course_tags: list[str] | None = None,
+        doc_types: list[str] | None = None,
+    ) -> list:
+        """Top-k per punteggio BM25; con `course_tags`/`doc_types` solo le partizioni indicate."""
         if not self._bm25 or not self._docs:
             return []
 
-        scores = self._bm25.get_scores(tokenize(query))
-        order = sorted(range(len(self._docs)), key=lambda i: scores[i], reverse=True)
+        tokens = tokenize(query)
+        if course_tags or doc_types:
+            ids = self.partition_ids(course_tags, doc_types)
+            scores = self._scores(tokens, ids)
+        else:
+            ids = range(len(self._docs))
+            scores = self._bm25.get_scores(tokens)
+
+        order = sorted(range(len(ids)), key=lambda j: scores[j], reverse=True)
 
         results = []
-        for i in order[:k]:
-            if scores[i] <= 0:
+        for j in order[:k]:
+            if scores[j] <= 0:
                 break
-            results.append(self._docs[i])
+            results.append(self._docs[ids[j]])
 
         return results
 
 
 def build_bm25_index(vector_db):
-    """Costruisce l'indice BM25 leggendo i chunk persistiti in ChromaDB.
+    """Costruisce l'indice BM25 leggendo i chunk persistiti nel vector store.
 
     Restituisce ``None`` se il vector store è assente, privo del metodo ``get`` o
     vuoto (così i test con vector store finto e i casi senza indice restano validi).
+    I documenti portano ID e vettore del chunk (Ciclo 3 — FASE 1), come i
+    candidati dell'arm vettoriale. `get` ha la stessa forma su Chroma e
+    sull'indice piatto (`vector_store.FlatVectorStore`, FASE 11).
     """
     if vector_db is None or not hasattr(vector_db, "get"):
         return None
 
     try:
-        data = vector_db.get()
+        data = vector_db.get(include=["documents", "metadatas", "embeddings"])
     except Exception as exc:
         logger.warning("Indice BM25 non costruito: %s", exc)
         return None
@@ -258,9 +557,14 @@ def build_bm25_index(vector_db):
     if not texts:
         return None
 
+    ids = data.get("ids") or [None] * len(texts)
+    embeddings = data.get("embeddings")
+    if embeddings is None or len(embeddings) != len(texts):
+        embeddings = [None] * len(texts)
+
     documents = [
-        Document(page_content=text or "", metadata=(metadata or {}))
-        for text, metadata in zip(texts, metadatas)
+        _with_chunk_data(text, metadata, chunk_id, embedding)
+        for text, metadata, chunk_id, embedding in zip(texts, metadatas, ids, embeddings)
     ]
 
     return Bm25Index(documents)
@@ -299,19 +603,75 @@ def hybrid_retrieve(
     trace: RagTrace,
     k: int = DEFAULT_K_RETRIEVAL,
     use_bm25: bool = True,
+    query_vectors: dict | None = None,
+    prefilter: bool = False,
+    variant_cache=None,
+    document_index=None,
 ) -> list:
-    """Genera i candidati fondendo arm vettoriale e lessicale (RRF) e ne traccia lo scoring."""
+    """Genera i candidati fondendo arm vettoriale e lessicale (RRF) e ne traccia lo scoring.
+
+    `query_vectors` (opzionale) raccoglie i vettori delle varianti calcolati
+    dall'arm vettoriale, incluso quello della domanda stessa. Con `prefilter`
+    (Ciclo 3 — FASE 2) entrambi gli arm recuperano solo i chunk dei corsi
+    ammessi da `prefilter_course_tags`, con fallback senza filtro se il
+    risultato filtrato è troppo piccolo. `variant_cache` (FASE 4) fornisce i
+    risultati precalcolati delle varianti che non contengono la domanda.
+
+    Con `document_index` (Ciclo 3 — FASE 14) l'arm vettoriale è a due stadi:
+    documenti, poi chunk. Il primo stadio ammette solo i documenti che
+    `filter_documents_by_course` terrebbe (anche senza `prefilter`), così la
+    scelta dei documenti non spreca posti su corsi scartati a valle.
+    """
     variants = build_query_variants(question, intent)
     trace.query_variants = variants
 
-    vector_docs = run_vector_queries(vector_db, variants, k)
+    course_tags = prefilter_course_tags(intent) if prefilter else None
+    fallbacks: list = []
+    selected_documents: dict = {}
+
+    vector_docs = run_vector_queries(
+        vector_db,
+        variants,
+        k,
+        query_vectors,
+        course_tags,
+        fallbacks=fallbacks,
+        variant_cache=variant_cache,
+        question=question,
+        document_index=document_index,
+        document_course_tags=prefilter_course_tags(intent),
+        selected_documents=selected_documents,
+    )
     ranked_lists = [("vector", vector_docs)]
 
     if use_bm25 and bm25_index is not None and len(bm25_index):
-        bm25_docs = bm25_index.search(question, k)
+        bm25_docs = bm25_index.search(question, k, course_tags)
+        if course_tags and len(bm25_docs) < RETRIEVAL_PREFILTER_MIN_RESULTS:
+            seen = {_doc_key(doc) for doc in bm25_docs}
+            bm25_docs += [
+                doc for doc in bm25_index.search(question, k) if _doc_key(doc) not in seen
+            ]
+            fallbacks.append("BM25")
         if bm25_docs:
             ranked_lists.append(("bm25", bm25_docs))
 
+    if course_tags:
+        trace.prefilter = "course_tag ∈ {{{tags}}} | fallback senza filtro: {n}/{tot}".format(
+            tags=", ".join(course_tags),
+            n=len(fallbacks),
+            tot=len(variants) + (1 if use_bm25 and bm25_index is not None and len(bm25_index) else 0),
+        )
+
+    if document_index is not None:
+        chosen = list(dict.fromkeys(s for sources in selected_documents.values() for s in sources))
+        trace.document_stage = "{n} documenti su {tot} | varianti a due stadi: {v}/{nv} | {names}".format(
+            n=len(chosen),
+            tot=len(document_index),
+            v=len(selected_documents),
+            nv=len(variants),
+            names=", ".join(os.path.basename(s) for s in chosen) or "nessuno",
+        )
+
     trace.retrieval_mode = "hybrid" if len(ranked_lists) > 1 else "vettoriale"
 
     fused = reciprocal_rank_fusion(ranked_lists)
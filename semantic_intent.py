@@ -101,8 +101,12 @@ TOPIC_ANCHORS: dict[str, list[str]] = {
 
 
 def cosine_similarity(a: list[float], b: list[float]) -> float:
-    """Similarità del coseno fra due vettori. Funzione pura, 0.0 se un vettore è nullo."""
-    if not a or not b or len(a) != len(b):
+    """Similarità del coseno fra due vettori. Funzione pura, 0.0 se un vettore è nullo.
+
+    Accetta liste o array NumPy (i vettori memorizzati in ChromaDB arrivano come
+    array `float32`, Ciclo 3 — FASE 1).
+    """
+    if a is None or b is None or len(a) == 0 or len(b) == 0 or len(a) != len(b):
         return 0.0
 
     dot = 0.0
@@ -174,6 +178,10 @@ class SemanticIntentClassifier:
         """True se un embedder è stato iniettato (il modulo non ne carica di propri)."""
         return self._embedder is not None and not self._embed_failed
 
+    def warm_up(self) -> bool:
+        """Incorpora subito gli anchor (warm-up in background, Ciclo 3 — FASE 8)."""
+        return self._ensure_anchor_vecs()
+
     def _embed(self, texts: list[str]) -> Optional[list[list[float]]]:
         if self._embedder is None or self._embed_failed:
             return None
@@ -216,3 +216,45 @@ def test_responder_semantic_abstention_safe_without_vector_db():
     r = UniLawResponder(vector_db=None, use_semantic_abstention=True)
     assert r.use_semantic_abstention is True
     assert r.semantic_abstention_embedder is None
+
+
+# --- Ciclo 3 — FASE 1: vettori memorizzati riusati dall'astensione semantica --
+
+def _counting_embedder(calls):
+    def embed(texts):
+        calls.append(list(texts))
+        return _concept_embedder(texts)
+
+    return embed
+
+
+def test_semantic_strength_uses_stored_vectors_without_embedding():
+    # Domanda e fonte già vettorializzate: nessuna chiamata all'embedder.
+    calls = []
+    s = [_src("testo qualunque")]
+    s[0].embedding = [1.0, 0.0, 0.0]
+    strength = semantic_retrieval_strength(
+        "la tesi è consultabile?", s, _counting_embedder(calls), query_vector=[1.0, 0.0, 0.0]
+    )
+    assert strength == 1.0
+    assert calls == []
+
+
+def test_semantic_strength_embeds_only_missing_vectors():
+    calls = []
+    stored = _src("fonte già indicizzata")
+    stored.embedding = [0.0, 1.0, 0.0]
+    fresh = _src("L'elaborato finale resta accessibile in biblioteca.")
+    q = "la tesi è consultabile?"
+    strength = semantic_retrieval_strength(q, [stored, fresh], _counting_embedder(calls))
+    # Embedder chiamato una sola volta, per la domanda e la sola fonte senza vettore.
+    assert calls == [[q, fresh.content]]
+    assert strength >= 0.9
+
+
+def test_semantic_strength_stored_vectors_work_without_embedder():
+    s = [_src("x")]
+    s[0].embedding = [0.0, 1.0, 0.0]
+    assert semantic_retrieval_strength("domanda", s, None, query_vector=[0.0, 1.0, 0.0]) == 1.0
+    # Se manca anche un solo vettore e l'embedder è assente: fallback a 0.0.
+    assert semantic_retrieval_strength("domanda", s, None) == 0.0
@@ -0,0 +1,173 @@
+"""Test dell'API HTTP contro un server Ollama finto (Ciclo 3 — FASE 24). Offline."""
+
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_community.chat_models import ChatOllama
+from langchain_core.documents import Document
+
+from agent import UniLawResponder
+from api_server import AdmissionControl, APIServer, Rejected, UniLawAPI
+from config import DEFAULT_MODEL_NAME
+from vector_store import FlatVectorStore
+
+QUESTION = "Come si svolge la prova finale di informatica?"
+TOKENS = ["La prova finale consiste ", "nella discussione di un elaborato ", "[F1]."]
+
+
+class _FakeOllama(BaseHTTPRequestHandler):
+    """`/api/chat` di Ollama: risposta NDJSON a frammenti, trattenuta finché `gate` è chiuso."""
+
+    gate = threading.Event()
+    calls = []
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _FakeOllama.calls.append(payload["messages"][-1]["content"])
+        _FakeOllama.gate.wait(10)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in TOKENS:
+            line = {"model": payload["model"], "message": {"role": "assistant", "content": token}, "done": False}
+            self.wfile.write(json.dumps(line).encode() + b"\n")
+        self.wfile.write(json.dumps({"model": payload["model"], "message": {"content": ""}, "done": True}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        text = text.lower()
+        return [text.count(word) + 0.1 for word in ("prova", "finale", "tolc", "erasmus")]
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def api(tmp_path):
+    _FakeOllama.gate.set()
+    _FakeOllama.calls = []
+    ollama = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOllama)
+    ollama_url = _serve(ollama)
+
+    chunks = [
+        Document(
+            page_content="Art. 5 Prova finale. La prova finale consiste nella discussione di un elaborato "
+            "scritto concordato con un docente relatore.",
+            metadata={"filename": "Regolamento-prova-finale-informatica-l31.pdf", "page": 0,
+                      "course_tag": "informatica", "doc_type": "tesi"},
+        ),
+        Document(
+            page_content="Il TOLC-I si considera superato con punteggio pari almeno a 16.",
+            metadata={"filename": "regolamento-informatica-l31.pdf", "page": 2,
+                      "course_tag": "informatica", "doc_type": "accesso"},
+        ),
+    ]
+    store = FlatVectorStore.build(chunks, _Embeddings(), tmp_path / "flat", ids=["c1", "c2"])
+    responder = UniLawResponder(store, use_variant_cache=False)
+    responder.llm = ChatOllama(base_url=ollama_url, model=DEFAULT_MODEL_NAME)
+
+    server = APIServer(UniLawAPI(responder, AdmissionControl(slots=1, queue_size=1, per_client=2)), ("127.0.0.1", 0))
+    url = _serve(server)
+    yield url, server.api
+    _FakeOllama.gate.set()
+    server.shutdown()
+    ollama.shutdown()
+
+
+def _request(url, path, body=None, client=None):
+    headers = {"Content-Type": "application/json"}
+    if client:
+        headers["X-Client-Id"] = client
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url + path, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=15) as response:
+            return response.status, dict(response.headers), response.read().decode("utf-8")
+    except urllib.error.HTTPError as exc:
+        return exc.code, dict(exc.headers), exc.read().decode("utf-8")
+
+
+def test_answer_retrieve_and_health_end_to_end(api):
+    url, _ = api
+    status, _, body = _request(url, "/answer", {"question": QUESTION})
+    result = json.loads(body)
+    assert status == 200 and result["answer"].startswith("La prova finale consiste nella discussione")
+    assert "Fonti citate" in result["answer"] and "[F1]" in result["answer"]
+    assert result["trace"]["interpretation"]["topic"] == "tesi"
+    assert result["memory"] == {"last_course_tag": "informatica", "last_topic": "tesi"}
+    assert "prova finale" in _FakeOllama.calls[-1]  # il prompt arriva al modello
+
+    status, headers, body = _request(url, "/answer", {"question": QUESTION, "stream": True})
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert status == 200 and headers["Content-Type"].startswith("application/x-ndjson")
+    assert [line["token"] for line in lines[:-1]] == TOKENS
+    assert lines[-1]["answer"] == result["answer"]
+
+    status, _, body = _request(url, "/retrieve", {"question": QUESTION})
+    sources = json.loads(body)["sources"]
+    assert status == 200 and sources[0]["chunk_id"] == "c1" and len(_FakeOllama.calls) == 2
+
+    status, _, body = _request(url, "/health")
+    assert status == 200 and json.loads(body)["admission"] == {"slots": 1, "queue_size": 1, "running": 0, "waiting": 0}
+    assert _request(url, "/answer", {"domanda": QUESTION})[0] == 400
+    for body in ([], "x", 1):  # JSON valido ma non un oggetto
+        assert _request(url, "/answer", body)[0] == 400 and _request(url, "/retrieve", body)[0] == 400
+    assert _request(url, "/nessuna", {"question": QUESTION})[0] == 404
+
+
+def test_full_queue_and_busy_clients_get_429(api):
+    url, server_api = api
+    _FakeOllama.gate.clear()  # Ollama occupato: la prima richiesta resta in esecuzione
+    results = []
+    threads = [
+        threading.Thread(target=lambda c=client: results.append(_request(url, "/answer", {"question": QUESTION}, c)))
+        for client in ("studente-1", "studente-2")
+    ]
+    for thread in threads:
+        thread.start()
+    stats = server_api.admission.stats
+    for _ in range(100):
+        if stats()["running"] == 1 and stats()["waiting"] == 1:
+            break
+        threading.Event().wait(0.05)
+    assert stats() == {"slots": 1, "queue_size": 1, "running": 1, "waiting": 1}
+
+    status, headers, body = _request(url, "/answer", {"question": QUESTION}, "studente-3")
+    assert status == 429 and json.loads(body)["error"] == "coda piena" and int(headers["Retry-After"]) > 0
+    # Il retrieval non chiama il modello: posti propri, non attende le generazioni.
+    status, _, body = _request(url, "/retrieve", {"question": QUESTION}, "studente-3")
+    assert status == 200 and json.loads(body)["sources"][0]["chunk_id"] == "c1"
+    assert server_api.retrieval_admission.stats()["running"] == 0
+
+    _FakeOllama.gate.set()
+    for thread in threads:
+        thread.join(15)
+    assert [status for status, _, _ in results] == [200, 200]
+    assert stats()["running"] == 0 and stats()["waiting"] == 0
+
+
+def test_admission_limits_concurrent_requests_per_client():
+    admission = AdmissionControl(slots=2, queue_size=2, per_client=1)
+    with admission.admit("portale") as waited:
+        assert waited < 1
+        with pytest.raises(Rejected, match="client"):
+            with admission.admit("portale"):
+                pass
+        with admission.admit("altro"):
+            assert admission.stats()["running"] == 2
+    with admission.admit("portale"):
+        pass
+    assert admission.stats() == {"slots": 2, "queue_size": 2, "running": 0, "waiting": 0}
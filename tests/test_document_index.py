@@ -0,0 +1,126 @@
+"""Test del retrieval a due stadi, documento poi chunk (Ciclo 3 — FASE 14). Offline."""
+
+import json
+
+import numpy as np
+from langchain_core.documents import Document
+
+import document_index
+from document_index import DocumentIndex, load_index_document_index
+from rag_types import QueryIntent, RagTrace
+from retrieval import hybrid_retrieve, run_vector_queries
+from vector_store import FlatVectorStore
+
+# Tre PDF: un regolamento di informatica (due sezioni con temi diversi), il bando
+# Erasmus (generale) e un regolamento di economia.
+_ROWS = [
+    ("reg_inf.pdf", 0, "informatica", "tolc soglia accesso", [1.0, 0.0, 0.0, 0.0]),
+    ("reg_inf.pdf", 1, "informatica", "ofa recupero accesso", [0.9, 0.1, 0.0, 0.0]),
+    ("reg_inf.pdf", 8, "informatica", "tesi relatore", [0.0, 0.0, 0.0, 1.0]),
+    ("erasmus.pdf", 0, "generale", "bando erasmus mobilità", [0.0, 1.0, 0.0, 0.0]),
+    ("erasmus.pdf", 1, "generale", "learning agreement", [0.1, 0.9, 0.0, 0.0]),
+    ("reg_eco.pdf", 0, "economia", "tolc economia accesso", [0.8, 0.0, 0.2, 0.0]),
+]
+_VECTORS = {text: vector for *_, text, vector in _ROWS}
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [_VECTORS[t] for t in texts]
+
+    def embed_query(self, text):
+        return _VECTORS.get(text, [1.0, 0.0, 0.0, 0.0])
+
+
+def _store(path):
+    docs = [
+        Document(page_content=text, metadata={"source": source, "page": page, "course_tag": tag})
+        for source, page, tag, text, _ in _ROWS
+    ]
+    return FlatVectorStore.build(docs, _Embeddings(), path)
+
+
+def test_build_keeps_sections_and_selects_by_course(tmp_path):
+    index = DocumentIndex.from_vector_db(_store(tmp_path / "flat"), sections=2)
+    assert index.sources == ["erasmus.pdf", "reg_eco.pdf", "reg_inf.pdf"]
+    assert len(index.centroids) == 5  # 2 + 1 + 2 sezioni
+
+    # La sezione "tesi" del regolamento resta distinguibile dall'accesso.
+    assert index.select([0.0, 0.0, 0.0, 1.0], 1) == ["reg_inf.pdf"]
+    assert index.select([1.0, 0.0, 0.0, 0.0], 2) == ["reg_inf.pdf", "reg_eco.pdf"]
+    assert index.select([1.0, 0.0, 0.0, 0.0], 2, ["informatica", "generale"]) == [
+        "reg_inf.pdf",
+        "erasmus.pdf",
+    ]
+
+    index.save(tmp_path / "doc.npz")
+    reopened = DocumentIndex.load(tmp_path / "doc.npz")
+    assert reopened.sources == index.sources and reopened.signature is None
+    assert np.allclose(reopened.centroids, index.centroids)
+
+
+def test_second_stage_searches_only_selected_documents(tmp_path):
+    store = _store(tmp_path / "flat")
+    index = DocumentIndex.from_vector_db(store)
+    selected = {}
+    docs = run_vector_queries(
+        store,
+        ["tolc soglia accesso"],
+        k=3,
+        document_index=index,
+        document_top_n=1,
+        min_results=2,
+        selected_documents=selected,
+    )
+    assert selected == {"tolc soglia accesso": ["reg_inf.pdf"]}
+    assert {d.metadata["source"] for d in docs} == {"reg_inf.pdf"}
+
+    # Secondo stadio troppo povero: la variante è ripetuta sull'intero indice.
+    docs = run_vector_queries(
+        store, ["tolc soglia accesso"], k=3, document_index=index, document_top_n=1, min_results=4
+    )
+    assert "reg_eco.pdf" in {d.metadata["source"] for d in docs}
+    assert len(docs) == len({d.page_content for d in docs})
+
+
+def test_hybrid_traces_document_stage_and_respects_course_rule(tmp_path):
+    store = _store(tmp_path / "flat")
+    index = DocumentIndex.from_vector_db(store)
+
+    trace = RagTrace()
+    hybrid_retrieve(store, None, "tolc soglia accesso", QueryIntent(None, None), trace, use_bm25=False)
+    assert trace.document_stage == ""
+
+    trace = RagTrace()
+    docs = hybrid_retrieve(
+        store,
+        None,
+        "tolc soglia accesso",
+        QueryIntent("informatica", "accesso"),
+        trace,
+        use_bm25=False,
+        document_index=index,
+    )
+    assert trace.document_stage.startswith("2 documenti su 3")
+    assert "reg_eco.pdf" not in trace.document_stage
+    assert "economia" not in {d.metadata["course_tag"] for d in docs}
+
+
+def test_index_is_persisted_next_to_manifest_and_tied_to_signature(tmp_path, monkeypatch):
+    store = _store(tmp_path / "flat")
+    monkeypatch.setattr(document_index, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    manifest = tmp_path / "index_manifest.json"
+    monkeypatch.setattr(document_index, "INDEX_MANIFEST_FILE", manifest.name)
+    manifest.write_text(json.dumps({"files": {"a.pdf": "1"}}), encoding="utf-8")
+
+    first = load_index_document_index(store)
+    path = tmp_path / document_index.DOCUMENT_INDEX_FILE
+    assert path.exists() and first.signature
+
+    # Stessa firma: l'indice viene letto dal file, senza ricalcolo.
+    monkeypatch.setattr(DocumentIndex, "from_vector_db", None)
+    assert load_index_document_index(store).sources == first.sources
+
+    manifest.write_text(json.dumps({"files": {"a.pdf": "2"}}), encoding="utf-8")
+    assert load_index_document_index(store) is None  # firma cambiata, ricalcolo fallito: avviso
+    assert load_index_document_index(None) is None
@@ -0,0 +1,66 @@
+"""Test della cache degli embedding indirizzata per contenuto (Ciclo 3 — FASE 17). Offline."""
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_FILE
+from embedding_cache import CachedEmbeddings, EmbeddingCache, embedding_key, embedding_model_key
+from index_generations import collect_garbage, new_generation, publish_generation
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 0.5, -1.0 / 3.0] for t in texts]
+
+    def embed_query(self, text):
+        return [1.0, 0.0, 0.0]
+
+
+def test_rebuild_embeds_only_new_texts(tmp_path):
+    model = _Embeddings()
+    cached = CachedEmbeddings(model, EmbeddingCache(tmp_path / EMBEDDING_CACHE_FILE), "m|float")
+
+    first = cached.embed_documents(["art. 1", "art. 2", "art. 1"])
+    assert model.calls == [["art. 1", "art. 2"]]  # testo ripetuto calcolato una volta
+    assert first[0] == first[2] and np.allclose(first[1], [6.0, 0.5, -1.0 / 3.0])
+    model.calls.clear()
+
+    # Chunking diverso: solo il testo nuovo passa dal modello, vettori identici.
+    second = cached.embed_documents(["art. 2", "art. 3 nuovo", "art. 1"])
+    assert model.calls == [["art. 3 nuovo"]]
+    assert (cached.hits, cached.misses) == (2, 1)
+    assert second[0] == first[1] and second[2] == first[0]
+    assert len(cached.cache) == 3
+    assert cached.embed_query("domanda") == [1.0, 0.0, 0.0]
+
+
+def test_key_depends_on_model_and_precision(tmp_path):
+    assert embedding_model_key("m", False) != embedding_model_key("m", True)
+    assert embedding_key("m|float", "testo") != embedding_key("m|int8", "testo")
+    assert len(embedding_key("m|float", "testo")) == 16
+
+    cache = EmbeddingCache(tmp_path / EMBEDDING_CACHE_FILE)
+    model = _Embeddings()
+    CachedEmbeddings(model, cache, "m|float").embed_documents(["testo"])
+    CachedEmbeddings(model, cache, "m|int8").embed_documents(["testo"])
+    assert len(model.calls) == 2
+
+
+def test_unreadable_cache_falls_back_to_the_model(tmp_path):
+    path = tmp_path / EMBEDDING_CACHE_FILE
+    path.write_bytes(b"non un database sqlite")
+    model = _Embeddings()
+    vectors = CachedEmbeddings(model, EmbeddingCache(path), "m|float").embed_documents(["a", "b"])
+    assert len(vectors) == 2 and model.calls == [["a", "b"]]
+
+
+def test_cache_survives_generation_garbage_collection(tmp_path):
+    EmbeddingCache(tmp_path / EMBEDDING_CACHE_FILE).put_many({b"k" * 16: np.ones(3)})
+    (tmp_path / "chroma.sqlite3").write_bytes(b"")  # indice precedente alla FASE 16
+    publish_generation(new_generation(tmp_path), tmp_path)
+
+    assert collect_garbage(tmp_path, keep=1) == ["chroma.sqlite3"]
+    assert len(EmbeddingCache(tmp_path / EMBEDDING_CACHE_FILE)) == 1
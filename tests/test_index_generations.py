@@ -0,0 +1,110 @@
+"""Test delle generazioni dell'indice e del rebuild blue/green (Ciclo 3 — FASE 16). Offline."""
+
+import os
+import threading
+import time
+
+import index_generations
+from index_generations import (
+    BUILDING_MARKER,
+    IndexRebuild,
+    active_index_dir,
+    collect_garbage,
+    current_generation,
+    new_generation,
+    publish_generation,
+    start_rebuild,
+)
+
+
+def _write_index(path, label):
+    (path / "index_manifest.json").write_text(label, encoding="utf-8")
+
+
+def test_pointer_swap_selects_the_active_generation(tmp_path):
+    # Nessun puntatore: l'indice è nella radice, come prima della FASE 16.
+    _write_index(tmp_path, "radice")
+    assert current_generation(tmp_path) is None
+    assert active_index_dir(tmp_path) == tmp_path
+
+    path = new_generation(tmp_path)
+    assert (path / BUILDING_MARKER).exists()
+    assert active_index_dir(tmp_path) == tmp_path  # non ancora pubblicata
+
+    _write_index(path, "nuova")
+    publish_generation(path, tmp_path)
+    assert current_generation(tmp_path) == path.name
+    assert active_index_dir(tmp_path) == path
+    assert not (path / BUILDING_MARKER).exists()
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+
+def test_garbage_collection_keeps_recent_and_building_generations(tmp_path):
+    _write_index(tmp_path, "radice")
+    (tmp_path / "chroma.sqlite3").write_bytes(b"")
+
+    first = new_generation(tmp_path)
+    publish_generation(first, tmp_path)
+    # keep=2: la radice conta come la generazione precedente e resta.
+    assert collect_garbage(tmp_path, keep=2) == []
+    assert (tmp_path / "chroma.sqlite3").exists()
+
+    time.sleep(1.1)  # nomi ordinati per data e ora
+    second = new_generation(tmp_path)
+    publish_generation(second, tmp_path)
+    building = new_generation(tmp_path)  # rebuild concorrente ancora in corso
+
+    removed = collect_garbage(tmp_path, keep=2)
+    assert sorted(removed) == ["chroma.sqlite3", "index_manifest.json"]
+    assert first.is_dir() and second.is_dir() and building.is_dir()
+
+    publish_generation(building, tmp_path)
+    assert collect_garbage(tmp_path, keep=2) == [first.name]
+    assert active_index_dir(tmp_path) == building
+
+
+def test_failed_rebuild_removes_its_generation_and_keeps_the_active_one(tmp_path):
+    _write_index(tmp_path, "radice")
+
+    def build(path):
+        _write_index(path, "a metà")
+        raise ValueError("Nessun contenuto valido estratto dai PDF.")
+
+    rebuild = IndexRebuild(build, tmp_path)
+    rebuild.run()
+    assert rebuild.done and rebuild.error.startswith("Nessun contenuto")
+    assert rebuild.status().startswith("non riuscita")
+    assert not (tmp_path / "generations" / rebuild.generation).exists()
+    assert active_index_dir(tmp_path) == tmp_path
+
+
+def test_background_rebuild_serves_the_old_index_until_published(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_generations, "_REBUILD", None)
+    _write_index(tmp_path, "radice")
+    release = threading.Event()
+
+    def build(path):
+        release.wait(5)
+        _write_index(path, "nuova")
+        return "db"
+
+    rebuild = start_rebuild(build, tmp_path)
+    assert start_rebuild(build, tmp_path) is rebuild  # un solo rebuild alla volta
+    assert not rebuild.done and rebuild.status().startswith("in corso")
+    assert active_index_dir(tmp_path) == tmp_path
+
+    release.set()
+    assert rebuild.wait(5) and rebuild.error is None and rebuild.result == "db"
+    assert active_index_dir(tmp_path).name == rebuild.generation
+    assert (active_index_dir(tmp_path) / "index_manifest.json").read_text(encoding="utf-8") == "nuova"
+    assert index_generations.rebuild_in_progress() is rebuild
+
+
+def test_chroma_system_cache_is_guarded_against_a_renamed_attribute(tmp_path, monkeypatch, caplog):
+    from chromadb.api.client import SharedSystemClient
+
+    assert index_generations.chroma_system_cache() is SharedSystemClient._identifer_to_system
+    monkeypatch.delattr(SharedSystemClient, "_identifer_to_system")
+    assert index_generations.chroma_system_cache() is None
+    index_generations._release_chroma_system(tmp_path)  # nessuna eccezione, solo un avviso
+    assert "cache dei System non trovata" in caplog.text
@@ -0,0 +1,154 @@
+"""Test dei processi lettori e dello scrittore unico dell'indice (Ciclo 3 — FASE 22). Offline."""
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+
+from langchain_core.documents import Document
+
+import database
+import document_index
+import index_generations
+import variant_cache
+from config import DOCUMENT_INDEX_FILE, INDEX_MANIFEST_FILE
+from document_index import load_index_document_index
+from index_generations import (
+    IndexReader,
+    IndexRebuild,
+    IndexWriterBusy,
+    collect_garbage,
+    generation_number,
+    leased_generations,
+    new_generation,
+    publish_generation,
+    writer_lock,
+)
+from variant_cache import load_index_variant_cache, variant_cache_path
+from vector_store import FlatVectorStore
+
+
+def _publish(root, label):
+    path = new_generation(root)
+    (path / "label.txt").write_text(label, encoding="utf-8")
+    publish_generation(path, root)
+    time.sleep(0.01)  # mtime del puntatore distinto
+    return path
+
+
+def test_single_writer_and_read_only_processes_never_build(tmp_path, monkeypatch):
+    built = []
+
+    with writer_lock(tmp_path):
+        rebuild = IndexRebuild(built.append, tmp_path)
+        rebuild.run()
+        assert "già in scrittura" in rebuild.error and rebuild.generation is None
+    try:
+        with writer_lock(tmp_path):
+            with writer_lock(tmp_path):
+                raise AssertionError("secondo scrittore ammesso")
+    except IndexWriterBusy:
+        pass
+
+    monkeypatch.setattr(index_generations, "INDEX_READ_ONLY", True)
+    rebuild = IndexRebuild(built.append, tmp_path)
+    rebuild.run()
+    assert rebuild.error.startswith("processo in sola lettura")
+    assert built == [] and not (tmp_path / "generations").exists()
+
+    monkeypatch.setattr(database, "INDEX_READ_ONLY", True)
+    monkeypatch.setattr(database, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(database, "VECTOR_BACKEND", "flat")
+    monkeypatch.setattr(database, "_build_embeddings", lambda: None)
+    db, msg = database.inizializza_conoscenza.__wrapped__(force_rebuild=True)
+    assert db is None and "sola lettura" in msg
+
+
+def test_reader_polls_the_generation_number_and_switches(tmp_path):
+    assert generation_number(tmp_path) == 0
+    first = _publish(tmp_path, "prima")
+    assert generation_number(tmp_path) == 1
+
+    opened = []
+
+    def open_index(path):
+        opened.append(path.name)
+        return (path / "label.txt").read_text(encoding="utf-8")
+
+    reader = IndexReader(open_index, tmp_path, poll_interval=3600)
+    assert reader.get() == (first.name, "prima") and reader.number == 1
+    second = _publish(tmp_path, "seconda")
+    assert reader.get() == (first.name, "prima")  # prossimo controllo fra un'ora
+
+    reader.poll_interval = 0
+    assert reader.get() == (second.name, "seconda") and reader.number == 2
+    assert reader.get() == (second.name, "seconda")
+    assert opened == [first.name, second.name]  # puntatore invariato: nessuna riapertura
+    reader.close()
+
+
+def test_generation_open_in_a_reader_survives_garbage_collection(tmp_path):
+    first = _publish(tmp_path, "prima")
+    reader = IndexReader(lambda path: path.name, tmp_path, poll_interval=3600)
+    assert reader.get()[0] == first.name
+
+    time.sleep(1.1)  # nomi ordinati per data e ora
+    second = _publish(tmp_path, "seconda")
+    time.sleep(1.1)
+    _publish(tmp_path, "terza")
+    assert leased_generations(tmp_path) == {first.name}
+    assert collect_garbage(tmp_path, keep=1) == [second.name]
+    assert first.is_dir()
+
+    reader.close()
+    assert leased_generations(tmp_path) == set()
+    assert collect_garbage(tmp_path, keep=1) == [first.name]
+
+
+def test_published_chroma_database_is_in_wal_mode(tmp_path):
+    path = new_generation(tmp_path)
+    with closing(sqlite3.connect(path / "chroma.sqlite3")) as conn:
+        conn.execute("CREATE TABLE embeddings (id TEXT)")
+        conn.commit()
+    publish_generation(path, tmp_path)
+    with closing(sqlite3.connect(path / "chroma.sqlite3")) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [1.0 + text.count("tolc"), 1.0 + text.count("tesi"), 0.5]
+
+
+def _flat_generation(root, label):
+    path = new_generation(root)
+    docs = [Document(page_content=f"{label} tolc", metadata={"source": f"{label}.pdf", "page": 0}),
+            Document(page_content=f"{label} tesi", metadata={"source": f"{label}.pdf", "page": 1})]
+    store = FlatVectorStore.build(docs, _Embeddings(), path / "flat_index", ids=[f"{label}-0", f"{label}-1"])
+    (path / INDEX_MANIFEST_FILE).write_text(json.dumps({"documents": [label]}), encoding="utf-8")
+    return path, store
+
+
+def test_readers_never_write_index_artifacts_and_read_those_of_their_own_generation(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_index, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(variant_cache, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    first, first_store = _flat_generation(tmp_path, "prima")
+    load_index_document_index(first_store, rebuild=True)  # lo scrittore, prima di pubblicare
+    publish_generation(first, tmp_path)
+    second, _ = _flat_generation(tmp_path, "seconda")
+    publish_generation(second, tmp_path)
+
+    # Il lettore serve ancora la prima generazione: artefatti suoi, non della seconda.
+    assert load_index_document_index(first_store).sources == ["prima.pdf"]
+    assert not (second / DOCUMENT_INDEX_FILE).exists()
+
+    monkeypatch.setattr(document_index, "INDEX_READ_ONLY", True)
+    monkeypatch.setattr(variant_cache, "INDEX_READ_ONLY", True)
+    (first / DOCUMENT_INDEX_FILE).unlink()
+    assert load_index_document_index(first_store).sources == ["prima.pdf"]  # solo in memoria
+    assert len(load_index_variant_cache(first_store, k=1)) > 0
+    assert not (first / DOCUMENT_INDEX_FILE).exists() and not variant_cache_path(first).exists()
+    assert not list(first.glob("*.tmp"))
@@ -0,0 +1,95 @@
+"""Test dell'ingestione in streaming dei PDF (Ciclo 3 — FASE 19). Offline."""
+
+import pytest
+from langchain_core.documents import Document
+
+import database
+
+
+class _Loader:
+    """PyPDFLoader finto: una pagina per riga, con un errore opzionale a metà file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def lazy_load(self):
+        with open(self.path, encoding="utf-8") as fh:
+            for i, line in enumerate(fh.read().splitlines()):
+                if line == "ERRORE":
+                    raise ValueError("pagina illeggibile")
+                yield Document(page_content=line, metadata={"source": self.path, "page": i})
+
+
+@pytest.fixture
+def pdfs(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "PyPDFLoader", _Loader)
+    monkeypatch.setattr(database, "PAGE_CACHE_ENABLED", False)
+    monkeypatch.setattr(database, "CHUNK_SIZE", 40)
+    monkeypatch.setattr(database, "CHUNK_OVERLAP", 0)
+    first, second = tmp_path / "regolamento_informatica.pdf", tmp_path / "bando_erasmus.pdf"
+    first.write_text(
+        "\n".join(f"articolo {i} soglia tolc e obblighi formativi aggiuntivi" for i in range(7)),
+        encoding="utf-8",
+    )
+    second.write_text("mobilità erasmus\nintestazione\nintestazione\nERRORE\nmai letta", encoding="utf-8")
+    return [str(first), str(second)]
+
+
+def test_stream_batches_match_the_list_path(pdfs):
+    partial = {}
+    chunks = list(database._iter_chunks(pdfs, partial=partial))
+    # Pagina ripetuta tenuta (l'ID include la pagina), pagine dopo l'errore ignorate,
+    # pagine già lette tenute e segnalate.
+    assert [c.page_content for c in chunks if c.metadata["filename"] == "bando_erasmus.pdf"] == [
+        "mobilità erasmus",
+        "intestazione",
+        "intestazione",
+    ]
+    assert list(partial) == ["bando_erasmus.pdf"] and partial["bando_erasmus.pdf"]["pages"] == 3
+
+    batches = list(database._stream_batches(pdfs, batch_size=4, depth=1))
+    assert [len(b) for b in batches[:-1]] == [4] * (len(batches) - 1)
+    assert [c.metadata["chunk_id"] for b in batches for c in b] == [c.metadata["chunk_id"] for c in chunks]
+
+
+def test_stream_batches_propagate_errors_and_stop_the_producer(pdfs, monkeypatch):
+    def broken(pdf_files, near_dedup=None, partial=None, root=None):
+        yield Document(page_content="ok", metadata={})
+        raise RuntimeError("disco pieno")
+
+    iter_chunks = database._iter_chunks
+    monkeypatch.setattr(database, "_iter_chunks", broken)
+    with pytest.raises(RuntimeError, match="disco pieno"):
+        list(database._stream_batches(pdfs, batch_size=1))
+
+    # Il consumatore si ferma prima della fine: il produttore termina senza restare appeso.
+    monkeypatch.setattr(database, "_iter_chunks", iter_chunks)
+    stream = database._stream_batches(pdfs, batch_size=1, depth=1)
+    next(stream)
+    stream.close()
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return [1.0, 1.0]
+
+
+def test_manifest_records_pdfs_indexed_only_up_to_a_read_error(pdfs, tmp_path, monkeypatch):
+    for name, value in {
+        "CHROMA_PERSIST_DIRECTORY": str(tmp_path / "chroma"),
+        "VECTOR_BACKEND": "flat",
+        "TWO_STAGE_RETRIEVAL_ENABLED": False,
+        "NEAR_DEDUP_ENABLED": False,
+        "_build_embeddings": _Embeddings,
+    }.items():
+        monkeypatch.setattr(database, name, value)
+    index_dir = tmp_path / "chroma" / "generazione"
+    database._build_index(pdfs, {"documents": {}}, index_dir)
+
+    manifest = database._read_manifest(index_dir)
+    assert manifest["ingestion"]["partial_pdfs"] == {
+        "bando_erasmus.pdf": {"pages": 3, "error": "pagina illeggibile"}
+    }
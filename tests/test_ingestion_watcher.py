@@ -0,0 +1,144 @@
+"""Test del watcher della cartella dei documenti (Ciclo 3 — FASE 21). Offline."""
+
+import os
+import threading
+
+import pytest
+from langchain_core.documents import Document
+
+import database
+from index_generations import active_index_dir, current_generation, writer_lock
+from ingestion_watcher import FolderWatcher, diff_snapshots, folder_snapshot, watcher_active
+from vector_store import FlatVectorStore
+
+
+class _Loader:
+    extracted = []
+
+    def __init__(self, path):
+        self.path = path
+
+    def lazy_load(self):
+        _Loader.extracted.append(os.path.basename(self.path))
+        with open(self.path, encoding="utf-8") as fh:
+            for i, page in enumerate(fh.read().split("\f")):
+                yield Document(page_content=page, metadata={"source": self.path, "page": i})
+
+
+class _Embeddings:
+    embedded = []
+
+    def embed_documents(self, texts):
+        _Embeddings.embedded.extend(texts)
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return [1.0, 1.0]
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    root, docs = tmp_path / "chroma", tmp_path / "documenti"
+    docs.mkdir()
+    for name, value in {
+        "PyPDFLoader": _Loader,
+        "CHROMA_PERSIST_DIRECTORY": str(root),
+        "VECTOR_BACKEND": "flat",
+        "TWO_STAGE_RETRIEVAL_ENABLED": False,
+        "NEAR_DEDUP_ENABLED": False,
+        "_build_embeddings": _Embeddings,
+    }.items():
+        monkeypatch.setattr(database, name, value)
+    monkeypatch.setattr(_Loader, "extracted", [])
+    monkeypatch.setattr(_Embeddings, "embedded", [])
+    return root, docs
+
+
+def test_poll_debounces_until_the_folder_is_still(folders):
+    root, docs = folders
+    watcher = FolderWatcher(str(docs), root, debounce=10)
+    (docs / "bando_erasmus.pdf").write_text("mobilità", encoding="utf-8")
+    (docs / "note.txt").write_text("ignorato", encoding="utf-8")
+
+    assert watcher.poll(now=0) is None  # appena comparso
+    (docs / "bando_erasmus.pdf").write_text("mobilità erasmus 2026", encoding="utf-8")  # copia in corso
+    assert watcher.poll(now=8) is None
+    assert watcher.poll(now=17) is None
+    assert watcher.poll(now=18) == {"added": ["bando_erasmus.pdf"], "removed": [], "modified": []}
+
+    old = folder_snapshot(str(docs))
+    new = {**old, "bando_erasmus.pdf": (1, 2), "regolamento.pdf": (3, 4)}
+    assert diff_snapshots(new, old) == {"added": [], "removed": ["regolamento.pdf"], "modified": ["bando_erasmus.pdf"]}
+
+
+def test_ingest_publishes_generations_and_reprocesses_only_changed_pdfs(folders):
+    root, docs = folders
+    (docs / "regolamento_informatica.pdf").write_text("soglia tolc 16\fofa recupero", encoding="utf-8")
+    (docs / "bando_erasmus.pdf").write_text("mobilità erasmus", encoding="utf-8")
+    watcher = FolderWatcher(str(docs), root, debounce=0)
+
+    first = watcher.ingest()
+    assert first["error"] is None and first["published"] == current_generation(root)
+    assert sorted(_Loader.extracted) == ["bando_erasmus.pdf", "regolamento_informatica.pdf"]
+
+    assert watcher.poll() is None  # nulla di nuovo
+    assert watcher.ingest()["published"] is None  # stesso contenuto: nessuna generazione
+
+    _Loader.extracted.clear()
+    _Embeddings.embedded.clear()
+    (docs / "bando_erasmus.pdf").write_text("mobilità erasmus\fborse mensili", encoding="utf-8")
+    (docs / "regolamento_informatica.pdf").unlink()
+    changes = watcher.poll()
+    assert changes == {"added": [], "removed": ["regolamento_informatica.pdf"], "modified": ["bando_erasmus.pdf"]}
+
+    second = watcher.ingest(changes)
+    assert second["published"] not in (None, first["published"])
+    assert _Loader.extracted == ["bando_erasmus.pdf"]
+    assert _Embeddings.embedded == ["borse mensili"]  # il resto dalla cache degli embedding
+    store = FlatVectorStore.load(database._flat_index_dir(active_index_dir(root)))
+    assert sorted(store.get()["documents"]) == ["borse mensili", "mobilità erasmus"]
+
+
+def test_failed_ingestion_keeps_the_changes_and_retries_with_backoff(folders, tmp_path):
+    root, docs = folders
+    (docs / "bando_erasmus.pdf").write_text("mobilità erasmus", encoding="utf-8")
+    FolderWatcher(str(docs), root, debounce=0).ingest()  # indice della cartella sotto la radice di default
+
+    other = tmp_path / "altra_radice"
+    watcher = FolderWatcher(str(docs), other, interval=10, debounce=0)
+    with writer_lock(other):  # un altro processo sta scrivendo l'indice
+        busy = watcher.ingest(now=100)
+    assert "già in scrittura" in busy["error"] and current_generation(other) is None
+
+    changes = {"added": ["bando_erasmus.pdf"], "removed": [], "modified": []}
+    assert watcher.poll(now=105) is None  # in attesa del nuovo tentativo
+    assert watcher.poll(now=110) == changes  # modifiche non perse
+    with writer_lock(other):
+        watcher.ingest(changes, now=110)
+    assert watcher.poll(now=125) is None and watcher.poll(now=130) == changes  # attesa raddoppiata
+
+    done = watcher.ingest(changes, now=130)
+    assert done["error"] is None and done["published"] == current_generation(other)
+    assert watcher.poll(now=131) is None
+    # Indice, cache delle pagine e degli embedding sotto la radice del watcher.
+    assert (other / "page_cache").is_dir() and (other / "embedding_cache.sqlite3").exists()
+
+
+def test_run_keeps_a_heartbeat_while_alive(folders):
+    root, docs = folders
+    (docs / "bando_erasmus.pdf").write_text("mobilità erasmus", encoding="utf-8")
+    watcher = FolderWatcher(str(docs), root, interval=0.05, debounce=0)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        for _ in range(100):
+            if watcher.last_result is not None:
+                break
+            stop.wait(0.05)
+        assert watcher_active(root, max_age=5)
+        assert watcher.last_result["published"] == current_generation(root)
+    finally:
+        stop.set()
+        thread.join(5)
+    assert not watcher_active(root)
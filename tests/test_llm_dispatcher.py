@@ -0,0 +1,143 @@
+"""Test del dispatcher delle chiamate al modello e del gateway (Ciclo 3 — FASE 25). Offline."""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_community.chat_models import ChatOllama
+from langchain_core.documents import Document
+
+from agent import UniLawResponder
+from config import DEFAULT_MODEL_NAME
+from llm_dispatcher import PRIORITY_HEADER, DispatcherGateway, LLMDispatcher
+from trace_export import trace_to_dict
+from vector_store import FlatVectorStore
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_free_slots_go_to_interactive_first_and_round_robin_across_clients():
+    dispatcher = LLMDispatcher(max_inflight=1, weights={"interactive": 8, "batch": 1})
+    order, threads = [], []
+
+    def request(priority, client, label):
+        with dispatcher.slot(priority, client):
+            order.append(label)
+
+    def total_waiting():
+        return sum(c["waiting"] for c in dispatcher.stats()["classes"].values())
+
+    with dispatcher.slot("batch", "eval"):  # generazione batch in corso
+        queued = [("batch", "eval", "b1"), ("batch", "eval", "b2"), ("interactive", "a", "a1"),
+                  ("interactive", "a", "a2"), ("interactive", "b", "b-1")]
+        for n, args in enumerate(queued, start=1):
+            threads.append(threading.Thread(target=request, args=args))
+            threads[-1].start()
+            assert _wait_for(lambda: total_waiting() == n)  # ordine di arrivo deterministico
+    for thread in threads:
+        thread.join(5)
+
+    # Prima le domande, a turno fra i client; poi il batch, che non si perde.
+    assert order == ["a1", "b-1", "a2", "b1", "b2"]
+    stats = dispatcher.stats()["classes"]
+    assert stats["interactive"]["granted"] == 3 and stats["batch"]["granted"] == 3
+    assert stats["batch"]["wait_ms_p95"] >= stats["interactive"]["wait_ms_p95"] > 0
+
+
+def test_batch_never_takes_every_slot():
+    dispatcher = LLMDispatcher(max_inflight=2, weights={"interactive": 8, "batch": 1})
+    assert dispatcher.limits == {"batch": 1}
+    release = threading.Event()
+
+    def batch_job():
+        with dispatcher.slot("batch", "notturno"):
+            release.wait(5)
+
+    jobs = [threading.Thread(target=batch_job) for _ in range(2)]
+    for job in jobs:
+        job.start()
+    assert _wait_for(lambda: dispatcher.stats()["classes"]["batch"]["waiting"] == 1)
+    with dispatcher.slot("interactive") as waited:  # il posto riservato è libero
+        assert waited < 0.5
+        assert dispatcher.stats()["classes"]["batch"]["running"] == 1
+    release.set()
+    for job in jobs:
+        job.join(5)
+    with pytest.raises(ValueError):
+        with dispatcher.slot("urgente"):
+            pass
+
+
+class _FakeOllama(BaseHTTPRequestHandler):
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for token in ("La prova finale ", "è la discussione di un elaborato [F1]."):
+            self.wfile.write(json.dumps({"message": {"content": token}, "done": False}).encode() + b"\n")
+        self.wfile.write(json.dumps({"model": payload["model"], "message": {"content": ""}, "done": True}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [text.lower().count(word) + 0.1 for word in ("prova", "finale", "tolc")]
+
+
+def test_responder_through_gateway_records_priority_and_queue_wait(tmp_path):
+    ollama = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOllama)
+    gateway = DispatcherGateway(("127.0.0.1", 0), f"http://127.0.0.1:{ollama.server_address[1]}",
+                                LLMDispatcher(max_inflight=1))
+    for server in (ollama, gateway):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    gateway_url = f"http://127.0.0.1:{gateway.server_address[1]}"
+    try:
+        chunk = Document(
+            page_content="Art. 5 Prova finale. La prova finale consiste nella discussione di un elaborato.",
+            metadata={"filename": "Regolamento-prova-finale-informatica-l31.pdf", "page": 0,
+                      "course_tag": "informatica", "doc_type": "tesi"},
+        )
+        store = FlatVectorStore.build([chunk], _Embeddings(), tmp_path / "flat", ids=["c1"])
+        responder = UniLawResponder(store, use_variant_cache=False, llm_priority="batch")
+        responder.llm = ChatOllama(base_url=gateway_url, model=DEFAULT_MODEL_NAME,
+                                   headers={PRIORITY_HEADER: "batch"})
+
+        question = "Come si svolge la prova finale di informatica?"
+        answer = responder.answer(question, memory={}, show_interpretation=False, show_confidence=False)
+        assert answer.startswith("La prova finale è la discussione")
+        assert trace_to_dict(responder.last_trace)["llm"]["priority"] == "batch"
+        assert responder.last_trace.llm_queue_wait_ms >= 0
+
+        tokens = []
+        responder.answer(question, memory={}, on_token=tokens.append)
+        assert tokens == ["La prova finale ", "è la discussione di un elaborato [F1]."]
+        classes = json.loads(urllib.request.urlopen(gateway_url + "/dispatcher", timeout=5).read())["classes"]
+        assert classes["batch"]["granted"] == 2 and classes["interactive"]["granted"] == 0
+
+        request = urllib.request.Request(gateway_url + "/api/chat", data=b"{}", headers={PRIORITY_HEADER: "urgente"})
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            urllib.request.urlopen(request, timeout=5)
+        assert exc.value.code == 400
+    finally:
+        gateway.shutdown()
+        ollama.shutdown()
+
+    with pytest.raises(ValueError):
+        UniLawResponder(None, use_variant_cache=False, llm_priority="urgente")
@@ -82,3 +82,80 @@ def test_signature_changes_with_content(tmp_path):
 def test_force_rebuild_always_true():
     # Con force_rebuild=True la funzione deve sempre richiedere il rebuild.
     assert _should_rebuild(True, {"documents": []}) is True
+
+
+# --- Ciclo 3 — FASE 12: parametri dell'indice nel manifest ---------------------
+
+def _persisted_index(tmp_path, monkeypatch, index=None):
+    import json
+
+    import database
+
+    monkeypatch.setattr(database, "CHROMA_PERSIST_DIRECTORY", str(tmp_path))
+    (tmp_path / "chroma.sqlite3").write_bytes(b"")
+    manifest = {"documents": [{"filename": "a.pdf"}]}
+    if index is not None:
+        manifest["index"] = index
+    (tmp_path / database.INDEX_MANIFEST_FILE).write_text(json.dumps(manifest), encoding="utf-8")
+    return {"documents": [{"filename": "a.pdf"}]}
+
+
+def test_legacy_manifest_matches_default_hnsw_settings(tmp_path, monkeypatch):
+    # Manifest scritto prima della FASE 12: nessun rebuild con i parametri di default.
+    signature = _persisted_index(tmp_path, monkeypatch)
+    assert _should_rebuild(False, signature) is False
+
+
+def test_index_with_page_less_chunk_ids_is_rebuilt(tmp_path, monkeypatch):
+    import database
+
+    # Indice della FASE 15 con ID senza pagina: le pagine ripetute scartate si recuperano.
+    settings = {k: v for k, v in database._index_settings().items() if k != "chunk_ids"}
+    signature = _persisted_index(tmp_path, monkeypatch, settings)
+    assert _should_rebuild(False, signature) is True
+
+
+def test_changed_hnsw_settings_force_rebuild(tmp_path, monkeypatch):
+    import database
+
+    signature = _persisted_index(tmp_path, monkeypatch, database._index_settings())
+    assert _should_rebuild(False, signature) is False
+
+    monkeypatch.setattr(database, "HNSW_M", 32)
+    assert database._hnsw_metadata()["hnsw:M"] == 32
+    assert _should_rebuild(False, signature) is True
+
+
+# --- Ciclo 3 — FASE 15: ID di contenuto dei chunk -----------------------------
+
+def test_chunk_content_id_is_deterministic_and_normalized():
+    from database import _chunk_content_id
+
+    chunk_id = _chunk_content_id("a.pdf", "Il  TOLC-I\nsoglia 16")
+    assert chunk_id == _chunk_content_id("a.pdf", "Il TOLC-I soglia 16")
+    assert len(chunk_id) == 20 and int(chunk_id, 16) >= 0
+    assert chunk_id != _chunk_content_id("b.pdf", "Il TOLC-I soglia 16")
+    assert _chunk_content_id("a.pdf", "Il TOLC-I soglia 16", 3) != _chunk_content_id("a.pdf", "Il TOLC-I soglia 16", 4)
+
+
+def test_unique_chunks_writes_ids_and_drops_repeats():
+    from langchain_core.documents import Document
+
+    from database import _chunk_content_id, _unique_chunks
+
+    chunks = [
+        Document(page_content="intestazione", metadata={"filename": "a.pdf", "page": 0}),
+        Document(page_content="articolo 1", metadata={"filename": "a.pdf", "page": 0}),
+        Document(page_content="intestazione", metadata={"filename": "a.pdf", "page": 0}),
+        Document(page_content="intestazione", metadata={"filename": "a.pdf", "page": 1}),
+        Document(page_content="intestazione", metadata={"filename": "b.pdf", "page": 0}),
+    ]
+    unique = list(_unique_chunks(chunks, set()))
+    # Scartata solo la ripetizione sulla stessa pagina: la pagina 1 resta citabile.
+    assert [(c.metadata["filename"], c.metadata["page"]) for c in unique] == [
+        ("a.pdf", 0),
+        ("a.pdf", 0),
+        ("a.pdf", 1),
+        ("b.pdf", 0),
+    ]
+    assert unique[0].metadata["chunk_id"] == _chunk_content_id("a.pdf", "intestazione", 0)
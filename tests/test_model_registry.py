@@ -0,0 +1,117 @@
+"""Test del registro dei modelli condiviso (Ciclo 3 — FASE 9). Offline."""
+
+import threading
+
+import pytest
+
+import model_registry
+from neural_reranker import CrossEncoderReranker
+
+
+@pytest.fixture(autouse=True)
+def _empty_registry():
+    model_registry.clear_models()
+    yield
+    model_registry.clear_models()
+
+
+class _Param:
+    def __init__(self, n):
+        self.n = n
+
+    def numel(self):
+        return self.n
+
+    def element_size(self):
+        return 4
+
+
+class _FakeModel:
+    def __init__(self, n=1024 * 1024):
+        self._params = [_Param(n)]
+
+    def parameters(self):
+        return iter(self._params)
+
+    def predict(self, pairs, **kwargs):
+        return [0.0 for _ in pairs]
+
+
+def test_get_model_loads_once_even_from_concurrent_threads():
+    loads = []
+    barrier = threading.Barrier(4)
+
+    def factory():
+        loads.append(1)
+        return _FakeModel()
+
+    def worker(out):
+        barrier.wait()
+        out.append(model_registry.get_model(("embedding", "fake"), factory))
+
+    results = []
+    threads = [threading.Thread(target=worker, args=(results,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_failed_load_is_not_registered():
+    def broken():
+        raise RuntimeError("modello assente")
+
+    with pytest.raises(RuntimeError):
+        model_registry.get_model(("cross-encoder", "rotto"), broken)
+    assert model_registry.loaded_models() == []
+    assert model_registry.get_model(("cross-encoder", "rotto"), _FakeModel)
+
+
+def test_memory_report_includes_process_and_models():
+    model_registry.get_model(("embedding", "fake"), lambda: _FakeModel(1024 * 1024))
+    report = model_registry.memory_report()
+    assert report["embedding:fake"] == 4.0  # 1M parametri float32
+    assert report["processo (RSS)"] > 0
+    assert "embedding:fake 4 MB" in model_registry.describe_memory()
+
+
+def test_rerankers_share_the_registered_cross_encoder():
+    model = model_registry.get_model(("cross-encoder", "fake-model", "cpu", 512), _FakeModel)
+    first = CrossEncoderReranker("fake-model", num_threads=0)
+    second = CrossEncoderReranker("fake-model", num_threads=0)
+    assert first.available() and second.available()
+    assert first._model is model and second._model is model
+
+
+def test_build_embeddings_reuses_the_registered_model():
+    from config import EMBEDDING_MODEL_NAME
+    from database import _build_embeddings
+
+    model = model_registry.get_model(("embedding", EMBEDDING_MODEL_NAME, "cpu"), _FakeModel)
+    assert _build_embeddings() is model
+    assert _build_embeddings() is model  # es. dopo un rebuild: nessun ricaricamento
+
+
+# --- Ciclo 3 — FASE 10: quantizzazione int8 -----------------------------------
+
+def test_float_and_int8_models_are_separate_registry_entries():
+    from config import EMBEDDING_MODEL_NAME
+
+    float_model = model_registry.get_model(("embedding", EMBEDDING_MODEL_NAME, "cpu"), _FakeModel)
+    int8_model = model_registry.get_model(("embedding", EMBEDDING_MODEL_NAME, "cpu", "int8"), _FakeModel)
+    assert model_registry.get_embeddings(quantize=False) is float_model
+    assert model_registry.get_embeddings(quantize=True) is int8_model
+    assert f"embedding:{EMBEDDING_MODEL_NAME} (int8)" in model_registry.loaded_models()
+
+    reranker_model = model_registry.get_model(("cross-encoder", "fake-model", "cpu", 512, "int8"), _FakeModel)
+    reranker = CrossEncoderReranker("fake-model", num_threads=0, quantize=True)
+    assert reranker.available() and reranker._model is reranker_model
+
+
+def test_quantize_int8_keeps_float_model_when_not_applicable(caplog):
+    model = object()
+    assert model_registry.quantize_int8(model) is model
+    assert "resta in float" in caplog.text
@@ -0,0 +1,100 @@
+"""Test dell'eliminazione dei chunk quasi duplicati con MinHash/LSH (Ciclo 3 — FASE 20). Offline."""
+
+import json
+
+from langchain_core.documents import Document
+
+import database
+from near_dedup import MinHasher, NearDuplicateFilter
+from vector_store import FlatVectorStore
+
+_ARTICLE = (
+    "Art. 5 Prova finale. La prova finale consiste nella discussione di un elaborato scritto "
+    "concordato con un docente relatore del corso di studio, su un argomento coerente con gli "
+    "obiettivi formativi; lo studente deve aver acquisito tutti i crediti previsti dal piano di "
+    "studi ad eccezione di quelli attribuiti alla prova finale, e presenta domanda di laurea "
+    "entro i termini fissati dal calendario didattico pubblicato sul sito del dipartimento."
+)
+
+
+def _chunk(text, filename, page, course_tag="informatica"):
+    return Document(page_content=text, metadata={"filename": filename, "page": page, "course_tag": course_tag})
+
+
+def test_minhash_estimates_jaccard_of_word_trigrams():
+    hasher = MinHasher()
+    same = hasher.signature(_ARTICLE)
+    assert (same == hasher.signature(_ARTICLE.upper())).all()  # normalizzato
+    edited = hasher.signature(_ARTICLE.replace("relatore", "tutor"))
+    other = hasher.signature("Bando Erasmus: mobilità per studio, learning agreement e borse mensili.")
+    assert 0.8 < (same == edited).mean() < 1.0
+    assert (same == other).mean() < 0.1
+    assert hasher.signature("  ") is None
+
+
+def test_filter_collapses_near_copies_within_the_same_course():
+    near_dedup = NearDuplicateFilter(threshold=0.8)
+    chunks = [
+        _chunk(_ARTICLE, "regolamento-l31.pdf", 4),
+        _chunk(_ARTICLE.replace("Art. 5", "Articolo 5"), "rad-l31.pdf", 9),
+        _chunk("Il TOLC-I si considera superato con punteggio pari almeno a 16.", "regolamento-l31.pdf", 1),
+        _chunk(_ARTICLE, "regolamento-l19.pdf", 3, course_tag="scienze_educazione"),
+    ]
+    kept = [c for i, c in enumerate(chunks) if not near_dedup.is_duplicate(c, f"id{i}")]
+    assert [c.metadata["filename"] for c in kept] == [
+        "regolamento-l31.pdf",
+        "regolamento-l31.pdf",
+        "regolamento-l19.pdf",  # altro corso: mai fuso
+    ]
+    assert near_dedup.stats() == {"chunks": 4, "near_duplicates": 1, "dedup_ratio": 0.25, "threshold": 0.8}
+    updates = near_dedup.metadata_updates()
+    assert list(updates) == ["id0"]
+    assert json.loads(updates["id0"]["provenance"]) == [["regolamento-l31.pdf", 4], ["rad-l31.pdf", 9]]
+    assert updates["id0"]["duplicate_count"] == 1
+
+
+class _Loader:
+    def __init__(self, path):
+        self.path = path
+
+    def lazy_load(self):
+        with open(self.path, encoding="utf-8") as fh:
+            for i, page in enumerate(fh.read().split("\f")):
+                yield Document(page_content=page, metadata={"source": self.path, "page": i})
+
+
+class _Embeddings:
+    def embed_documents(self, texts):
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return [1.0, 1.0]
+
+
+def test_rebuild_writes_canonical_provenance_and_dedup_ratio(tmp_path, monkeypatch):
+    for name, value in {
+        "PyPDFLoader": _Loader,
+        "CHROMA_PERSIST_DIRECTORY": str(tmp_path),
+        "VECTOR_BACKEND": "flat",
+        "PAGE_CACHE_ENABLED": False,
+        "EMBEDDING_CACHE_ENABLED": False,
+        "TWO_STAGE_RETRIEVAL_ENABLED": False,
+        "NEAR_DEDUP_ENABLED": True,
+    }.items():
+        monkeypatch.setattr(database, name, value)
+    monkeypatch.setattr(database, "_build_embeddings", _Embeddings)
+
+    (tmp_path / "regolamento-l31.pdf").write_text(f"Soglia TOLC-I 16 punti.\f{_ARTICLE}", encoding="utf-8")
+    (tmp_path / "rad-l31.pdf").write_text(_ARTICLE.replace("Art. 5", "Articolo 5"), encoding="utf-8")
+    pdfs = sorted(str(p) for p in tmp_path.glob("*.pdf"))
+    index_dir = tmp_path / "gen"
+
+    db, n_chunks = database._build_index(pdfs, {"documents": []}, index_dir)
+    assert n_chunks == 2
+    reopened = FlatVectorStore.load(database._flat_index_dir(index_dir))
+    canonical = [m for m in reopened.get()["metadatas"] if m.get("duplicate_count")]
+    assert [json.loads(m["provenance"]) for m in canonical] == [[["rad-l31.pdf", 0], ["regolamento-l31.pdf", 1]]]
+
+    manifest = json.loads((index_dir / database.INDEX_MANIFEST_FILE).read_text(encoding="utf-8"))
+    assert manifest["ingestion"]["near_duplicates"] == 1
+    assert manifest["index"]["near_dedup"] == database.NEAR_DEDUP_THRESHOLD
@@ -66,3 +66,90 @@ def test_fallback_when_model_unavailable():
 def test_rerank_empty_docs():
     reranker = CrossEncoderReranker("fake-model", scorer=_fake_scorer)
     assert reranker.rerank("q", [], top_n=5) == []
+
+
+# --- Ciclo 3 — FASE 6: cache LRU, finestra di evidenza -----------------------
+
+def _counting_scorer(calls):
+    def scorer(question, docs):
+        calls.append([d.page_content for d in docs])
+        return _fake_scorer(question, docs)
+
+    return scorer
+
+
+def test_score_cache_skips_already_scored_pairs():
+    calls = []
+    reranker = CrossEncoderReranker("fake-model", scorer=_counting_scorer(calls))
+    docs = [_doc("a", "tolc"), _doc("b", "erasmus")]
+
+    first = reranker.score("domanda", docs)
+    second = reranker.score("domanda", docs + [_doc("c", "tolc ofa")])
+
+    assert second[:2] == first
+    assert calls == [["tolc", "erasmus"], ["tolc ofa"]]  # solo la coppia nuova
+    assert reranker.last_cache_hits == 2
+    # Domanda diversa: nessun riuso.
+    reranker.score("altra domanda", docs)
+    assert len(calls) == 3
+
+
+def test_concurrent_threads_share_the_cache_but_not_the_hit_count():
+    import threading
+
+    reranker = CrossEncoderReranker("fake-model", scorer=_fake_scorer, cache_size=8)
+    warm = [_doc("a", "tolc"), _doc("b", "erasmus")]
+    reranker.score("domanda", warm)
+    reranker.score("domanda", warm)
+    hits, errors = {}, []
+
+    def request(name, docs):
+        try:
+            for _ in range(200):
+                reranker.score(name, docs)
+            hits[name] = reranker.last_cache_hits
+        except Exception as exc:  # race sulla OrderedDict
+            errors.append(exc)
+
+    threads = [threading.Thread(target=request, args=("domanda", warm))] + [
+        threading.Thread(target=request, args=(f"altra {i}", [_doc(f"x{j}", f"tolc {i} {j}") for j in range(3)]))
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [] and len(reranker._cache) <= 8
+    assert reranker.last_cache_hits == 2  # questo thread: ultima chiamata prima dei thread
+    assert set(hits) == {"domanda", "altra 0", "altra 1", "altra 2", "altra 3"}
+
+
+def test_score_cache_uses_chunk_id_and_evicts_lru():
+    from retrieval import CHUNK_ID_KEY
+
+    calls = []
+    reranker = CrossEncoderReranker("fake-model", scorer=_counting_scorer(calls), cache_size=2)
+    a = Document(page_content="tolc", metadata={"source": "a", CHUNK_ID_KEY: "id-a"})
+    b = Document(page_content="x", metadata={"source": "b", CHUNK_ID_KEY: "id-b"})
+    c = Document(page_content="y", metadata={"source": "c", CHUNK_ID_KEY: "id-c"})
+
+    reranker.score("q", [a, b])
+    reranker.score("q", [c])          # supera la capienza: esce 'a' (il meno recente)
+    reranker.score("q", [b, a])
+    assert calls[-1] == ["tolc"]      # 'b' ancora in cache, 'a' ricalcolato
+
+
+def test_failed_scoring_is_not_cached():
+    reranker = CrossEncoderReranker("fake-model", scorer=lambda q, docs: None)
+    assert reranker.score("q", [_doc("a", "x")]) is None
+    assert len(reranker._cache) == 0
+
+
+def test_evidence_window_scores_the_selected_passage():
+    calls = []
+    reranker = CrossEncoderReranker(
+        "fake-model", scorer=_counting_scorer(calls), evidence_window=True
+    )
+    long_text = " ".join(f"Frase di riempimento numero {i} sul regolamento." for i in range(40))
+    reranker.score("tolc", [_doc("a", long_text + " Il TOLC è obbligatorio.")])
+    assert len(calls[0][0]) < len(long_text)
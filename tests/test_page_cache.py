@@ -0,0 +1,80 @@
+"""Test della cache delle pagine estratte dai PDF (Ciclo 3 — FASE 18). Offline."""
+
+from langchain_core.documents import Document
+
+import database
+from page_cache import PageCache
+
+
+class _Loader:
+    """PyPDFLoader finto: una pagina per riga del file, conta le estrazioni."""
+
+    calls = []
+
+    def __init__(self, path):
+        self.path = path
+
+    def lazy_load(self):
+        _Loader.calls.append(self.path)
+        with open(self.path, encoding="utf-8") as fh:
+            for i, line in enumerate(fh.read().splitlines()):
+                yield Document(page_content=line, metadata={"source": self.path, "page": i})
+
+
+def test_pages_round_trip_keyed_by_hash_and_extractor(tmp_path):
+    pages = [Document(page_content="Art. 1 — àccesso", metadata={"source": "a.pdf", "page": 0})]
+    cache = PageCache(tmp_path)
+    assert cache.get("abc") is None
+
+    cache.put("abc", pages)
+    assert cache.get("abc") == pages
+    assert PageCache(tmp_path, extractor="pypdf-9.9-r1").get("abc") is None  # nuovo estrattore
+
+    cache._path("abc").write_text("{rotto", encoding="utf-8")
+    assert cache.get("abc") is None
+
+
+def test_rebuild_extracts_only_new_or_changed_pdfs(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "PyPDFLoader", _Loader)
+    monkeypatch.setattr(database, "CHROMA_PERSIST_DIRECTORY", str(tmp_path / "chroma"))
+    monkeypatch.setattr(_Loader, "calls", [])
+    docs = tmp_path / "documenti"
+    docs.mkdir()
+    first, second = docs / "regolamento_informatica.pdf", docs / "bando_erasmus.pdf"
+    first.write_text("soglia tolc 16\nofa recupero", encoding="utf-8")
+    second.write_text("mobilità erasmus", encoding="utf-8")
+
+    chunks = list(database._iter_chunks([str(first), str(second)]))
+    assert len(_Loader.calls) == 2
+
+    again = list(database._iter_chunks([str(first), str(second)]))
+    assert len(_Loader.calls) == 2  # tutto dalla cache
+    assert [(c.page_content, c.metadata) for c in again] == [(c.page_content, c.metadata) for c in chunks]
+
+    second.write_text("mobilità erasmus 2026", encoding="utf-8")
+    list(database._iter_chunks([str(first), str(second)]))
+    assert _Loader.calls[2:] == [str(second)]
+
+    # PDF spostato: stesse pagine, metadata riferiti al nuovo percorso.
+    moved = docs / "regolamento_informatica_v2.pdf"
+    first.rename(moved)
+    moved_chunks = list(database._iter_chunks([str(moved)]))
+    assert len(_Loader.calls) == 3
+    assert moved_chunks[0].metadata["source"] == str(moved)
+    assert moved_chunks[0].metadata["course_tag"] == "informatica"
+
+
+def test_entry_broken_halfway_is_extracted_again_without_repeating_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "PyPDFLoader", _Loader)
+    monkeypatch.setattr(_Loader, "calls", [])
+    pdf = tmp_path / "regolamento_informatica.pdf"
+    pdf.write_text("soglia tolc 16\nofa recupero\nimmatricolazione", encoding="utf-8")
+    cache = PageCache(tmp_path / "pagine")
+    sha256 = database._file_hash(str(pdf))
+    cache.put(sha256, _Loader(str(pdf)).lazy_load())
+    lines = cache._path(sha256).read_text(encoding="utf-8").splitlines()
+    cache._path(sha256).write_text(f"{lines[0]}\n{{rotto\n", encoding="utf-8")
+
+    pages = list(database._iter_pdf_pages(str(pdf), cache))
+    assert [p.page_content for p in pages] == ["soglia tolc 16", "ofa recupero", "immatricolazione"]
+    assert len(_Loader.calls) == 2 and len(cache.get(sha256)) == 3  # voce riscritta intera
@@ -0,0 +1,120 @@
+"""Test del server preload-then-fork (Ciclo 3 — FASE 23). Offline, solo sistemi con fork."""
+
+import os
+import signal
+import time
+
+import numpy as np
+import pytest
+
+import prefork
+from index_generations import new_generation, publish_generation
+from prefork import PreforkServer, memory_usage
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="richiede os.fork")
+
+
+def _wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def _make_server(tmp_path, loads, workers=2):
+    def preload():
+        loads.append(time.time())
+        return {"generation": len(loads), "weights": np.full(2**20, len(loads), dtype=np.float32)}
+
+    def worker(state, index):
+        # Il worker vede lo stato del padre senza ricostruirlo.
+        tmp = tmp_path / f"tmp-{os.getpid()}"
+        tmp.write_text(f"{state['generation']} {state['weights'].sum():.0f}", encoding="utf-8")
+        os.replace(tmp, tmp_path / f"worker-{index}-{os.getpid()}")
+        while True:
+            time.sleep(3600)
+
+    return PreforkServer(preload, worker, workers=workers, setup=lambda state: None)
+
+
+def test_workers_share_the_preloaded_state_and_report_startup(tmp_path):
+    loads = []
+    server = _make_server(tmp_path, loads).start()
+    try:
+        assert len(loads) == 1 and len(server.workers) == 2
+        assert _wait_for(lambda: len(list(tmp_path.glob("worker-*"))) == 2)
+        assert {p.read_text(encoding="utf-8") for p in tmp_path.glob("worker-*")} == {f"1 {2**20}"}
+
+        report = server.report()
+        assert [w["index"] for w in report["workers"]] == [0, 1]
+        assert all(0 <= w["startup_s"] < 5 for w in report["workers"])
+        if memory_usage():  # /proc disponibile (Linux)
+            assert all(w["uss_mb"] < w["rss_mb"] for w in report["workers"])  # pagine condivise
+    finally:
+        server.stop()
+    assert server.workers == {}
+
+
+def test_supervisor_respawns_dead_workers_and_reloads_on_new_generation(tmp_path, monkeypatch):
+    root = tmp_path / "indice"
+    monkeypatch.setattr("index_generations.CHROMA_PERSIST_DIRECTORY", str(root))
+    loads = []
+    server = _make_server(tmp_path, loads).start()
+    try:
+        dead = next(pid for pid, info in server.workers.items() if info["index"] == 1)
+        os.kill(dead, signal.SIGKILL)
+        assert _wait_for(lambda: server._reap(respawn=True) or dead not in server.workers)
+        assert sorted(info["index"] for info in server.workers.values()) == [0, 1]
+
+        old = set(server.workers)
+        publish_generation(new_generation(root), root)
+        stop = prefork.threading.Event()
+        thread = prefork.threading.Thread(target=server.supervise, args=(stop, 0.05))
+        thread.start()
+        try:
+            assert _wait_for(lambda: len(loads) == 2)
+        finally:
+            stop.set()
+            thread.join(10)
+        assert server.generation_number == 1
+        assert not old & set(server.workers) and len(server.workers) == 2
+        def reloaded():
+            return [p for p in tmp_path.glob("worker-*") if p.read_text(encoding="utf-8") == f"2 {2 * 2**20}"]
+
+        assert _wait_for(lambda: len(reloaded()) == 2)
+    finally:
+        server.stop()
+
+
+def test_failed_reload_keeps_the_current_state_and_retries(tmp_path, monkeypatch):
+    root = tmp_path / "indice"
+    monkeypatch.setattr("index_generations.CHROMA_PERSIST_DIRECTORY", str(root))
+    loads, failures = [], []
+    server = _make_server(tmp_path, loads, workers=1)
+    preload = server._preload
+
+    def broken_preload():
+        failures.append(time.time())
+        raise RuntimeError("generazione non apribile")
+
+    server.start()
+    server._preload = broken_preload
+    try:
+        old, state = set(server.workers), server.state
+        publish_generation(new_generation(root), root)
+        stop = prefork.threading.Event()
+        thread = prefork.threading.Thread(target=server.supervise, args=(stop, 0.05))
+        thread.start()
+        try:
+            assert _wait_for(lambda: len(failures) >= 2)  # riprovato a ogni controllo
+            assert server.state is state and set(server.workers) == old and server.generation_number == 0
+            server._preload = preload  # la generazione ora si apre
+            assert _wait_for(lambda: server.generation_number == 1)
+        finally:
+            stop.set()
+            thread.join(10)
+        assert server.state["generation"] == 2 and not old & set(server.workers)
+    finally:
+        server.stop()
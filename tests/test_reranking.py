@@ -0,0 +1,128 @@
+"""Test del budget dei candidati fra fusione e reranking (Ciclo 3 — FASE 5). Offline."""
+
+from langchain_core.documents import Document
+
+from rag_types import QueryIntent, RagTrace
+from reranking import rerank_documents, rerank_within_budget
+
+INTENT = QueryIntent("informatica", "accesso")
+
+
+def _doc(i, course_tag="economia", doc_type="altro"):
+    return Document(
+        page_content=f"testo {i}",
+        metadata={"source": f"d{i}.pdf", "course_tag": course_tag, "doc_type": doc_type},
+    )
+
+
+def _sources(docs):
+    return [d.metadata["source"] for d in docs]
+
+
+def test_no_budget_matches_plain_reranking():
+    docs = [_doc(i) for i in range(20)] + [_doc(20, "informatica", "accesso")]
+    trace = RagTrace()
+    assert _sources(rerank_within_budget("tolc", docs, INTENT, trace, budget=0)) == _sources(
+        rerank_documents("tolc", docs, INTENT, RagTrace())
+    )
+    assert trace.candidate_budget == ""
+
+
+def test_static_budget_truncates_before_reranking():
+    docs = [_doc(i) for i in range(20)] + [_doc(20, "informatica", "accesso")]
+    trace = RagTrace()
+    ranked = rerank_within_budget("tolc", docs, INTENT, trace, budget=10, adaptive=False)
+    assert len(ranked) == 10
+    assert "d20.pdf" not in _sources(ranked)  # fuori budget, anche se il migliore
+    assert trace.candidate_budget == "10/21 candidati"
+
+
+def test_adaptive_budget_widens_when_boundary_scores_are_close():
+    # Punteggi tutti uguali al confine della finestra di contesto: si allarga.
+    docs = [_doc(i) for i in range(20)] + [_doc(20, "informatica", "accesso")]
+    trace = RagTrace()
+    ranked = rerank_within_budget("tolc", docs, INTENT, trace, budget=10, adaptive=True)
+    assert _sources(ranked)[0] == "d20.pdf"
+    assert trace.candidate_budget == "21/21 candidati (adattivo, budget iniziale 10)"
+
+
+def test_adaptive_budget_keeps_window_when_ranking_is_decided():
+    # I primi 5 (corso giusto) staccano nettamente il sesto: nessun allargamento.
+    docs = [_doc(i, "informatica", "accesso") for i in range(5)] + [_doc(i) for i in range(5, 30)]
+    trace = RagTrace()
+    ranked = rerank_within_budget("tolc", docs, INTENT, trace, budget=10, adaptive=True)
+    assert len(ranked) == 10
+    assert trace.candidate_budget == "10/30 candidati"
+
+
+# --- Ciclo 3 — FASE 7: reranking a cascata ------------------------------------
+
+def test_heuristic_margin_at_context_boundary():
+    from reranking import heuristic_margin, needs_cross_encoder
+
+    assert heuristic_margin([90, 80, 70, 60, 50, 10]) == 40
+    assert heuristic_margin([5, 5, 5]) == float("inf")  # nessun escluso
+    assert not needs_cross_encoder([90, 80, 70, 60, 50, 10], threshold=10)
+    assert needs_cross_encoder([50, 50, 50, 50, 50, 48], threshold=10)
+
+
+class _StaticVectorDB:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def max_marginal_relevance_search(self, query, k, fetch_k):
+        return list(self._docs)
+
+    def similarity_search(self, query, k):
+        return list(self._docs)
+
+
+def _cascade_responder(responder, docs, calls):
+    from neural_reranker import CrossEncoderReranker
+
+    def scorer(question, scored):
+        calls.append(len(scored))
+        return [0.0] * len(scored)
+
+    responder.vector_db = _StaticVectorDB(docs)
+    responder.bm25_index = None
+    responder.use_neural_reranker = True
+    responder.use_reranker_cascade = True
+    responder.neural_reranker = CrossEncoderReranker("fake-model", scorer=scorer)
+    return responder
+
+
+def test_cascade_skips_cross_encoder_when_heuristic_is_decided(responder):
+    calls = []
+    # 5 documenti del corso giusto; gli altri corsi sono scartati dal filtro.
+    docs = [_doc(i, "informatica", "accesso") for i in range(5)] + [_doc(i) for i in range(5, 9)]
+    _cascade_responder(responder, docs, calls)._retrieve_documents("tolc", INTENT)
+    assert calls == []
+    assert "cross-encoder non invocato" in responder.last_trace.reranker
+
+
+def test_cascade_invokes_cross_encoder_when_heuristic_is_uncertain(responder):
+    calls = []
+    docs = [_doc(i, "informatica", "accesso") for i in range(8)]
+    _cascade_responder(responder, docs, calls)._retrieve_documents("tolc", INTENT)
+    assert calls == [8]
+    assert responder.last_trace.reranker.startswith("euristico + cross-encoder (cascata: margine 0")
+
+
+def test_cascade_measures_the_boundary_after_source_deduplication(responder):
+    calls = []
+    # Sei candidati, ma due sono chunk diversi della stessa pagina: nel contesto ne entrano cinque.
+    same_page = _doc(0, "informatica", "accesso")
+    same_page.page_content = "altro chunk della pagina"
+    docs = [_doc(i, "informatica", "accesso") for i in range(5)] + [same_page]
+    _cascade_responder(responder, docs, calls)._retrieve_documents("tolc", INTENT)
+    assert calls == []
+    assert "margine inf" in responder.last_trace.reranker
+
+
+def test_cascade_reports_a_missing_cross_encoder(responder):
+    calls = []
+    docs = [_doc(i, "informatica", "accesso") for i in range(5)]
+    _cascade_responder(responder, docs, calls).neural_reranker.available = lambda: False
+    responder._retrieve_documents("tolc", INTENT)
+    assert responder.last_trace.reranker == "euristico (reranker neurale non disponibile)"
@@ -128,3 +128,224 @@ def test_vector_only_mode_preserves_vector_order():
                            trace, use_bm25=False)
     assert trace.retrieval_mode == "vettoriale"
     assert [d.metadata["source"] for d in docs] == ["a", "b"]
+
+
+# --- Ciclo 3 — FASE 1: ID e vettori dei chunk propagati dal retrieval ---------
+
+class _FakeEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0] if "tolc" in text else [0.0, 1.0]
+
+
+class _FakeCollection:
+    """Collezione Chroma finta: restituisce ID, testi, metadata e vettori."""
+
+    def __init__(self, rows):
+        self._rows = rows  # (id, testo, metadata, vettore)
+
+    def query(self, query_embeddings, n_results, include, where=None):
+        self.last_where = where
+        rows = self._rows
+        if where is not None:
+            allowed = where["course_tag"]["$in"]
+            rows = [r for r in rows if r[2].get("course_tag") in allowed]
+        rows = rows[:n_results]
+        return {
+            "ids": [[r[0] for r in rows]],
+            "documents": [[r[1] for r in rows]],
+            "metadatas": [[r[2] for r in rows]],
+            "embeddings": [[r[3] for r in rows]],
+            "distances": [[0.0 for _ in rows]],
+        }
+
+
+class _FakeChroma:
+    def __init__(self, rows):
+        self._collection = _FakeCollection(rows)
+        self._embedding_function = _FakeEmbeddings()
+
+    def get(self, include=None):
+        return {
+            "ids": [r[0] for r in self._collection._rows],
+            "documents": [r[1] for r in self._collection._rows],
+            "metadatas": [r[2] for r in self._collection._rows],
+            "embeddings": [r[3] for r in self._collection._rows],
+        }
+
+
+_ROWS = [
+    ("id-a", "tolc accesso informatica", {"source": "a", "page": 0}, [1.0, 0.0]),
+    ("id-b", "erasmus mobilità", {"source": "b", "page": 0}, [0.0, 1.0]),
+]
+
+
+def test_vector_arm_carries_chunk_id_and_stored_embedding():
+    from retrieval import CHUNK_ID_KEY, EMBEDDING_KEY, run_vector_queries
+
+    query_vectors = {}
+    docs = run_vector_queries(_FakeChroma(_ROWS), ["tolc"], k=2, query_vectors=query_vectors)
+    by_source = {d.metadata["source"]: d for d in docs}
+    assert by_source["a"].metadata[CHUNK_ID_KEY] == "id-a"
+    assert list(by_source["a"].metadata[EMBEDDING_KEY]) == [1.0, 0.0]
+    # Il vettore della query è registrato per il riuso a valle.
+    assert query_vectors == {"tolc": [1.0, 0.0]}
+
+
+def test_bm25_index_documents_carry_chunk_id_and_embedding():
+    from retrieval import CHUNK_ID_KEY, EMBEDDING_KEY, build_bm25_index
+
+    index = build_bm25_index(_FakeChroma(_ROWS))
+    doc = index._docs[1]
+    assert doc.metadata[CHUNK_ID_KEY] == "id-b"
+    assert list(doc.metadata[EMBEDDING_KEY]) == [0.0, 1.0]
+
+
+def test_prepare_sources_propagates_chunk_id_and_embedding(responder):
+    from retrieval import CHUNK_ID_KEY, EMBEDDING_KEY
+
+    doc = Document(
+        page_content="testo",
+        metadata={"source": "a.pdf", "page": 0, CHUNK_ID_KEY: "id-a", EMBEDDING_KEY: [1.0]},
+    )
+    source = responder._prepare_sources([doc])[0]
+    assert source.chunk_id == "id-a"
+    assert source.embedding == [1.0]
+
+
+# --- Ciclo 3 — FASE 2: pre-filtro per corso dentro la query ------------------
+
+def _tagged_rows():
+    tags = ["informatica", "economia", "generale", "economia", "informatica", "generale"]
+    return [
+        (f"id-{i}", f"tolc chunk {i}", {"source": f"s{i}", "page": 0, "course_tag": tag}, [1.0, 0.0])
+        for i, tag in enumerate(tags)
+    ]
+
+
+def test_prefilter_course_tags_mirrors_course_filter():
+    from retrieval import prefilter_course_tags
+
+    assert prefilter_course_tags(QueryIntent("informatica", "accesso")) == ["informatica", "generale"]
+    # Bandi di Ateneo ed assenza del corso: nessun filtro.
+    assert prefilter_course_tags(QueryIntent("informatica", "erasmus")) is None
+    assert prefilter_course_tags(QueryIntent("informatica", "borsa")) is None
+    assert prefilter_course_tags(QueryIntent(None, "accesso")) is None
+
+
+def test_vector_arm_pushes_course_filter_into_chroma_where():
+    from retrieval import run_vector_queries
+
+    vdb = _FakeChroma(_tagged_rows())
+    fallbacks = []
+    docs = run_vector_queries(
+        vdb, ["tolc"], k=6, course_tags=["informatica", "generale"], min_results=2,
+        fallbacks=fallbacks,
+    )
+    assert vdb._collection.last_where == {"course_tag": {"$in": ["informatica", "generale"]}}
+    assert {d.metadata["course_tag"] for d in docs} == {"informatica", "generale"}
+    assert fallbacks == []
+
+
+def test_vector_arm_falls_back_without_filter_when_too_few_results():
+    from retrieval import run_vector_queries
+
+    fallbacks = []
+    docs = run_vector_queries(
+        _FakeChroma(_tagged_rows()), ["tolc"], k=6, course_tags=["generale"], min_results=3,
+        fallbacks=fallbacks,
+    )
+    # I documenti filtrati restano in testa, seguiti da quelli della query senza filtro.
+    assert [d.metadata["course_tag"] for d in docs[:2]] == ["generale", "generale"]
+    assert len(docs) == 6
+    assert fallbacks == ["tolc"]
+
+
+def test_bm25_search_respects_course_tags():
+    docs = [
+        Document(page_content="tolc accesso", metadata={"source": "a", "course_tag": "economia"}),
+        Document(page_content="tolc ofa", metadata={"source": "b", "course_tag": "informatica"}),
+        Document(page_content="erasmus bando", metadata={"source": "c", "course_tag": "generale"}),
+        Document(page_content="piano studi", metadata={"source": "d", "course_tag": "generale"}),
+    ] + [_doc(f"f{i}", f"testo di riempimento {i}") for i in range(4)]
+    results = Bm25Index(docs).search("tolc", k=3, course_tags=["informatica", "generale"])
+    assert [d.metadata["source"] for d in results] == ["b"]
+
+
+def test_hybrid_prefilter_is_traced_and_off_by_default():
+    vdb = _FakeChroma(_tagged_rows())
+    intent = QueryIntent("informatica", None)
+
+    trace = RagTrace()
+    hybrid_retrieve(vdb, None, "tolc", intent, trace, use_bm25=False)
+    assert trace.prefilter == ""
+    assert vdb._collection.last_where is None
+
+    trace = RagTrace()
+    docs = hybrid_retrieve(vdb, None, "tolc", intent, trace, use_bm25=False, prefilter=True)
+    assert trace.prefilter.startswith("course_tag ∈ {informatica, generale}")
+    assert "economia" not in {d.metadata["course_tag"] for d in docs}
+
+
+# --- Ciclo 3 — FASE 3: indice BM25 partizionato per corso/tipo ----------------
+
+def _partitioned_corpus():
+    rows = [
+        ("a", "tolc ofa accesso informatica", "informatica", "accesso"),
+        ("b", "tolc punteggio soglia", "informatica", "accesso"),
+        ("c", "prova finale tesi relatore", "informatica", "tesi"),
+        ("d", "tolc economia accesso", "economia", "accesso"),
+        ("e", "regolamento tesi embargo", "generale", "tesi"),
+        ("f", "bando borsa isee", "generale", "borsa"),
+    ]
+    return [
+        Document(page_content=text, metadata={"source": src, "course_tag": tag, "doc_type": dt})
+        for src, text, tag, dt in rows
+    ]
+
+
+def test_partitioned_bm25_uses_global_statistics():
+    index = Bm25Index(_partitioned_corpus())
+    full = index._bm25.get_scores(tokenize("tolc accesso"))
+    ids = index.partition_ids(["informatica", "generale"])
+    assert ids == [0, 1, 2, 4, 5]
+    # Stessi punteggi della ricerca sull'intero corpus (IDF globale).
+    assert list(index._scores(tokenize("tolc accesso"), ids)) == [full[i] for i in ids]
+
+
+def test_partitioned_bm25_search_by_course_and_doc_type():
+    index = Bm25Index(_partitioned_corpus())
+    by_course = index.search("tolc accesso", k=5, course_tags=["informatica", "generale"])
+    assert "d" not in {d.metadata["source"] for d in by_course}
+    by_type = index.search("tesi", k=5, doc_types=["tesi"])
+    assert {d.metadata["source"] for d in by_type} == {"c", "e"}
+
+
+# --- Ciclo 3 — FASE 15: ID di contenuto portati lungo la pipeline -----------------
+
+def test_chunk_id_is_the_dedup_and_fusion_key():
+    from retrieval import CHUNK_ID_KEY, _doc_key
+
+    a = Document(page_content="stesso inizio", metadata={"source": "a", "page": 0, CHUNK_ID_KEY: "x1"})
+    b = Document(page_content="stesso inizio", metadata={"source": "a", "page": 0, CHUNK_ID_KEY: "x2"})
+    a_bm25 = Document(page_content="stesso inizio", metadata=dict(a.metadata))
+    assert _doc_key(a) == "x1"
+    assert _doc_key(_doc("a", "testo")) == ("a", 0, "testo")  # senza ID: chiave di testo
+
+    fused = reciprocal_rank_fusion([("vector", [a, b]), ("bm25", [a_bm25])])
+    assert [(d.metadata[CHUNK_ID_KEY], arms) for d, _, arms in fused] == [
+        ("x1", ["bm25", "vector"]),
+        ("x2", ["vector"]),
+    ]
+
+
+def test_prepare_sources_dedups_repeated_text_and_traces_chunk_ids(responder):
+    from retrieval import CHUNK_ID_KEY
+
+    # Lo stesso articolo su due pagine ha due ID (con la pagina): nel contesto entra una volta.
+    docs = [
+        Document(page_content="art. 1", metadata={"source": "a.pdf", "page": 0, CHUNK_ID_KEY: "x1"}),
+        Document(page_content="art.  1", metadata={"source": "a.pdf", "page": 3, CHUNK_ID_KEY: "x2"}),
+        Document(page_content="art. 2", metadata={"source": "a.pdf", "page": 4, CHUNK_ID_KEY: "x3"}),
+    ]
+    sources = responder._prepare_sources(docs)
+    assert [(s.page, s.chunk_id) for s in sources] == [(0, "x1"), (4, "x3")]
@@ -0,0 +1,133 @@
+"""Test della cache delle varianti costanti (Ciclo 3 — FASE 4). Offline."""
+
+import json
+
+from rag_types import QueryIntent, RagTrace
+from retrieval import CHUNK_ID_KEY, hybrid_retrieve, is_constant_variant, run_vector_queries
+from variant_cache import VariantResultCache, build_variant_cache, constant_variants
+
+
+class _CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return [1.0, 0.0]
+
+
+class _Collection:
+    def __init__(self, rows):
+        self.rows = rows  # (id, testo, metadata, vettore)
+
+    def query(self, query_embeddings, n_results, include, where=None):
+        rows = self.rows[:n_results]
+        return {
+            "ids": [[r[0] for r in rows]],
+            "documents": [[r[1] for r in rows]],
+            "metadatas": [[r[2] for r in rows]],
+            "embeddings": [[r[3] for r in rows]],
+            "distances": [[0.0 for _ in rows]],
+        }
+
+
+class _FakeChroma:
+    def __init__(self, rows):
+        self._collection = _Collection(rows)
+        self._embedding_function = _CountingEmbeddings()
+
+    def get(self, ids=None, include=None):
+        rows = [r for r in self._collection.rows if ids is None or r[0] in ids]
+        return {
+            "ids": [r[0] for r in rows],
+            "documents": [r[1] for r in rows],
+            "metadatas": [r[2] for r in rows],
+            "embeddings": [r[3] for r in rows],
+        }
+
+
+_ROWS = [
+    (f"id-{i}", f"chunk {i}", {"source": f"s{i}.pdf", "page": i}, [1.0, float(i)])
+    for i in range(3)
+]
+
+
+def test_constant_variant_detection():
+    question = "posso immatricolarmi?"
+    assert not is_constant_variant(question, question)
+    assert not is_constant_variant(f"{question} informatica L-31 regolamento", question)
+    assert is_constant_variant("regolamento di accesso informatica L-31 TOLC-I OFA", question)
+
+
+def test_constant_variants_enumerates_fixed_expansions_only():
+    variants = [v for v, _ in constant_variants()]
+    assert "regolamento-di-accesso-informatical-31 TOLC OFA immatricolazione" in variants
+    assert "regolamento-tesi-2023 consultabile embargo deposito tesi" in variants
+    assert not any("\x00" in v for v in variants)
+    assert len(variants) == len(set(variants))
+
+
+def test_hybrid_retrieve_serves_constant_variants_from_cache():
+    vdb = _FakeChroma(_ROWS)
+    intent = QueryIntent("informatica", "accesso")
+    cache = VariantResultCache("firma")
+
+    first = hybrid_retrieve(vdb, None, "tolc?", intent, RagTrace(), use_bm25=False, variant_cache=cache)
+    assert len(cache) > 0
+
+    vdb._embedding_function.calls.clear()
+    trace = RagTrace()
+    second = hybrid_retrieve(vdb, None, "tolc?", intent, trace, use_bm25=False, variant_cache=cache)
+
+    assert [d.page_content for d in second] == [d.page_content for d in first]
+    # Solo le varianti che contengono la domanda raggiungono il vector store.
+    assert vdb._embedding_function.calls == [v for v in trace.query_variants if v.startswith("tolc?")]
+
+
+def test_build_variant_cache_persists_ids_under_manifest_signature(tmp_path):
+    path = tmp_path / "variant_cache.json"
+    vdb = _FakeChroma(_ROWS)
+
+    cache = build_variant_cache(vdb, {"documents": ["a"]}, path, k=2)
+    saved = json.loads(path.read_text(encoding="utf-8"))
+    assert saved["signature"] == cache.signature
+    assert len(saved["entries"]) == len(constant_variants())
+
+    # Stessa firma: ricostruita dagli ID, nessun nuovo embedding.
+    vdb._embedding_function.calls.clear()
+    reloaded = build_variant_cache(vdb, {"documents": ["a"]}, path, k=2)
+    assert vdb._embedding_function.calls == []
+    variant = constant_variants()[0][0]
+    docs, _ = reloaded.get(variant, 2)
+    assert [d.metadata[CHUNK_ID_KEY] for d in docs] == ["id-0", "id-1"]
+
+    # Modello delle query con un'altra precisione (UNILAW_QUANTIZE): si ricalcola.
+    int8 = build_variant_cache(vdb, {"documents": ["a"]}, path, k=2, model_key="modello|int8")
+    assert vdb._embedding_function.calls and int8.signature != cache.signature
+
+    # Firma diversa (PDF cambiati): la cache su disco viene ignorata e ricalcolata.
+    vdb._embedding_function.calls.clear()
+    build_variant_cache(vdb, {"documents": ["b"]}, path, k=2)
+    assert vdb._embedding_function.calls
+
+
+class _NoDocuments:
+    def select(self, query_vec, n, course_tags=None):
+        return []
+
+
+def test_two_stage_retrieval_bypasses_the_variant_cache():
+    vdb = _FakeChroma(_ROWS)
+    cache = VariantResultCache("firma")
+    variant = constant_variants()[0][0]
+    cache.put(variant, 2, None, [], False)  # calcolata sull'intero indice
+
+    docs = run_vector_queries(vdb, [variant], 2, variant_cache=cache, document_index=_NoDocuments())
+    assert [d.page_content for d in docs] == ["chunk 0", "chunk 1"]
+    assert vdb._embedding_function.calls == [variant] and cache.get(variant, 2) == ([], False)
+
+
+def test_build_variant_cache_without_manifest_is_empty(tmp_path):
+    cache = build_variant_cache(_FakeChroma(_ROWS), None, tmp_path / "vc.json", k=2)
+    assert len(cache) == 0
+    assert not (tmp_path / "vc.json").exists()
@@ -0,0 +1,180 @@
+"""Test dell'indice vettoriale piatto esatto (Ciclo 3 — FASE 11). Offline."""
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from retrieval import CHUNK_ID_KEY, EMBEDDING_KEY, _mmr_search_with_vectors, build_bm25_index, run_vector_queries
+from vector_store import FlatVectorStore, matches_where, vector_backend
+
+_VECTORS = {
+    "tolc informatica soglia": [1.0, 0.0, 0.0],
+    "ofa informatica recupero": [0.9, 0.1, 0.0],
+    "bando erasmus mobilità": [0.0, 1.0, 0.0],
+    "tesi relatore elaborato": [0.0, 0.0, 1.0],
+    "piano di studi cfu": [0.1, 0.0, 0.9],
+}
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        return [_VECTORS[t] for t in texts]
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return _VECTORS.get(text, [1.0, 0.0, 0.0])
+
+
+def _docs():
+    tags = ["informatica", "informatica", "generale", "informatica", "economia"]
+    return [
+        Document(page_content=text, metadata={"source": f"d{i}.pdf", "page": i, "course_tag": tag})
+        for i, (text, tag) in enumerate(zip(_VECTORS, tags))
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FlatVectorStore.build(_docs(), _Embeddings(), tmp_path / "flat")
+
+
+def test_build_persists_and_reopens_memory_mapped(tmp_path, store):
+    assert FlatVectorStore.exists(tmp_path / "flat")
+    reopened = FlatVectorStore.load(tmp_path / "flat", _Embeddings())
+    assert isinstance(reopened._vectors, np.memmap)
+    assert reopened.get()["documents"] == store.get()["documents"]
+    assert len(FlatVectorStore.load(tmp_path / "assente")) == 0
+
+
+def test_query_is_exact_l2_order_with_ids_and_vectors(store):
+    query = [0.8, 0.3, 0.0]
+    results = store.query(query, 3)
+    matrix = np.array(list(_VECTORS.values()))
+    expected = np.argsort(((matrix - np.array(query)) ** 2).sum(axis=1), kind="stable")[:3]
+    assert results["documents"] == [list(_VECTORS)[i] for i in expected]
+    assert results["ids"] == [f"flat-{i:06d}" for i in expected]
+    assert np.allclose(results["embeddings"][0], matrix[expected[0]])
+    assert results["distances"] == sorted(results["distances"])
+
+
+def test_where_filter_and_float16_storage(tmp_path):
+    store16 = FlatVectorStore.build(_docs(), _Embeddings(), tmp_path / "h", dtype="float16")
+    assert store16._vectors.dtype == np.float16
+    results = store16.query([1.0, 0.0, 0.0], 5, where={"course_tag": {"$in": ["generale", "economia"]}})
+    assert results["documents"] == ["piano di studi cfu", "bando erasmus mobilità"]
+
+    assert matches_where({"course_tag": "informatica"}, {"$or": [{"course_tag": "informatica"}, {"page": 9}]})
+    with pytest.raises(ValueError):
+        matches_where({"page": 1}, {"page": {"$gt": 0}})
+
+
+def test_get_mirrors_chroma_shape(store):
+    got = store.get(ids=["flat-000003", "mancante"], include=["documents", "embeddings"])
+    assert got["ids"] == ["flat-000003"]
+    assert got["documents"] == ["tesi relatore elaborato"]
+    assert got["metadatas"] is None
+    assert store.get(limit=2)["ids"] == ["flat-000000", "flat-000001"]
+
+
+def test_retrieval_uses_flat_backend_with_chunk_data(store):
+    assert vector_backend(store) is store
+    query_vectors = {}
+    docs = run_vector_queries(store, ["ofa informatica recupero"], k=2, query_vectors=query_vectors)
+    assert [d.page_content for d in docs] == ["ofa informatica recupero", "tolc informatica soglia"]
+    assert docs[0].metadata[CHUNK_ID_KEY] == "flat-000001"
+    assert docs[0].metadata[EMBEDDING_KEY].dtype == np.float32
+    assert "ofa informatica recupero" in query_vectors
+
+    index = build_bm25_index(store)
+    assert len(index) == 5
+    assert index.search("erasmus", 1)[0].metadata[CHUNK_ID_KEY] == "flat-000002"
+
+
+def test_langchain_compatible_search(store):
+    assert [d.page_content for d in store.similarity_search("tesi relatore elaborato", k=1)] == [
+        "tesi relatore elaborato"
+    ]
+    mmr = store.max_marginal_relevance_search("tolc informatica soglia", k=2, fetch_k=5)
+    assert mmr[0].page_content == "tolc informatica soglia"
+    assert len(mmr) == 2
+
+
+def test_mmr_returns_candidate_order_like_the_chroma_path(store):
+    # Qui l'MMR sceglie il quinto candidato prima del terzo.
+    query = "tesi relatore elaborato"
+    mmr = store.max_marginal_relevance_search(query, k=4, fetch_k=20)
+    reference = _mmr_search_with_vectors(store, query, 4, 20)
+    assert [d.page_content for d in mmr] == [d.page_content for d in reference]
+    assert [d.page_content for d in mmr] == [
+        "tesi relatore elaborato", "piano di studi cfu", "ofa informatica recupero", "bando erasmus mobilità"
+    ]
+
+
+# --- Ciclo 3 — FASE 13: vettori compatti e rescoring esatto --------------------
+
+def _clustered(n=600, dim=32, seed=0):
+    # Come gli embedding reali: poche direzioni portano quasi tutta la varianza.
+    rng = np.random.default_rng(seed)
+    latent = rng.normal(size=(n, 8)) * np.linspace(3.0, 1.0, 8)
+    return (latent @ rng.normal(size=(8, dim)) + 0.05 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def test_int8_compact_vectors_approximate_the_originals():
+    from vector_store import CompactVectors
+
+    vectors = _clustered()
+    compact = CompactVectors.fit(vectors, "int8")
+    assert compact.codes.dtype == np.int8
+    assert compact.nbytes * 4 == vectors.nbytes
+    assert np.abs(compact._decode(slice(None)) - vectors).max() < compact.scale.max()
+
+    reduced = CompactVectors.fit(vectors, "float16", pca_dim=8)
+    assert reduced.codes.shape == (600, 8)
+    with pytest.raises(ValueError):
+        CompactVectors.fit(vectors, "int4")
+
+
+@pytest.mark.parametrize("mode,pca_dim", [("int8", 0), ("float16", 0), ("int8", 16)])
+def test_compact_store_rescores_exactly(tmp_path, mode, pca_dim):
+    vectors = _clustered()
+    ids = [str(i) for i in range(len(vectors))]
+    exact = FlatVectorStore.from_vectors(tmp_path / "esatto", ids, [""] * 600, [{}] * 600, vectors)
+    FlatVectorStore.from_vectors(
+        tmp_path / mode, ids, [""] * 600, [{}] * 600, vectors, compact=mode, pca_dim=pca_dim
+    )
+    reopened = FlatVectorStore.load(tmp_path / mode)
+    assert reopened.compact is not None and reopened.compact.mode == mode
+
+    queries = vectors[::60] + 0.1 * np.random.default_rng(1).normal(size=(10, 32)).astype(np.float32)
+    for query in queries:
+        expected = exact.query(query, 5)
+        got = reopened.query(query, 5)
+        # I candidati del primo stadio contengono i veri vicini: stesso top-5, stesse distanze.
+        assert got["ids"] == expected["ids"]
+        assert np.allclose(got["distances"], expected["distances"], atol=1e-3)
+
+
+def test_build_keeps_content_ids_from_ingestion(tmp_path):
+    # Ciclo 3 — FASE 15: gli ID di contenuto assegnati da `database` sostituiscono quelli posizionali.
+    ids = [f"hash{i}" for i in range(5)]
+    store = FlatVectorStore.build(_docs(), _Embeddings(), tmp_path / "c", ids=ids)
+    assert store.query([0.0, 0.0, 1.0], 1)["ids"] == ["hash3"]
+    assert FlatVectorStore.load(tmp_path / "c").get(ids=["hash1"])["documents"] == ["ofa informatica recupero"]
+
+
+def test_batched_build_matches_single_build(tmp_path, store):
+    # Ciclo 3 — FASE 19: scrittura a lotti, stessi file dell'indice costruito in un colpo.
+    docs = _docs()
+    ids = [f"flat-{i:06d}" for i in range(len(docs))]
+    batches = [(ids[:2], docs[:2]), (ids[2:4], docs[2:4]), (ids[4:], docs[4:])]
+    batched = FlatVectorStore.build_batches(iter(batches), _Embeddings(), tmp_path / "lotti", compact="int8")
+    assert not (tmp_path / "lotti" / "vectors.npy.part").exists()
+    assert batched.get(include=["documents", "metadatas"]) == store.get(include=["documents", "metadatas"])
+    assert np.array_equal(np.asarray(batched._vectors), np.asarray(store._vectors))
+    assert np.allclose(batched._sq_norms, store._sq_norms)
+    assert batched.query([0.8, 0.3, 0.0], 3)["ids"] == store.query([0.8, 0.3, 0.0], 3)["ids"]
+
+    assert len(FlatVectorStore.build_batches(iter([]), _Embeddings(), tmp_path / "vuoto")) == 0
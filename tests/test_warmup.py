@@ -0,0 +1,62 @@
+"""Test del warm-up in background dei modelli (Ciclo 3 — FASE 8). Offline."""
+
+from neural_reranker import CrossEncoderReranker
+from semantic_intent import SemanticIntentClassifier
+from warmup import Warmup, start_warmup, warmup_steps
+
+
+def test_warmup_runs_steps_and_sets_ready():
+    calls = []
+    warmup = Warmup([("a", lambda: calls.append("a")), ("b", lambda: calls.append("b"))])
+    assert not warmup.ready
+    assert warmup.status() == "in corso (0/2)"
+
+    warmup.start()
+    assert warmup.wait(5)
+    assert calls == ["a", "b"]
+    assert warmup.completed == ["a", "b"]
+    assert warmup.status().startswith("pronto in")
+
+
+def test_warmup_failed_step_does_not_block_the_others():
+    def broken():
+        raise RuntimeError("modello assente")
+
+    warmup = Warmup([("rotto", broken), ("ok", lambda: None)])
+    warmup.run()
+    assert warmup.ready
+    assert warmup.completed == ["ok"]
+    assert warmup.failed == {"rotto": "modello assente"}
+    assert "non riusciti: rotto" in warmup.status()
+
+
+def test_warmup_steps_skip_disabled_components(responder):
+    responder.use_neural_reranker = False
+    responder.semantic_intent = None
+    responder.bm25_index = None
+    assert warmup_steps(responder) == []
+
+
+def test_start_warmup_preloads_enabled_models(responder):
+    scored = []
+    embedded = []
+
+    def scorer(question, docs):
+        scored.append(question)
+        return [0.0] * len(docs)
+
+    def embedder(texts):
+        embedded.extend(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+    responder.use_neural_reranker = True
+    responder.neural_reranker = CrossEncoderReranker("fake-model", scorer=scorer)
+    responder.semantic_intent = SemanticIntentClassifier(embedder=embedder)
+
+    warmup = start_warmup(responder)
+    assert responder.warmup is warmup
+    assert warmup.wait(5)
+    assert warmup.completed == ["cross-encoder", "anchor intent"]
+    assert scored == ["riscaldamento"]
+    assert embedded  # anchor incorporati prima della prima domanda
+    assert responder.neural_reranker.last_cache_hits == 0
@@ -34,6 +34,9 @@ def trace_to_dict(trace: Optional[RagTrace]) -> dict:
         "answer_profile": trace.answer_profile,
         "retrieval": {
             "mode": field("retrieval_mode"),
+            "prefilter": field("prefilter"),
+            "document_stage": field("document_stage"),
+            "candidate_budget": field("candidate_budget"),
             "query_variants": list(trace.query_variants or []),
             "fusion_scores": list(field("fusion_scores", []) or []),
             "reranker": field("reranker"),
@@ -41,8 +44,13 @@ def trace_to_dict(trace: Optional[RagTrace]) -> dict:
         "evidence": field("evidence_chars"),
         "grounding": field("grounding"),
         "abstention_reason": field("abstention_reason"),
+        "llm": {
+            "priority": field("llm_priority"),
+            "queue_wait_ms": field("llm_queue_wait_ms", None),
+        },
         "deterministic_rule_used": trace.deterministic_rule_used,
         "selected_sources": list(trace.selected_sources or []),
+        "selected_chunk_ids": list(field("selected_chunk_ids", []) or []),
         "rejected_after_rerank": list(trace.rejected_hint or []),
     }
 
@@ -85,6 +93,9 @@ def trace_to_markdown(trace: Optional[RagTrace]) -> str:
         "",
         "## Retrieval",
         f"- Modalità: `{retr['mode'] or 'n.d.'}`",
+        f"- Pre-filtro: `{retr['prefilter'] or 'nessuno'}`",
+        f"- Primo stadio (documenti): `{retr['document_stage'] or 'disattivato'}`",
+        f"- Budget candidati: `{retr['candidate_budget'] or 'nessun limite'}`",
         f"- Reranker: `{retr['reranker'] or 'n.d.'}`",
         f"- Evidence: `{data['evidence'] or 'n.d.'}`",
         "",
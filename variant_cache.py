@@ -0,0 +1,230 @@
+"""Cache dei risultati delle varianti di query costanti (Ciclo 3 — FASE 4).
+
+Molte delle varianti generate da `retrieval.build_query_variants` sono testi
+fissi che non contengono la domanda dell'utente (es. "regolamento di accesso
+informatica L-31 TOLC-I OFA Ris_Test tabella punteggio" o le espansioni
+Erasmus/borsa): a parità di indice il loro risultato MMR è sempre lo stesso, ma
+veniva ricalcolato (embedding + ricerca) a ogni domanda.
+
+Qui quelle varianti vengono enumerate e i loro risultati precalcolati al
+caricamento dell'indice. Su disco si salvano solo gli ID dei chunk, legati alla
+firma del manifest dell'indice: se i PDF cambiano la cache viene ignorata e
+ricalcolata. A runtime raggiungono il vector store solo le varianti che
+contengono il testo della domanda.
+
+I risultati dipendono anche dal modello che calcola i vettori delle query: la
+firma include nome e precisione del modello di embedding (`UNILAW_QUANTIZE`),
+così una cache calcolata in float non serve un processo int8, e viceversa.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from config import CHROMA_PERSIST_DIRECTORY, INDEX_MANIFEST_FILE, INDEX_READ_ONLY, VARIANT_CACHE_FILE
+from embedding_cache import embedding_model_key
+from index_generations import active_index_dir, store_index_dir, write_index_artifact
+from rag_types import QueryIntent
+from retrieval import (
+    CHUNK_ID_KEY,
+    _with_chunk_data,
+    build_query_variants,
+    is_constant_variant,
+    prefilter_course_tags,
+    run_vector_queries,
+)
+
+logger = logging.getLogger(__name__)
+
+_COURSES = [None, "informatica", "scienze_educazione", "amministrazione", "economia"]
+_TOPICS = [None, "accesso", "borsa", "erasmus", "tesi", "piano_studi", "calcolo"]
+
+# Domande segnaposto per enumerare le varianti fisse: la prima non contiene alcuna
+# parola chiave, la seconda attiva il ramo "consultabilità della tesi".
+_PLACEHOLDER_QUESTIONS = ["\x00", "\x00 consultazione"]
+
+
+def manifest_digest(manifest: dict | None) -> str | None:
+    """Impronta stabile della firma dei PDF (manifest dell'indice)."""
+    if not manifest:
+        return None
+    payload = json.dumps(manifest, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def constant_variants(prefilter: bool = False) -> list[tuple[str, list[str] | None]]:
+    """Enumera le varianti fisse e i corsi ammessi con cui vengono interrogate."""
+    seen = set()
+    variants = []
+
+    for course_tag in _COURSES:
+        for topic in _TOPICS:
+            intent = QueryIntent(course_tag, topic)
+            course_tags = prefilter_course_tags(intent) if prefilter else None
+            for question in _PLACEHOLDER_QUESTIONS:
+                for variant in build_query_variants(question, intent):
+                    key = (variant, tuple(course_tags or ()))
+                    if is_constant_variant(variant, question) and key not in seen:
+                        seen.add(key)
+                        variants.append((variant, course_tags))
+
+    return variants
+
+
+class VariantResultCache:
+    """Risultati dell'arm vettoriale per (variante, k, corsi ammessi).
+
+    Passata a `run_vector_queries`, che la consulta solo per le varianti
+    costanti e la riempie al primo calcolo.
+    """
+
+    def __init__(self, signature: str | None = None):
+        self.signature = signature
+        self._entries: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(variant: str, k: int, course_tags) -> str:
+        return f"{k}|{','.join(course_tags or [])}|{variant}"
+
+    def get(self, variant: str, k: int, course_tags=None):
+        """Coppia (documenti, fallback_usato) oppure None se assente."""
+        return self._entries.get(self._key(variant, k, course_tags))
+
+    def put(self, variant: str, k: int, course_tags, docs: list, fell_back: bool) -> None:
+        self._entries[self._key(variant, k, course_tags)] = (list(docs), fell_back)
+
+    def to_dict(self) -> dict:
+        """Forma serializzabile: solo gli ID dei chunk (i testi restano in ChromaDB)."""
+        return {
+            "signature": self.signature,
+            "entries": {
+                key: {
+                    "ids": [(d.metadata or {}).get(CHUNK_ID_KEY) for d in docs],
+                    "fallback": fell_back,
+                }
+                for key, (docs, fell_back) in self._entries.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, vector_db) -> "VariantResultCache":
+        """Ricostruisce i documenti con una sola lettura per ID dal vector store."""
+        cache = cls(data.get("signature"))
+        entries = data.get("entries") or {}
+
+        ids = sorted({i for entry in entries.values() for i in entry["ids"]})
+        if None in ids:
+            raise ValueError("voce di cache senza ID del chunk")
+        stored = vector_db.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+
+        embeddings = stored.get("embeddings")
+        if embeddings is None:
+            embeddings = [None] * len(stored["ids"])
+        by_id = {
+            chunk_id: _with_chunk_data(text, metadata, chunk_id, embedding)
+            for chunk_id, text, metadata, embedding in zip(
+                stored["ids"], stored["documents"], stored["metadatas"], embeddings
+            )
+        }
+
+        for key, entry in entries.items():
+            if any(i not in by_id for i in entry["ids"]):
+                raise ValueError(f"chunk mancante nell'indice per la voce {key!r}")
+            cache._entries[key] = ([by_id[i] for i in entry["ids"]], entry["fallback"])
+
+        return cache
+
+
+def build_variant_cache(
+    vector_db,
+    manifest: dict | None,
+    path: Path | None,
+    k: int,
+    prefilter: bool = False,
+    model_key: str | None = None,
+) -> VariantResultCache:
+    """Carica da disco o precalcola la cache delle varianti costanti.
+
+    La firma unisce il manifest e `model_key` (default: il modello di embedding
+    di questo processo, `embedding_model_key`). Se il file esiste ed è legato
+    alla stessa firma, i risultati
+    vengono ricostruiti dagli ID salvati; altrimenti si interroga il vector
+    store una volta per variante e si salva il risultato. Ogni errore è
+    gestito con un avviso: la cache resta vuota (o parziale) e le varianti
+    mancanti vengono calcolate a runtime come prima.
+    """
+    signature = manifest_digest(manifest)
+    if signature is not None:
+        signature = f"{signature}|{model_key or embedding_model_key()}"
+    cache = VariantResultCache(signature)
+
+    if signature is None or vector_db is None:
+        return cache
+
+    if path is not None and path.exists():
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+            if data.get("signature") == signature:
+                cache = VariantResultCache.from_dict(data, vector_db)
+        except Exception as exc:
+            logger.warning("Cache delle varianti non leggibile, si ricalcola: %s", exc)
+            cache = VariantResultCache(signature)
+
+    missing = [
+        (variant, course_tags)
+        for variant, course_tags in constant_variants(prefilter)
+        if cache.get(variant, k, course_tags) is None
+    ]
+    if not missing:
+        return cache
+
+    try:
+        for variant, course_tags in missing:
+            run_vector_queries(
+                vector_db, [variant], k, course_tags=course_tags, variant_cache=cache
+            )
+    except Exception as exc:
+        logger.warning("Precalcolo delle varianti interrotto: %s", exc)
+        return cache
+
+    # Ciclo 3 — FASE 22: un lettore non scrive mai nella generazione pubblicata.
+    if path is not None and not INDEX_READ_ONLY and all(
+        (d.metadata or {}).get(CHUNK_ID_KEY) for docs, _ in cache._entries.values() for d in docs
+    ):
+        data = json.dumps(cache.to_dict(), ensure_ascii=False).encode("utf-8")
+        try:
+            write_index_artifact(path, lambda fh: fh.write(data))
+        except Exception as exc:
+            logger.warning("Cache delle varianti non salvata: %s", exc)
+
+    return cache
+
+
+def variant_cache_path(index_dir: Path, prefilter: bool = False) -> Path:
+    name = VARIANT_CACHE_FILE if not prefilter else VARIANT_CACHE_FILE.replace(".json", "_prefilter.json")
+    return Path(index_dir) / name
+
+
+def load_index_variant_cache(
+    vector_db, k: int, prefilter: bool = False, index_dir: Path | None = None
+) -> VariantResultCache:
+    """Cache delle varianti per l'indice persistito in `index_dir`.
+
+    Legge la firma dal manifest dell'indice e salva la cache accanto ad esso.
+    Senza `index_dir` si usa la cartella da cui è stato aperto `vector_db`
+    (`store_index_dir`), altrimenti la generazione attiva (FASE 16). La cache è
+    costruita all'indicizzazione, prima della pubblicazione (FASE 22): qui di norma
+    si legge soltanto.
+    """
+    index_dir = Path(index_dir or store_index_dir(vector_db) or active_index_dir(CHROMA_PERSIST_DIRECTORY))
+    manifest = None
+    try:
+        manifest = json.loads((index_dir / INDEX_MANIFEST_FILE).read_text(encoding="utf-8"))
+    except Exception as exc:
+        logger.warning("Manifest non leggibile, cache delle varianti disattivata: %s", exc)
+
+    return build_variant_cache(vector_db, manifest, variant_cache_path(index_dir, prefilter), k, prefilter)
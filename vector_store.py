@@ -0,0 +1,575 @@
+"""Vector store intercambiabile: Chroma o indice piatto esatto in NumPy (Ciclo 3 — FASE 11).
+
+Il retrieval usa del vector store solo tre operazioni: l'embedder delle query,
+una ricerca per vettore (con filtro `where` sui metadata) che restituisce anche
+ID e vettori dei chunk, e la lettura dei chunk (`get`, per BM25 e per la cache
+delle varianti). `vector_backend` le espone in modo uniforme:
+
+- `ChromaBackend` adatta il wrapper LangChain `Chroma` (indice HNSW su SQLite);
+- `FlatVectorStore` tiene i vettori in una matrice float32/float16 su disco,
+  aperta in memory-map, e cerca in modo esatto con un solo prodotto matrice-vettore.
+
+Per un corpus di qualche migliaio di chunk la ricerca esatta costa meno del
+round-trip HNSW, l'avvio non apre SQLite e i risultati sono deterministici
+(parità sulla distanza: ordine per distanza L2 crescente, come la collezione
+Chroma di default; a pari distanza vince il chunk indicizzato prima).
+
+`FlatVectorStore` espone anche la parte dell'API LangChain usata nel resto del
+progetto (`get`, `similarity_search`, `max_marginal_relevance_search`,
+`_embedding_function`), così responder, warm-up e script di valutazione lo usano
+senza modifiche.
+
+Ciclo 3 — FASE 13: l'indice piatto può affiancare ai vettori completi una copia
+compatta (`CompactVectors`: float16 o int8 per dimensione, eventualmente dopo una
+PCA stimata in indicizzazione). La ricerca avviene allora in due stadi: candidati
+sui vettori compatti, poi punteggio esatto ricalcolato sui vettori completi, letti
+dal memory-map solo per le righe candidate.
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from config import FLAT_INDEX_RESCORE_FACTOR
+
+logger = logging.getLogger(__name__)
+
+QUERY_FIELDS = ("ids", "documents", "metadatas", "embeddings")
+
+# Righe copiate per blocco nella scrittura a lotti (Ciclo 3 — FASE 19): 8192 × 384
+# float32 = 12 MB.
+_WRITE_BLOCK = 8192
+
+
+class ChromaBackend:
+    """Ricerca per vettore sulla collezione di un `Chroma` LangChain."""
+
+    def __init__(self, vector_db):
+        self._collection = vector_db._collection
+        self._embedding_function = vector_db._embedding_function
+
+    def embed_query(self, text: str):
+        return self._embedding_function.embed_query(text)
+
+    def query(self, query_vec, n_results: int, where: dict | None = None) -> dict:
+        results = self._collection.query(
+            query_embeddings=[query_vec],
+            n_results=n_results,
+            where=where,
+            include=["metadatas", "documents", "distances", "embeddings"],
+        )
+        return {field: results[field][0] for field in QUERY_FIELDS}
+
+
+def vector_backend(vector_db):
+    """Backend di ricerca per vettore, o `None` se il vector store non ne offre.
+
+    `None` per i vector store finti dei test (solo API pubblica LangChain): il
+    retrieval ricade allora su `max_marginal_relevance_search`.
+    """
+    if isinstance(vector_db, FlatVectorStore):
+        return vector_db
+    if getattr(vector_db, "_collection", None) is None:
+        return None
+    if getattr(vector_db, "_embedding_function", None) is None:
+        return None
+    return ChromaBackend(vector_db)
+
+
+def matches_where(metadata: dict, where: dict | None) -> bool:
+    """Valuta il sottoinsieme di clausole `where` di Chroma usato dal progetto.
+
+    Uguaglianza semplice, `$eq`, `$ne`, `$in`, `$nin`, `$and`, `$or`.
+    """
+    if not where:
+        return True
+    metadata = metadata or {}
+    for field, condition in where.items():
+        if field == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, arg in condition.items():
+            if op == "$eq":
+                ok = value == arg
+            elif op == "$ne":
+                ok = value != arg
+            elif op == "$in":
+                ok = value in arg
+            elif op == "$nin":
+                ok = value not in arg
+            else:
+                raise ValueError(f"Operatore where non supportato dall'indice piatto: {op}")
+            if not ok:
+                return False
+    return True
+
+
+def _where_fields(where: dict) -> set:
+    """Campi dei metadata citati da una clausola `where` (anche dentro `$and`/`$or`)."""
+    fields = set()
+    for field, condition in where.items():
+        if field in {"$and", "$or"}:
+            for clause in condition:
+                fields |= _where_fields(clause)
+        else:
+            fields.add(field)
+    return fields
+
+
+def _top_rows(scores: np.ndarray, rows: np.ndarray, n: int) -> tuple:
+    """Righe (e punteggi) dei primi `n`; a pari punteggio vince la riga indicizzata prima."""
+    order = np.argsort(-scores, kind="stable")[:n]
+    return rows[order], scores[order]
+
+
+class CompactVectors:
+    """Copia compatta dei vettori per il primo stadio della ricerca (Ciclo 3 — FASE 13).
+
+    `mode` "float16" dimezza lo spazio; "int8" lo riduce di 4 volte con una
+    quantizzazione scalare per dimensione (x ≈ offset + scale · codice). Con
+    `components` i vettori sono prima proiettati sulle prime componenti PCA.
+    """
+
+    FILE = "compact.npz"
+    BLOCK_ROWS = 512
+
+    def __init__(self, mode, codes, scale=None, offset=None, mean=None, components=None):
+        self.mode = mode
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+        self.mean = mean
+        self.components = components
+        # Norme dei vettori decodificati, calcolate a blocchi (nessuna copia float32
+        # dell'intera matrice in memoria).
+        self.sq_norms = np.concatenate(
+            [
+                np.einsum("ij,ij->i", block, block)
+                for block in (
+                    self._decode(slice(i, i + self.BLOCK_ROWS))
+                    for i in range(0, len(codes), self.BLOCK_ROWS)
+                )
+            ]
+            or [np.zeros(0, dtype=np.float32)]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes)
+
+    @classmethod
+    def fit(cls, vectors, mode: str, pca_dim: int = 0) -> "CompactVectors":
+        if mode not in {"float16", "int8"}:
+            raise ValueError(f"Modalità compatta non supportata: {mode}")
+        vectors = np.asarray(vectors, dtype=np.float32)
+        mean = components = None
+        if 0 < pca_dim < vectors.shape[1]:
+            mean = vectors.mean(axis=0)
+            _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+            components = vt[:pca_dim].astype(np.float32)
+        reduced = cls._project(vectors, mean, components)
+
+        if mode == "float16":
+            return cls(mode, reduced.astype(np.float16), mean=mean, components=components)
+
+        low, high = reduced.min(axis=0), reduced.max(axis=0)
+        scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+        offset = (low + 128.0 * scale).astype(np.float32)
+        codes = np.clip(np.rint((reduced - offset) / scale), -128, 127).astype(np.int8)
+        return cls(mode, codes, scale, offset, mean, components)
+
+    @staticmethod
+    def _project(vectors, mean, components):
+        if components is None:
+            return vectors
+        return (vectors - mean) @ components.T
+
+    def _decode(self, rows) -> np.ndarray:
+        codes = np.asarray(self.codes[rows], dtype=np.float32)
+        return codes if self.scale is None else self.offset + self.scale * codes
+
+    def scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Punteggi L2 approssimati (2 q·x − ||x||²) delle righe `rows`."""
+        reduced = self._project(query, self.mean, self.components).astype(np.float32)
+        codes = self.codes if len(rows) == len(self.codes) else self.codes[rows]
+        if self.scale is None:
+            weights, bias = reduced, 0.0
+        else:
+            # q·x = q·offset + (q ∘ scale)·codice: il prodotto lavora sui codici int8.
+            weights, bias = reduced * self.scale, float(reduced @ self.offset)
+        # A blocchi di righe: la conversione a float32 resta nella cache della CPU
+        # invece di materializzare l'intera matrice decodificata.
+        dots = np.empty(len(codes), dtype=np.float32)
+        for i in range(0, len(codes), self.BLOCK_ROWS):
+            dots[i:i + self.BLOCK_ROWS] = codes[i:i + self.BLOCK_ROWS].astype(np.float32) @ weights
+        return 2.0 * (dots + bias) - self.sq_norms[rows]
+
+    def save(self, directory) -> None:
+        arrays = {"codes": self.codes}
+        for name in ("scale", "offset", "mean", "components"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        np.savez(Path(directory) / self.FILE, mode=np.array(self.mode), **arrays)
+
+    @classmethod
+    def load(cls, directory) -> "CompactVectors | None":
+        path = Path(directory) / cls.FILE
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return cls(
+                str(data["mode"]),
+                data["codes"],
+                **{name: data[name] for name in ("scale", "offset", "mean", "components") if name in data},
+            )
+
+
+class FlatVectorStore:
+    """Indice vettoriale piatto: matrice in memory-map + ricerca esatta.
+
+    Su disco, in `directory`: `vectors.npy` (una riga per chunk, float32 o
+    float16), `chunks.json` (ID, testi e metadata nello stesso ordine),
+    `sq_norms.npy` (norme al quadrato) e, se attiva, la copia compatta
+    (`compact.npz`, FASE 13).
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    CHUNKS_FILE = "chunks.json"
+    NORMS_FILE = "sq_norms.npy"
+
+    def __init__(
+        self,
+        ids,
+        texts,
+        metadatas,
+        vectors,
+        embedding_function=None,
+        compact: CompactVectors | None = None,
+        sq_norms=None,
+        rescore_factor: int = FLAT_INDEX_RESCORE_FACTOR,
+        directory=None,
+    ):
+        self.directory = Path(directory) if directory is not None else None
+        self._ids = list(ids)
+        self._texts = list(texts)
+        self._metadatas = [dict(m or {}) for m in metadatas]
+        self._vectors = vectors
+        self._embedding_function = embedding_function
+        self._row_by_id = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        # Righe raggruppate per valori dei campi usati nei `where` (Ciclo 3 — FASE 14).
+        self._row_groups: dict = {}
+        self.compact = compact
+        self.rescore_factor = rescore_factor
+        # Norme al quadrato precalcolate: ||q - d||² = ||q||² + ||d||² - 2 q·d,
+        # quindi l'ordinamento L2 richiede solo il prodotto matrice-vettore.
+        if sq_norms is None:
+            sq_norms = (
+                np.einsum("ij,ij->i", vectors, vectors, dtype=np.float32)
+                if len(self._ids)
+                else np.zeros(0, dtype=np.float32)
+            )
+        self._sq_norms = sq_norms
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def footprint(self) -> dict:
+        """Byte dei vettori completi e della copia compatta (0 se assente)."""
+        return {
+            "full_bytes": int(self._vectors.nbytes),
+            "compact_bytes": self.compact.nbytes if self.compact is not None else 0,
+        }
+
+    # --- persistenza ----------------------------------------------------------
+
+    @classmethod
+    def exists(cls, directory) -> bool:
+        directory = Path(directory)
+        return (directory / cls.VECTORS_FILE).exists() and (directory / cls.CHUNKS_FILE).exists()
+
+    @classmethod
+    def build(
+        cls,
+        documents,
+        embedding_function,
+        directory,
+        dtype: str = "float32",
+        compact: str = "",
+        pca_dim: int = 0,
+        ids=None,
+    ):
+        """Incorpora i chunk, scrive l'indice in `directory` e lo riapre in memory-map.
+
+        `ids` (Ciclo 3 — FASE 15): ID di contenuto assegnati all'indicizzazione; in
+        assenza, ID posizionali `flat-000123`.
+        """
+        texts = [doc.page_content for doc in documents]
+        return cls.from_vectors(
+            directory,
+            list(ids) if ids is not None else [f"flat-{i:06d}" for i in range(len(texts))],
+            texts,
+            [doc.metadata or {} for doc in documents],
+            embedding_function.embed_documents(texts),
+            embedding_function,
+            dtype=dtype,
+            compact=compact,
+            pca_dim=pca_dim,
+        )
+
+    @classmethod
+    def from_vectors(
+        cls,
+        directory,
+        ids,
+        texts,
+        metadatas,
+        vectors,
+        embedding_function=None,
+        dtype: str = "float32",
+        compact: str = "",
+        pca_dim: int = 0,
+    ):
+        """Scrive un indice da vettori già calcolati (anche per i benchmark) e lo riapre."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        vectors = np.asarray(vectors, dtype=dtype)
+        np.save(directory / cls.VECTORS_FILE, vectors)
+        cls._write_sidecars(directory, ids, texts, metadatas, vectors, compact, pca_dim)
+        return cls.load(directory, embedding_function)
+
+    @classmethod
+    def build_batches(
+        cls,
+        batches,
+        embedding_function,
+        directory,
+        dtype: str = "float32",
+        compact: str = "",
+        pca_dim: int = 0,
+    ):
+        """Come `build`, ma un lotto `(ids, documenti)` alla volta (Ciclo 3 — FASE 19).
+
+        I vettori di ogni lotto vengono accodati a un file grezzo e poi copiati a
+        blocchi in `vectors.npy`: in memoria restano il lotto corrente, i testi e i
+        metadata (che `load` rilegge comunque per intero), non la matrice completa.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        part = directory / f"{cls.VECTORS_FILE}.part"
+        ids, texts, metadatas = [], [], []
+        dim = 0
+        with open(part, "wb") as fh:
+            for batch_ids, documents in batches:
+                batch_texts = [doc.page_content for doc in documents]
+                vectors = np.asarray(embedding_function.embed_documents(batch_texts), dtype=dtype)
+                fh.write(vectors.tobytes())
+                dim = vectors.shape[1]
+                ids.extend(batch_ids)
+                texts.extend(batch_texts)
+                metadatas.extend(doc.metadata or {} for doc in documents)
+
+        if not ids:
+            part.unlink()
+            return cls.from_vectors(directory, [], [], [], np.zeros((0, 0)), embedding_function, dtype)
+
+        raw = np.memmap(part, dtype=dtype, mode="r", shape=(len(ids), dim))
+        vectors = np.lib.format.open_memmap(
+            directory / cls.VECTORS_FILE, mode="w+", dtype=dtype, shape=raw.shape
+        )
+        for start in range(0, len(ids), _WRITE_BLOCK):
+            vectors[start:start + _WRITE_BLOCK] = raw[start:start + _WRITE_BLOCK]
+        vectors.flush()
+        cls._write_sidecars(directory, ids, texts, metadatas, vectors, compact, pca_dim)
+        del raw, vectors
+        part.unlink()
+        return cls.load(directory, embedding_function)
+
+    @classmethod
+    def _write_sidecars(cls, directory, ids, texts, metadatas, vectors, compact, pca_dim) -> None:
+        # Norme al quadrato, copia compatta e `chunks.json` accanto a `vectors.npy`.
+        norms = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), _WRITE_BLOCK):
+            block = np.asarray(vectors[start:start + _WRITE_BLOCK])
+            norms[start:start + _WRITE_BLOCK] = np.einsum("ij,ij->i", block, block, dtype=np.float32)
+        np.save(directory / cls.NORMS_FILE, norms)
+        if compact:
+            CompactVectors.fit(vectors, compact, pca_dim).save(directory)
+        chunks = {
+            "ids": list(ids),
+            "documents": list(texts),
+            "metadatas": list(metadatas),
+            "dtype": str(vectors.dtype),
+        }
+        (directory / cls.CHUNKS_FILE).write_text(json.dumps(chunks, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory, embedding_function=None, mmap: bool = True):
+        """Apre l'indice persistito; indice vuoto se i file mancano (rebuild a carico del chiamante)."""
+        directory = Path(directory)
+        if not cls.exists(directory):
+            return cls([], [], [], np.zeros((0, 0), dtype=np.float32), embedding_function)
+
+        chunks = json.loads((directory / cls.CHUNKS_FILE).read_text(encoding="utf-8"))
+        vectors = np.load(directory / cls.VECTORS_FILE, mmap_mode="r" if mmap else None)
+        norms_path = directory / cls.NORMS_FILE
+        return cls(
+            chunks["ids"],
+            chunks["documents"],
+            chunks["metadatas"],
+            vectors,
+            embedding_function,
+            compact=CompactVectors.load(directory),
+            sq_norms=np.load(norms_path) if norms_path.exists() else None,
+            directory=directory,
+        )
+
+    def update_metadatas(self, updates: dict) -> None:
+        """Unisce `updates[id]` ai metadata dei chunk e riscrive `chunks.json`.
+
+        Stessa semantica di `collection.update(metadatas=...)` di Chroma: le chiavi
+        date sostituiscono o si aggiungono, le altre restano (Ciclo 3 — FASE 20).
+        """
+        for chunk_id, metadata in updates.items():
+            row = self._row_by_id.get(chunk_id)
+            if row is not None:
+                self._metadatas[row].update(metadata)
+        self._row_groups.clear()
+        if self.directory is None:
+            return
+        path = self.directory / self.CHUNKS_FILE
+        chunks = json.loads(path.read_text(encoding="utf-8"))
+        chunks["metadatas"] = self._metadatas
+        path.write_text(json.dumps(chunks, ensure_ascii=False), encoding="utf-8")
+
+    # --- backend di ricerca (vedi `vector_backend`) -----------------------------
+
+    def embed_query(self, text: str):
+        return self._embedding_function.embed_query(text)
+
+    def _rows(self, where: dict | None) -> np.ndarray:
+        """Righe che soddisfano `where`, in ordine di indice.
+
+        Le righe sono raggruppate (una volta per insieme di campi) per i valori dei
+        campi citati dal filtro: la clausola si valuta una volta per combinazione
+        distinta (es. per PDF con il `where` su `source` del retrieval a due stadi),
+        non una volta per chunk.
+        """
+        if not where:
+            return np.arange(len(self._ids))
+        fields = tuple(sorted(_where_fields(where)))
+        groups = self._row_groups.get(fields)
+        if groups is None:
+            grouped: dict = {}
+            for i, metadata in enumerate(self._metadatas):
+                grouped.setdefault(tuple(metadata.get(f) for f in fields), []).append(i)
+            groups = {values: np.array(rows, dtype=np.int64) for values, rows in grouped.items()}
+            self._row_groups[fields] = groups
+        matched = [
+            rows for values, rows in groups.items() if matches_where(dict(zip(fields, values)), where)
+        ]
+        return np.sort(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+
+    def _exact_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        vectors = self._vectors if len(rows) == len(self._ids) else self._vectors[rows]
+        return 2.0 * (vectors @ query) - self._sq_norms[rows]
+
+    def query(self, query_vec, n_results: int, where: dict | None = None) -> dict:
+        """Primi `n_results` chunk per distanza L2 esatta, con ID e vettori.
+
+        Con la copia compatta, il punteggio esatto è calcolato solo sui
+        `n_results × rescore_factor` candidati migliori del primo stadio.
+        """
+        rows = self._rows(where)
+        if not len(rows):
+            return {field: [] for field in QUERY_FIELDS} | {"distances": []}
+
+        query = np.asarray(query_vec, dtype=np.float32)
+        candidates = n_results * max(1, self.rescore_factor)
+        if self.compact is not None and len(rows) > candidates:
+            rows, _ = _top_rows(self.compact.scores(query, rows), rows, candidates)
+            rows = np.sort(rows)  # lettura sequenziale del memory-map e stesso ordine a pari punteggio
+        chosen, scores = _top_rows(self._exact_scores(query, rows), rows, n_results)
+
+        return {
+            "ids": [self._ids[i] for i in chosen],
+            "documents": [self._texts[i] for i in chosen],
+            "metadatas": [dict(self._metadatas[i]) for i in chosen],
+            "embeddings": [np.asarray(self._vectors[i], dtype=np.float32) for i in chosen],
+            "distances": (float(query @ query) - scores).tolist(),
+        }
+
+    # --- API compatibile con LangChain `Chroma` ---------------------------------
+
+    def get(self, ids=None, where=None, limit=None, include=None) -> dict:
+        include = include if include is not None else ["documents", "metadatas"]
+        if ids is not None:
+            rows = [self._row_by_id[i] for i in ids if i in self._row_by_id]
+        else:
+            rows = [int(i) for i in self._rows(where)]
+        if where is not None and ids is not None:
+            rows = [i for i in rows if matches_where(self._metadatas[i], where)]
+        if limit is not None:
+            rows = rows[:limit]
+
+        return {
+            "ids": [self._ids[i] for i in rows],
+            "documents": [self._texts[i] for i in rows] if "documents" in include else None,
+            "metadatas": [dict(self._metadatas[i]) for i in rows] if "metadatas" in include else None,
+            "embeddings": (
+                [np.asarray(self._vectors[i], dtype=np.float32) for i in rows]
+                if "embeddings" in include
+                else None
+            ),
+        }
+
+    def _documents(self, results: dict) -> list:
+        return [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(results["documents"], results["metadatas"])
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: dict | None = None, **kwargs) -> list:
+        return self._documents(self.query(self.embed_query(query), k, filter))
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: dict | None = None,
+        **kwargs,
+    ) -> list:
+        query_vec = self.embed_query(query)
+        results = self.query(query_vec, fetch_k, filter)
+        if not results["embeddings"]:
+            return []
+        selected = set(
+            maximal_marginal_relevance(
+                np.asarray(query_vec, dtype=np.float32),
+                results["embeddings"],
+                k=k,
+                lambda_mult=lambda_mult,
+            )
+        )
+        # Ordine dei candidati (per distanza), non di selezione: come Chroma e
+        # `retrieval._mmr_search_with_vectors`.
+        return [doc for i, doc in enumerate(self._documents(results)) if i in selected]
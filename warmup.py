@@ -0,0 +1,103 @@
+"""Riscaldamento in background dei modelli all'avvio (Ciclo 3 — FASE 8).
+
+Dopo un riavvio la prima domanda pagava tutti i caricamenti pigri: il primo
+`embed_query` (inizializzazione di torch), il caricamento del cross-encoder in
+`CrossEncoderReranker._ensure_model` e l'embedding degli anchor del
+classificatore d'intento semantico. Qui quei passi vengono eseguiti in un thread
+daemon subito dopo la creazione del responder, così la prima richiesta reale
+trova i modelli già pronti.
+
+Si riscalda solo ciò che è abilitato (reranker, intent semantico): nessun modello
+opzionale viene caricato se la relativa opzione è spenta. Un passo che fallisce
+viene registrato e saltato; lo stato è esposto da `Warmup.ready`.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+WARMUP_TEXT = "riscaldamento del modello"
+
+
+class Warmup:
+    """Esegue i passi di riscaldamento in un thread e ne espone lo stato."""
+
+    def __init__(self, steps: list[tuple[str, Callable[[], object]]]):
+        self._steps = list(steps)
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.completed: list[str] = []
+        self.failed: dict[str, str] = {}
+        self.elapsed: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        """True quando tutti i passi sono terminati (con o senza errori)."""
+        return self._ready.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start(self) -> "Warmup":
+        self._thread = threading.Thread(target=self.run, name="unilaw-warmup", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            for name, step in self._steps:
+                try:
+                    step()
+                    self.completed.append(name)
+                except Exception as exc:
+                    logger.warning("Warm-up '%s' non riuscito: %s", name, exc)
+                    self.failed[name] = str(exc)
+        finally:
+            self.elapsed = time.perf_counter() - t0
+            self._ready.set()
+            logger.info(
+                "Warm-up completato in %.1f s: %s",
+                self.elapsed,
+                ", ".join(self.completed) or "nessun passo",
+            )
+
+    def status(self) -> str:
+        """Stato leggibile, per la UI e i log."""
+        if not self.ready:
+            return f"in corso ({len(self.completed) + len(self.failed)}/{len(self._steps)})"
+        text = f"pronto in {self.elapsed:.1f} s"
+        if self.failed:
+            text += f" (non riusciti: {', '.join(self.failed)})"
+        return text
+
+
+def warmup_steps(responder) -> list[tuple[str, Callable[[], object]]]:
+    """Passi di riscaldamento per le componenti abilitate del responder."""
+    steps = []
+
+    embedding_function = getattr(responder.vector_db, "_embedding_function", None)
+    embed_query = getattr(embedding_function, "embed_query", None)
+    if callable(embed_query):
+        steps.append(("embedding", lambda: embed_query(WARMUP_TEXT)))
+
+    if responder.use_neural_reranker:
+        steps.append(("cross-encoder", responder.neural_reranker.warm_up))
+
+    if responder.semantic_intent is not None:
+        steps.append(("anchor intent", responder.semantic_intent.warm_up))
+
+    if responder.bm25_index is not None:
+        steps.append(("bm25", lambda: responder.bm25_index.search(WARMUP_TEXT, 1)))
+
+    return steps
+
+
+def start_warmup(responder) -> Warmup:
+    """Avvia il riscaldamento in background e lo collega al responder."""
+    warmup = Warmup(warmup_steps(responder))
+    responder.warmup = warmup
+    return warmup.start()